@@ -10,6 +10,9 @@ from .routes.admin_routes import admin_bp
 from .routes.upload_routes import upload_bp 
 from .routes.dashboard_routes import dashboard_bp
 from .routes.scenario_routes import scenario_bp
+from .routes.export_routes import export_bp
+from .utils.refresco import iniciar_refresco
+from .utils.limites import iniciar_limites
 
 
 
@@ -44,7 +47,13 @@ def create_app():
     app.register_blueprint(upload_bp)
     app.register_blueprint(dashboard_bp)
     app.register_blueprint(scenario_bp)
+    app.register_blueprint(export_bp)
 
+    # statement_timeout por clase de endpoint y errores de tiempo agotado (504)
+    iniciar_limites(app)
+
+    # Precalcula los items de dashboard que tienen refresh_interval
+    iniciar_refresco(app)
 
     
     return app
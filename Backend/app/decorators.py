@@ -1,5 +1,7 @@
 from functools import wraps
 import os
+import json
+import base64
 from flask_jwt_extended import verify_jwt_in_request, get_jwt
 from flask import jsonify
 import pandas as pd
@@ -9,6 +11,9 @@ from sqlalchemy import text
 import decimal
 from datetime import timedelta, datetime, date
 from prophet import Prophet
+from app.utils.consultas import (
+    columnas_tabla, construir_select, parsear_orden, sql_orden, condicion_keyset
+)
 
 
 def admin_required(fn):
@@ -22,12 +27,19 @@ def admin_required(fn):
     return wrapper
 
 
-def obtener_datos(tabla, limit=10, offset=0):
+def obtener_datos(tabla, limit=10, offset=0, columnas=None, orden=None, filtros=None):
     """
     Devuelve filas y columnas de la tabla con paginación.
+    Opcionalmente con proyección de columnas, orden ('col,-col') y filtros,
+    validados contra el esquema y compilados a SQL parametrizado.
     """
-    sql = text(f'SELECT * FROM "{tabla}" ORDER BY id LIMIT :limit OFFSET :offset')
-    result = db.session.execute(sql, {"limit": limit, "offset": offset})
+    if not (columnas or orden or filtros):
+        sql = text(f'SELECT * FROM "{tabla}" ORDER BY id LIMIT :limit OFFSET :offset')
+        result = db.session.execute(sql, {"limit": limit, "offset": offset})
+    else:
+        consulta, params, _, tipos = construir_select(tabla, columnas, filtros)
+        consulta += f' ORDER BY {sql_orden(parsear_orden(orden, tipos))} LIMIT :limit OFFSET :offset'
+        result = db.session.execute(text(consulta), {**params, "limit": limit, "offset": offset})
 
     # Filas como listas
     filas = [list(row) for row in result.fetchall()]
@@ -37,6 +49,83 @@ def obtener_datos(tabla, limit=10, offset=0):
     return filas, columnas  # filas primero, columnas después
 
 
+def codificar_cursor(direccion, claves):
+    """Token opaco para paginación por keyset: dirección + valores de la clave"""
+    crudo = json.dumps({"d": direccion, "k": claves}, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(crudo.encode()).decode().rstrip('=')
+
+
+def decodificar_cursor(token):
+    try:
+        relleno = '=' * (-len(token) % 4)
+        datos = json.loads(base64.urlsafe_b64decode(token + relleno))
+        if datos["d"] not in ("next", "prev") or not isinstance(datos["k"], list):
+            raise ValueError
+        return datos["d"], datos["k"]
+    except Exception:
+        raise ValueError("Cursor inválido")
+
+
+def obtener_datos_cursor(tabla, limit=10, cursor=None, columnas=None, orden=None, filtros=None):
+    """
+    Paginación por keyset: por defecto sobre la columna id oculta
+    (WHERE id > :ultimo_id); con `orden` el cursor guarda los valores de las
+    columnas de orden más el id. Cada página cuesta lo mismo sin importar lo
+    lejos que esté. Devuelve filas, columnas y los cursores {"siguiente", "anterior"}.
+    """
+    direccion, valores = decodificar_cursor(cursor) if cursor else ("next", None)
+
+    claves = parsear_orden(orden, columnas_tabla(tabla))
+    condiciones = [condicion_keyset(claves, valores, direccion)] if valores is not None else []
+
+    # Las columnas de orden hacen falta para armar el cursor aunque no se proyecten
+    consulta, params, seleccion, _ = construir_select(
+        tabla, columnas, filtros, extra=[c for c, _ in claves], condiciones=condiciones
+    )
+    consulta += f' ORDER BY {sql_orden(claves, invertir=direccion == "prev")} LIMIT :limit'
+    params["limit"] = limit + 1
+
+    result = db.session.execute(text(consulta), params)
+    filas = [list(row) for row in result.fetchall()]
+    todas = list(result.keys())
+
+    # Se pide una fila de más para saber si hay otra página en esa dirección
+    hay_mas = len(filas) > limit
+    filas = filas[:limit]
+    if direccion == "prev":
+        filas.reverse()
+
+    posiciones = [todas.index(c) for c, _ in claves]
+    cursores = {"siguiente": None, "anterior": None}
+    if filas:
+        if hay_mas or direccion == "prev":
+            cursores["siguiente"] = codificar_cursor("next", [filas[-1][p] for p in posiciones])
+        if (hay_mas and direccion == "prev") or (direccion == "next" and valores is not None):
+            cursores["anterior"] = codificar_cursor("prev", [filas[0][p] for p in posiciones])
+
+    ancho = len(seleccion)
+    return [fila[:ancho] for fila in filas], seleccion, cursores
+
+
+def paginar_modelo(query, columna_id, limit=50, cursor=None):
+    """
+    Keyset sobre un query ORM: ORDER BY id, WHERE id > :ultimo_id.
+    Devuelve los objetos de la página y el cursor {"siguiente"} (None al final).
+    """
+    if cursor:
+        direccion, valores = decodificar_cursor(cursor)
+        if direccion != "next" or len(valores) != 1:
+            raise ValueError("Cursor inválido")
+        query = query.filter(columna_id > int(valores[0]))
+
+    objetos = query.order_by(columna_id).limit(limit + 1).all()
+    siguiente = None
+    if len(objetos) > limit:
+        objetos = objetos[:limit]
+        siguiente = codificar_cursor("next", [getattr(objetos[-1], columna_id.key)])
+    return objetos, {"siguiente": siguiente}
+
+
 def compare_scenarios(scenario_a, scenario_b):
     """Analiza diferencias entre dos conjuntos de datos con métricas más detalladas"""
     df_a = pd.DataFrame(scenario_a)
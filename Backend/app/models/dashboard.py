@@ -80,4 +80,39 @@ class DashboardItem(db.Model):
             "refresh_interval": self.refresh_interval,
             "last_refresh": self.last_refresh.isoformat() if self.last_refresh else None
         }
-    meta_tabla = db.relationship("MetaTabla")  
\ No newline at end of file
+    meta_tabla = db.relationship("MetaTabla")  
+
+
+class ResultadoItem(db.Model):
+    """Último resultado precalculado de un item con refresh_interval"""
+    __tablename__ = 'dashboard_item_resultados'
+
+    item_id = db.Column(
+        db.Integer, db.ForeignKey('dashboard_items.id', ondelete='CASCADE'), primary_key=True
+    )
+    datos = db.Column(db.JSON)
+    error = db.Column(db.Text)
+    # Versión de la tabla (MetaTabla.version) con la que se calculó
+    version_tabla = db.Column(db.Integer, nullable=False, default=0)
+    calculado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    ms = db.Column(db.Float)
+
+
+class Rollup(db.Model):
+    """
+    Vista materializada con un GROUP BY usado por los items de dashboard:
+    por grupo guarda COUNT(*), COUNT(y), SUM(y), MIN(y) y MAX(y).
+    """
+    __tablename__ = 'rollups'
+    __table_args__ = (db.UniqueConstraint('tabla_id', 'columna_x', 'columna_y', 'nivel'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    tabla_id = db.Column(db.Integer, db.ForeignKey('meta_tabla.id', ondelete='CASCADE'), nullable=False)
+    # '' = sin agrupar (KPI); nivel 'hour' = x temporal truncado a la hora
+    columna_x = db.Column(db.String(100), nullable=False, default='')
+    columna_y = db.Column(db.String(100), nullable=False)
+    nivel = db.Column(db.String(20), nullable=False, default='')
+    vista = db.Column(db.String(63), unique=True, nullable=False)
+    # MetaTabla.version con la que se refrescó por última vez (-1 = nunca)
+    version_tabla = db.Column(db.Integer, nullable=False, default=-1)
+    creado_en = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
@@ -43,11 +43,13 @@ class Scenario(db.Model):
     scenario_type = db.Column(db.String(50), default="base", nullable=False)
     config = db.Column(db.JSON, default={})  # columnas y filtros seleccionados
     data_snapshot = db.Column(db.JSON)       # opcional: snapshot de los datos
+    # Calculado en SQL: los listados lo usan sin traer el snapshot (defer)
+    has_snapshot = db.column_property(data_snapshot.isnot(None))
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
 
-    def to_dict(self):
-        return {
+    def to_dict(self, summary=False):
+        data = {
             "id": self.id,
             "comparison_id": self.comparison_id,
             "name": self.name,
@@ -56,7 +58,11 @@ class Scenario(db.Model):
             "source_id": self.source_id,
             "scenario_type": self.scenario_type,
             "config": self.config,
-            "data_snapshot": self.data_snapshot,
+            "has_snapshot": self.has_snapshot,
             "created_at": self.created_at.isoformat() if self.created_at else None,
             "updated_at": self.updated_at.isoformat() if self.updated_at else None,
         }
+        # El resumen no toca data_snapshot: con defer() no se carga
+        if not summary:
+            data["data_snapshot"] = self.data_snapshot
+        return data
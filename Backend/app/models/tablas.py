@@ -1,8 +1,22 @@
 from app.extensions import db
 from sqlalchemy import text
+import io
+from itertools import islice
 import pandas as pd
 import numpy as np
+import pyarrow as pa
+from pyarrow import csv as pa_csv
 from app.decorators import obtener_datos
+from app.utils.tipos import (
+    crear_enum, nombre_enum, sql_tipo, convertir_bloque, esquema_tabla, invalidar_esquema,
+    invalidar_al_terminar
+)
+from app.utils.cache import descartar_tabla
+
+
+def normalizar_columnas(columnas):
+    """Normaliza los nombres de columnas (minúsculas, sin espacios ni tildes en 'ó')"""
+    return [str(col).lower().replace(' ', '_').replace('ó', 'o') for col in columnas]
 
 
 def tabla_existe(nombre_tabla):
@@ -18,14 +32,19 @@ def tabla_existe(nombre_tabla):
     resultado = db.session.execute(query, {'tabla': nombre_tabla.lower()}).scalar()
     return resultado
 
-def crear_tabla_dinamica(tabla, df):
+def crear_tabla_dinamica(tabla, df, tipos=None):
+    """
+    Crea la tabla física. Si se pasan `tipos` (ver app.utils.tipos.inferir_tipos)
+    se usan esos tipos y se crean los ENUM necesarios; si no, se mapean los
+    dtypes de pandas.
+    """
     # Verificar primero si la tabla existe
     if tabla_existe(tabla):
         return False, f"La tabla '{tabla}' ya existe. No se realizaron cambios."
     
     try:
         # Normalizar nombres de columnas
-        df.columns = [col.lower().replace(' ', '_').replace('ó', 'o') for col in df.columns]
+        df.columns = normalizar_columnas(df.columns)
         
         # Mapeo de tipos
         tipo_map = {
@@ -39,12 +58,19 @@ def crear_tabla_dinamica(tabla, df):
         # Generar definiciones de columnas
         column_defs = ['id SERIAL PRIMARY KEY']  # columna id oculta
         for col, dtype in df.dtypes.items():
-            pg_type = tipo_map.get(str(dtype), 'TEXT')
+            if tipos and col in tipos:
+                tipo = tipos[col]
+                if tipo.es_enum:
+                    crear_enum(nombre_enum(tabla, col), tipo.valores)
+                pg_type = sql_tipo(tabla, col, tipo)
+            else:
+                pg_type = tipo_map.get(str(dtype), 'TEXT')
             column_defs.append(f'"{col}" {pg_type}')
         
         sql = f'CREATE TABLE {tabla} ({", ".join(column_defs)})'
         db.session.execute(text(sql))
         db.session.commit()
+        invalidar_esquema(tabla)
         
         return True, f"Tabla '{tabla}' creada exitosamente."
     
@@ -53,12 +79,49 @@ def crear_tabla_dinamica(tabla, df):
         return False, f"Error al crear tabla: {str(e)}"
 
 
+def eliminar_tabla_fisica(tabla):
+    """
+    DROP TABLE junto con los tipos ENUM creados para sus columnas.
+    No hace commit.
+    """
+    # rollups importa MetaTabla de este módulo: se importa aquí para no crear un ciclo
+    from app.utils.rollups import eliminar_rollups
+
+    enums = db.session.execute(text("""
+        SELECT DISTINCT t.typname
+        FROM pg_attribute a
+        JOIN pg_type t ON t.oid = a.atttypid
+        WHERE a.attrelid = to_regclass(:tabla)
+          AND a.attnum > 0
+          AND t.typtype = 'e'
+          AND t.typname LIKE 'enum\\_%'
+    """), {"tabla": f'"{tabla}"'}).scalars().all()
+
+    eliminar_rollups(tabla)
+    db.session.execute(text(f'DROP TABLE IF EXISTS "{tabla}"'))
+    for enum in enums:
+        db.session.execute(text(f'DROP TYPE IF EXISTS "{enum}"'))
+    incrementar_version(tabla)
+    invalidar_al_terminar(tabla)
+    descartar_tabla(tabla)
+
+
+def incrementar_version(tabla):
+    """
+    Marca la tabla como modificada: los resultados cacheados con la versión
+    anterior dejan de usarse. Va en la misma transacción que la escritura.
+    """
+    db.session.execute(
+        text("UPDATE meta_tabla SET version = version + 1 WHERE nombre_tabla = :t"), {"t": tabla}
+    )
+
+
 def insertar_fila(tabla, df):
     """
     Inserta los datos del DataFrame en la tabla
     """
     # Normalizar nombres como en la creación
-    df.columns = [col.lower().replace(' ', '_').replace('ó', 'o') for col in df.columns]
+    df.columns = normalizar_columnas(df.columns)
     
     # Convertir a diccionario
     data = df.replace({np.nan: None}).to_dict('records')
@@ -74,11 +137,145 @@ def insertar_fila(tabla, df):
     
     try:
         db.session.execute(text(sql), data)
+        incrementar_version(tabla)
         db.session.commit()
     except Exception as e:
         db.session.rollback()
         raise e
 
+def _preparar_bloque_copy(df):
+    """
+    Ajusta un bloque para COPY: las columnas float que sólo tienen enteros
+    (p.ej. enteros con nulos) se escriben sin '.0' para que BIGINT las acepte.
+    """
+    convertidas = {}
+    for col in df.columns:
+        serie = df[col]
+        if pd.api.types.is_float_dtype(serie):
+            no_nulos = serie.dropna()
+            if not no_nulos.empty and (no_nulos % 1 == 0).all():
+                convertidas[col] = serie.astype('Int64')
+    if not convertidas:
+        return df
+    return df.assign(**convertidas)
+
+
+def copiar_bloque(tabla, df):
+    """
+    Envía un bloque del DataFrame a la tabla con COPY ... FROM STDIN.
+    No hace commit: la transacción la controla quien llama.
+    Devuelve el número de filas copiadas.
+    """
+    if df.empty:
+        return 0
+
+    buffer = io.StringIO()
+    _preparar_bloque_copy(df).to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    columns = ', '.join([f'"{col}"' for col in df.columns])
+    sql = f'COPY "{tabla}" ({columns}) FROM STDIN WITH (FORMAT csv)'
+
+    # COPY necesita el cursor de psycopg2 de la misma conexión que usa la sesión
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(sql, buffer)
+    finally:
+        cursor.close()
+    return len(df)
+
+
+def _validar_lote(filas, tipos):
+    """
+    Convierte una lista de filas (dicts) en un DataFrame con los tipos de la
+    tabla. Lanza ValueError si hay filas mal formadas, columnas desconocidas o
+    valores que no encajan en el tipo de su columna.
+    """
+    registros = []
+    for i, fila in enumerate(filas):
+        if isinstance(fila, Exception):
+            raise fila
+        if not isinstance(fila, dict):
+            raise ValueError(f"Fila {i}: se esperaba un objeto con columnas")
+        registros.append(dict(zip(normalizar_columnas(fila.keys()), fila.values())))
+
+    df = pd.DataFrame.from_records(registros)
+    desconocidas = [c for c in df.columns if c not in tipos]
+    if desconocidas:
+        raise ValueError(f"Columnas desconocidas: {', '.join(desconocidas)}")
+
+    df, invalidas = convertir_bloque(df, tipos)
+    if invalidas:
+        raise ValueError(f"Valores inválidos para las columnas: {', '.join(invalidas)}")
+    return df
+
+
+def insertar_filas_lote(tabla, filas, tamano_lote=1000, atomico=False):
+    """
+    Inserta filas (dicts, lista o iterador) en lotes multi-fila dentro de una
+    sola transacción. Cada lote se valida contra el esquema cacheado de la
+    tabla y se escribe con COPY dentro de un SAVEPOINT, de modo que un lote
+    inválido no descarta los demás (salvo con atomico=True).
+    Devuelve (filas_insertadas, lotes) con el detalle de cada lote.
+    """
+    tipos = esquema_tabla(tabla)
+    if not tipos:
+        raise ValueError(f"La tabla '{tabla}' no existe")
+
+    filas = iter(filas)
+    lotes = []
+    insertadas = 0
+    desde = 0
+    while True:
+        lote = list(islice(filas, tamano_lote))
+        if not lote:
+            break
+
+        info = {"lote": len(lotes), "desde": desde, "filas": len(lote), "insertadas": 0, "error": None}
+        desde += len(lote)
+        try:
+            df = _validar_lote(lote, tipos)
+            with db.session.begin_nested():
+                info["insertadas"] = copiar_bloque(tabla, df)
+            insertadas += info["insertadas"]
+        except Exception as e:
+            info["error"] = str(e)
+            if atomico:
+                db.session.rollback()
+                lotes.append(info)
+                return 0, lotes
+        lotes.append(info)
+
+    if insertadas:
+        incrementar_version(tabla)
+    db.session.commit()
+    return insertadas, lotes
+
+
+def copiar_lote_arrow(tabla, lote, columnas):
+    """
+    Envía un RecordBatch de Arrow con COPY. El CSV se genera con el escritor
+    nativo de Arrow, sin pasar los valores por objetos de Python.
+    No hace commit. Devuelve el número de filas copiadas.
+    """
+    if lote.num_rows == 0:
+        return 0
+
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(lote, sink, write_options=pa_csv.WriteOptions(include_header=False))
+    buffer = io.BytesIO(sink.getvalue().to_pybytes())
+
+    lista = ', '.join([f'"{col}"' for col in columnas])
+    sql = f'COPY "{tabla}" ({lista}) FROM STDIN WITH (FORMAT csv)'
+
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.copy_expert(sql, buffer)
+    finally:
+        cursor.close()
+    return lote.num_rows
+
+
 def listar_tablas():
     sql = """
     SELECT table_name FROM information_schema.tables
@@ -132,5 +329,7 @@ class MetaTabla(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     nombre_tabla = db.Column(db.String(100), nullable=False)
     usuario_id = db.Column(db.Integer, db.ForeignKey('usuario.id'), nullable=False)
+    # Se incrementa en cada escritura; forma parte de las claves de la cache de gráficos
+    version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
     usuario = db.relationship('Usuario', backref='tablas')
@@ -1,11 +1,19 @@
 
-from flask import Blueprint, request, jsonify
+import time
+from flask import Blueprint, Response, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy import text, func, Table, Integer, Float, Numeric, String, Date, DateTime
+from sqlalchemy.orm import selectinload
 from app import db
-from app.models.dashboard import Dashboard, DashboardItem
+from app.models.dashboard import Dashboard, DashboardItem, ResultadoItem
 from app.models.tablas import MetaTabla
+from app.utils.esquemas import esquema_registrado
+from app.utils.eventos import canal_dashboard, flujo_sse
+from app.utils.limites import limitar_consultas
+from app.utils.dashboards import (
+    tabla_item, opciones_aproximado, datos_item_cacheado, evaluar_items, resultados_vigentes,
+    definicion_item
+)
 
 
 dashboard_bp = Blueprint('dashboard_bp', __name__)
@@ -19,7 +27,11 @@ def owned_or_public(dash: Dashboard, user_id: int):
 def list_dashboards():
     user_id = int(get_jwt_identity())
     q = Dashboard.query.filter((Dashboard.user_id == user_id) | (Dashboard.is_public == True)).order_by(Dashboard.updated_at.desc())
-    return jsonify([d.to_dict(with_items=False) for d in q.all()])
+    # ?items=1: los items de todos los dashboards en una segunda consulta (selectin), no una por dashboard
+    with_items = request.args.get("items", "").lower() in ("1", "true", "si")
+    if with_items:
+        q = q.options(selectinload(Dashboard.items))
+    return jsonify([d.to_dict(with_items=with_items) for d in q.all()])
 
 @dashboard_bp.route('/dashboards', methods=['POST'])
 @jwt_required()
@@ -44,7 +56,7 @@ def create_dashboard():
 @jwt_required()
 def get_dashboard(dash_id):
     user_id = int(get_jwt_identity())
-    dash = Dashboard.query.get_or_404(dash_id)
+    dash = Dashboard.query.options(selectinload(Dashboard.items)).get_or_404(dash_id)
     if not owned_or_public(dash, user_id):
         return jsonify({'error': 'not authorized'}), 403
     return jsonify(dash.to_dict(with_items=True))
@@ -122,14 +134,15 @@ def update_item(dash_id, item_id):
 
     item = DashboardItem.query.filter_by(id=item_id, dashboard_id=dash_id).first_or_404()
     data = request.get_json() or {}
+    anterior = definicion_item(item)
 
     # actualizar campos simples
     for field in ['item_type','chart_type','position_x','position_y','width','height','refresh_interval']:
         if field in data and data[field] is not None:
             setattr(item, field, data[field])
 
-    # 🟢 merge de config
-    current_config = item.config or {}
+    # 🟢 merge de config (copia: si se modifica el mismo dict SQLAlchemy no lo detecta)
+    current_config = dict(item.config or {})
     if 'config' in data and isinstance(data['config'], dict):
         current_config.update(data['config'])
     item.config = current_config
@@ -138,6 +151,11 @@ def update_item(dash_id, item_id):
     if 'filters' in data and isinstance(data['filters'], dict):
         item.filters = data['filters']
 
+    if definicion_item(item) != anterior:
+        # El resultado precalculado corresponde a la definición anterior
+        ResultadoItem.query.filter_by(item_id=item.id).delete()
+        item.last_refresh = None
+
     db.session.commit()
     return jsonify(item.to_dict())
 
@@ -160,6 +178,7 @@ def delete_item(dash_id, item_id):
 
 @dashboard_bp.route("/dashboards/<int:dash_id>/items/<int:item_id>/data", methods=["GET"])
 @jwt_required()
+@limitar_consultas('dashboard')
 def get_item_data(dash_id, item_id):
     item = DashboardItem.query.get_or_404(item_id)
     usuario = get_jwt_identity()
@@ -169,90 +188,80 @@ def get_item_data(dash_id, item_id):
     if meta_tabla.usuario_id != usuario_id:
         return jsonify({"error": "No autorizado"}), 403
 
-    table = db.Model.metadata.tables.get(meta_tabla.nombre_tabla)
+    # ?aproximado=1[&error=0.05&confianza=0.95]: vista previa instantánea por muestreo
+    aproximado = opciones_aproximado(request.args)
+
+    # Resultado precalculado por el refresco en segundo plano, si sigue vigente
+    if aproximado is None:
+        materializado = resultados_vigentes([item], {meta_tabla.id: meta_tabla})
+        if item.id in materializado:
+            return jsonify(materializado[item.id])
+
+    table = tabla_item(meta_tabla.nombre_tabla)
     if table is None:
         return jsonify({"error": "Tabla no encontrada"}), 404
 
-    config = item.config or {}
-    item_type = item.item_type
-
-    # --- CHART (bar, line, pie) ---
-    if item_type == "chart":
-        x_name = config.get("x") or config.get("x_axis")
-        y_name = config.get("y") or config.get("y_axis")
-        agg_func = (config.get("agg") or config.get("aggregation") or "SUM").upper() 
-
-        if not x_name or not y_name:
-            return jsonify({"error": "Faltan columnas x/y"}), 400
-
-        x_col = table.c.get(x_name)
-        y_col = table.c.get(y_name)
-        if x_col is None or y_col is None:
-            return jsonify({"error": "Columnas inválidas"}), 400
-
-        agg_map = {
-            "SUM": func.sum,
-            "AVG": func.avg,
-            "COUNT": func.count,
-            "MAX": func.max,
-            "MIN": func.min,
-        }
-        agg_func_callable = agg_map.get(agg_func, func.sum)
-
-        if isinstance(y_col.type, (Integer, Float, Numeric)):
-            agg = agg_func_callable(y_col)
-        else:
-            if agg_func in ("SUM", "AVG"):
-                agg = func.count(y_col)
-            else:
-                agg = agg_func_callable(y_col)
-
-        query = db.session.query(x_col.label("label"), agg.label("value")).group_by(x_col)
-        rows = query.all()
-        return jsonify([{"label": r.label, "value": r.value} for r in rows])
-
-    # --- KPI ---
-    elif item_type == "kpi":
-        col_name = config.get("column")
-        agg_func = (config.get("agg") or "SUM").upper()
-        if not col_name:
-            return jsonify({"error": "Falta columna KPI"}), 400
-
-        col = table.c.get(col_name)
-        if col is None:
-            return jsonify({"error": "Columna inválida"}), 400
-
-        agg_map = {
-            "SUM": func.sum,
-            "AVG": func.avg,
-            "COUNT": func.count,
-            "MAX": func.max,
-            "MIN": func.min,
-        }
-        agg_func_callable = agg_map.get(agg_func, func.sum)
+    try:
+        data, _ = datos_item_cacheado(current_app, meta_tabla, item, table, aproximado)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(data)
+
+
+@dashboard_bp.route("/dashboards/<int:dash_id>/data", methods=["GET"])
+@jwt_required()
+@limitar_consultas('dashboard')
+def get_dashboard_data(dash_id):
+    """
+    Datos de todos los items del dashboard en una sola respuesta. Cada item
+    corre con el statement_timeout de la clase dashboard: los que lo superan
+    vuelven con status 504 y el resto del dashboard se entrega igual.
+    """
+    usuario = get_jwt_identity()
+    usuario_id = usuario["id"] if isinstance(usuario, dict) else int(usuario)
+
+    dash = Dashboard.query.get_or_404(dash_id)
+    if not owned_or_public(dash, usuario_id):
+        return jsonify({'error': 'not authorized'}), 403
 
-        value = db.session.query(agg_func_callable(col)).scalar()
-        return jsonify({"value": value})
+    inicio = time.perf_counter()
+    items = dash.items
+    ids = {item.table_id for item in items}
+    metas = {m.id: m for m in MetaTabla.query.filter(MetaTabla.id.in_(ids)).all()} if ids else {}
 
-    # --- TABLE ---
-    elif item_type == "table":
-        cols = config.get("columns", [])
-        if cols is None:
-            return jsonify({"error": "Faltan columnas para tabla"}), 400
+    resultados = evaluar_items(
+        current_app._get_current_object(), items, metas, usuario_id,
+        opciones_aproximado(request.args)
+    )
+    return jsonify({
+        "dashboard_id": dash.id,
+        "items": resultados,
+        "errores": sum(1 for r in resultados if r["error"]),
+        "interrumpidos": sum(1 for r in resultados if r.get("timeout")),
+        "ms": round((time.perf_counter() - inicio) * 1000, 1)
+    })
 
-        selected = [table.c[c] for c in cols if c in table.c]
-        if not selected:
-            return jsonify({"error": "Columnas inválidas"}), 400
 
-        rows = db.session.query(*selected).limit(100).all()
-        result = [dict(zip(cols, r)) for r in rows]
-        return jsonify(result)
+@dashboard_bp.route("/dashboards/<int:dash_id>/stream", methods=["GET"])
+@jwt_required()
+def stream_dashboard(dash_id):
+    """
+    Server-Sent Events con los datos de los items: una foto inicial y luego
+    sólo los items cuyo resultado cambió, recalculados según refresh_interval.
+    """
+    usuario = get_jwt_identity()
+    usuario_id = usuario["id"] if isinstance(usuario, dict) else int(usuario)
 
-    # --- TEXTO ---
-    elif item_type == "text":
-        return jsonify({"text": config.get("text", "")})
+    dash = Dashboard.query.get_or_404(dash_id)
+    if not owned_or_public(dash, usuario_id):
+        return jsonify({'error': 'not authorized'}), 403
 
-    return jsonify({"error": f"Tipo de item '{item_type}' no soportado"}), 400
+    canal = canal_dashboard(current_app._get_current_object(), dash_id, usuario_id)
+    return Response(
+        flujo_sse(canal),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @dashboard_bp.route("/dashboards/<int:tabla_id>/valid-columns", methods=["GET"])
@@ -266,36 +275,16 @@ def get_valid_columns(tabla_id):
     if meta_tabla.usuario_id != usuario_id:
         return jsonify({"error": "No autorizado"}), 403
 
-    # 🚀 Autoload de la tabla para tener columnas reales
-    table = Table(meta_tabla.nombre_tabla, db.metadata, autoload_with=db.engine)
-    if table is None:
+    # Columnas y categorías del registro de esquemas (sin reflejar en cada petición)
+    esquema = esquema_registrado(meta_tabla.nombre_tabla)
+    if esquema is None:
         return jsonify({"error": "Tabla no encontrada"}), 404
 
     chart_type = request.args.get("chart_type")
     if not chart_type:
         return jsonify({"error": "chart_type requerido"}), 400
 
-    columnas = {}
-    for col_name, col in table.c.items():
-        col_type = type(col.type).__name__.lower()
-
-
-        if any(t in col_type for t in ["int", "float", "numeric", "double", "decimal"]):
-            col_category = "numeric"
-        elif any(t in col_type for t in ["date", "time", "timestamp"]):
-            col_category = "temporal"
-        elif any(t in col_type for t in ["string", "text", "char"]):
-            normalized = col_name.lower().replace("_", "").replace(" ", "")
-            if any(pal in normalized for pal in ["fecha", "date", "time", "created", "updated"]):
-                col_category = "temporal"
-            else:
-                col_category = "categorical"
-        else:
-            col_category = "other"
-
-        print(f"DEBUG {col_name}: {col_type} → {col_category}")
-
-        columnas[col_name] = col_category
+    columnas = esquema.categorias
 
     # Filtrar columnas según gráfico
     if chart_type == "bar":
@@ -0,0 +1,179 @@
+import csv
+import io
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+from flask import Blueprint, request, jsonify, Response, stream_with_context, current_app
+from flask_jwt_extended import jwt_required, get_jwt_identity
+from sqlalchemy import text
+from app import db
+from app.models.tablas import MetaTabla
+from app.decorators import make_json_serializable
+from app.utils.consultas import construir_select
+from app.utils.limites import fijar_timeout, limite_de
+
+export_bp = Blueprint('export', __name__)
+
+FORMATOS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+# Tipos de columna -> tipos de Arrow para el esquema del Parquet exportado.
+# NUMERIC no está: va como decimal128 si la columna declara precisión y escala
+# (ver _tipos_numeric) y si no como texto, nunca como float (perdería precisión)
+TIPOS_ARROW = {
+    'SMALLINT': pa.int16(),
+    'INTEGER': pa.int32(),
+    'BIGINT': pa.int64(),
+    'DOUBLE PRECISION': pa.float64(),
+    'BOOLEAN': pa.bool_(),
+    'DATE': pa.date32(),
+    'TIMESTAMP': pa.timestamp('us'),
+    'TIMESTAMPTZ': pa.timestamp('us', tz='UTC'),
+    'TIME': pa.time64('us'),
+}
+
+
+class _SalidaIncremental:
+    """Archivo en memoria que se vacía después de cada grupo de filas escrito"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._posicion = 0
+        self.closed = False
+
+    def write(self, datos):
+        self._buffer += bytes(datos)
+        self._posicion += len(datos)
+        return len(datos)
+
+    def tell(self):
+        return self._posicion
+
+    def flush(self):
+        pass
+
+    def writable(self):
+        return True
+
+    def close(self):
+        self.closed = True
+
+    def vaciar(self):
+        datos = bytes(self._buffer)
+        self._buffer.clear()
+        return datos
+
+
+def _filas_en_bloques(engine, sql, params, tamano, limite):
+    """
+    Ejecuta la consulta con un cursor del lado del servidor y entrega las filas
+    por bloques: ni el worker ni Postgres materializan el resultado completo.
+    El límite de la clase browse aplica a cada FETCH; si el cliente se va, el
+    generador se cierra entre bloques y el cursor se cierra con la conexión.
+    """
+    with engine.connect() as conn:
+        fijar_timeout(conn, limite)
+        result = conn.execution_options(stream_results=True, max_row_buffer=tamano).execute(text(sql), params)
+        for bloque in result.partitions(tamano):
+            yield bloque
+
+
+def _csv(bloques, columnas):
+    salida = io.StringIO()
+    escritor = csv.writer(salida)
+    escritor.writerow(columnas)
+    for bloque in bloques:
+        escritor.writerows(bloque)
+        yield salida.getvalue()
+        salida.seek(0)
+        salida.truncate()
+    yield salida.getvalue()
+
+
+def _ndjson(bloques, columnas):
+    for bloque in bloques:
+        yield ''.join(
+            json.dumps(make_json_serializable(dict(zip(columnas, fila))), default=str, ensure_ascii=False) + '\n'
+            for fila in bloque
+        )
+
+
+def _tipos_numeric(tabla):
+    """{columna: decimal128(p, s)} de las columnas NUMERIC con precisión declarada (p <= 38)"""
+    filas = db.session.execute(text("""
+        SELECT column_name, numeric_precision, numeric_scale
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = :t AND data_type = 'numeric'
+          AND numeric_precision IS NOT NULL AND numeric_precision <= 38
+    """), {"t": tabla}).fetchall()
+    return {col: pa.decimal128(precision, escala or 0) for col, precision, escala in filas}
+
+
+def _parquet(bloques, columnas, tipos, numeric):
+    esquema = pa.schema([
+        (c, numeric.get(c) or TIPOS_ARROW.get(tipos[c].nombre, pa.string()))
+        for c in columnas
+    ])
+    # Los NUMERIC sin precisión declarada quedan como texto exacto (str(Decimal))
+    texto = [c for c in columnas if esquema.field(c).type == pa.string()]
+
+    salida = _SalidaIncremental()
+    escritor = pq.ParquetWriter(salida, esquema)
+    try:
+        for bloque in bloques:
+            datos = {c: [fila[i] for fila in bloque] for i, c in enumerate(columnas)}
+            for c in texto:
+                datos[c] = [None if v is None else str(v) for v in datos[c]]
+            escritor.write_table(pa.Table.from_pydict(datos, schema=esquema))
+            yield salida.vaciar()
+    finally:
+        escritor.close()
+    yield salida.vaciar()
+
+
+@export_bp.route('/exportar/<int:tabla_id>', methods=['GET'])
+@jwt_required()
+def exportar_tabla(tabla_id):
+    """
+    Exporta una tabla completa (o una proyección filtrada) en streaming.
+    Parámetros: formato=csv|ndjson|parquet, columnas=a,b,c y
+    filtros=<json> (mismo formato que los filtros de escenarios).
+    """
+    usuario = get_jwt_identity()
+    usuario_id = usuario["id"] if isinstance(usuario, dict) else int(usuario)
+
+    meta_tabla = MetaTabla.query.get_or_404(tabla_id)
+    if meta_tabla.usuario_id != usuario_id:
+        return jsonify({"error": "No autorizado"}), 403
+
+    formato = request.args.get('formato', 'csv').lower()
+    if formato not in FORMATOS:
+        return jsonify({"error": f"Formato no soportado, use uno de: {', '.join(FORMATOS)}"}), 400
+
+    columnas = [c.strip() for c in request.args.get('columnas', '').split(',') if c.strip()]
+    try:
+        filtros = json.loads(request.args['filtros']) if request.args.get('filtros') else None
+        sql, params, columnas, tipos = construir_select(meta_tabla.nombre_tabla, columnas, filtros)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    sql += ' ORDER BY id'
+    tamano = current_app.config.get('EXPORT_CHUNK_ROWS', 10000)
+    bloques = _filas_en_bloques(db.engine, sql, params, tamano, limite_de(current_app, 'browse'))
+
+    if formato == 'csv':
+        cuerpo = _csv(bloques, columnas)
+    elif formato == 'ndjson':
+        cuerpo = _ndjson(bloques, columnas)
+    else:
+        cuerpo = _parquet(bloques, columnas, tipos, _tipos_numeric(meta_tabla.nombre_tabla))
+
+    nombre_archivo = f"{meta_tabla.nombre_tabla}.{formato}"
+    return Response(
+        stream_with_context(cuerpo),
+        mimetype=FORMATOS[formato],
+        headers={"Content-Disposition": f'attachment; filename="{nombre_archivo}"'}
+    )
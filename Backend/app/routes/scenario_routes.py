@@ -1,7 +1,7 @@
 from flask import Blueprint, request, jsonify
 from app import db
 from app.models.scenario import ScenarioComparison, Scenario
-from app.decorators import compare_scenarios, generate_suggestions, get_csv_data, get_table_data, prepare_visualization_data, make_json_serializable
+from app.decorators import compare_scenarios, generate_suggestions, get_csv_data, get_table_data, prepare_visualization_data, make_json_serializable, paginar_modelo
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from sqlalchemy.exc import SQLAlchemyError
 from app.models import MetaTabla
@@ -9,12 +9,25 @@ from datetime import datetime, timedelta
 from prophet import Prophet
 
 from sqlalchemy import text
+from sqlalchemy.orm import defer
+from app.utils.limites import limitar_consultas
 import numpy as np
 import pandas as pd
 import decimal 
 
 scenario_bp = Blueprint('scenario', __name__)
 
+MAX_LIMITE_LISTADO = 200
+
+
+def _limite_listado():
+    """?limit= de los listados paginados (por defecto 50, máximo MAX_LIMITE_LISTADO)"""
+    limit = int(request.args.get("limit", 50))
+    if not 1 <= limit <= MAX_LIMITE_LISTADO:
+        raise ValueError(f"'limit' debe estar entre 1 y {MAX_LIMITE_LISTADO}")
+    return limit
+
+
 # ------------------------------
 # Crear comparación
 # ------------------------------
@@ -45,7 +58,19 @@ def list_comparisons():
     if request.method == "OPTIONS":
         return '', 200
     user_id = get_jwt_identity()
-    comps = ScenarioComparison.query.filter_by(user_id=user_id).all()
+    query = ScenarioComparison.query.filter_by(user_id=user_id)
+
+    # Con ?cursor= (vacío para la primera página) se pagina por keyset sobre id
+    if "cursor" in request.args:
+        try:
+            comps, cursor = paginar_modelo(
+                query, ScenarioComparison.id, _limite_listado(), request.args.get("cursor") or None
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"datos": [c.to_dict() for c in comps], "cursor": cursor})
+
+    comps = query.all()
     return jsonify([c.to_dict() for c in comps])
 
 # ------------------------------
@@ -75,6 +100,7 @@ def delete_comparison(comp_id):
 # ------------------------------
 @scenario_bp.route('/scenario/<int:comp_id>/scenarios', methods=['POST'])
 @jwt_required()
+@limitar_consultas('scenario')
 def add_scenario(comp_id):
     data = request.get_json()
     user_id = get_jwt_identity()
@@ -135,12 +161,43 @@ def list_scenario(comp_id):
         return "", 200 
     user_id = get_jwt_identity()
     comparison = ScenarioComparison.query.filter_by(id=comp_id, user_id=user_id).first_or_404()
-    scenarios = Scenario.query.filter_by(comparison_id=comparison.id).all()
-    
+    # Resumen: el snapshot (potencialmente de varios MB) no sale de la base;
+    # se obtiene por escenario con GET /scenario/<id>/scenarios/<scenario_id>
+    query = Scenario.query.options(defer(Scenario.data_snapshot)).filter_by(comparison_id=comparison.id)
+
+    if "cursor" in request.args:
+        try:
+            scenarios, cursor = paginar_modelo(
+                query, Scenario.id, _limite_listado(), request.args.get("cursor") or None
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({
+            **comparison.to_dict(),
+            "scenarios": [s.to_dict(summary=True) for s in scenarios],
+            "cursor": cursor
+        })
+
+    scenarios = query.order_by(Scenario.id).all()
     return jsonify({
         **comparison.to_dict(),
-        "scenarios": [s.to_dict() for s in scenarios]
+        "scenarios": [s.to_dict(summary=True) for s in scenarios]
     })
+
+# ------------------------------
+# Obtener un escenario completo (con snapshot)
+# ------------------------------
+@scenario_bp.route('/scenario/<int:comp_id>/scenarios/<int:scenario_id>', methods=['GET'])
+@jwt_required()
+def get_scenario(comp_id, scenario_id):
+    user_id = get_jwt_identity()
+    scenario = (
+        db.session.query(Scenario)
+        .join(ScenarioComparison)
+        .filter(Scenario.id == scenario_id, ScenarioComparison.id == comp_id, ScenarioComparison.user_id == user_id)
+        .first_or_404()
+    )
+    return jsonify(scenario.to_dict())
 # ------------------------------
 # Eliminar un escenario
 # ------------------------------
@@ -163,6 +220,7 @@ def delete_scenario(comp_id, scenario_id):
 # ------------------------------
 @scenario_bp.route('/scenario/compare', methods=['POST'])
 @jwt_required()
+@limitar_consultas('scenario')
 def run_comparison():
     data = request.json
     scenario_ids = data.get("scenario_ids", [])
@@ -194,6 +252,7 @@ def run_comparison():
 # ------------------------------
 @scenario_bp.route('/scenario/<int:scenario_id>/project', methods=['POST'])
 @jwt_required()
+@limitar_consultas('scenario')
 def project_scenario(scenario_id):
     data = request.get_json()
     periods = data.get("periods", 30)  # por defecto 30 días
@@ -1,12 +1,22 @@
+import json
 import pandas as pd
 import numpy as np
 import re
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from app.models.tablas import crear_tabla_dinamica, insertar_fila, obtener_datos, MetaTabla, db
+from app.models.tablas import (
+    crear_tabla_dinamica, insertar_filas_lote, eliminar_tabla_fisica, obtener_datos, MetaTabla, db,
+    normalizar_columnas
+)
+from app.utils.tipos import inferir_tipos
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy import text
-from app.decorators import obtener_datos
+from app.decorators import obtener_datos, obtener_datos_cursor
+from app.utils.graficos import calcular_grafico
+from app.utils.aproximado import grafico_aproximado
+from app.utils.cache import cache_graficos, clave_cache
+from app.utils.esquemas import esquema_registrado
+from app.utils.limites import ConsultaInterrumpida, limitar_consultas
 
 table_bp = Blueprint('table', __name__)
 
@@ -23,12 +33,28 @@ def upload_dynamic():
     if not tabla or not columnas or not filas:
         return jsonify({"error": "Faltan tabla, columnas o filas"}), 400
 
+    if not re.match(r'^\w+$', tabla):
+        return jsonify({"error": "Nombre de tabla inválido"}), 400
+    tabla = tabla.lower()
+
     try:
-        # Crear tabla física
-        crear_tabla_dinamica(tabla, columnas)
-        # Insertar filas
-        for fila in filas:
-            insertar_fila(tabla, fila)
+        # Las filas pueden venir como listas (en el orden de columnas) o como objetos
+        registros = [dict(zip(columnas, f)) if isinstance(f, (list, tuple)) else f for f in filas]
+        df = pd.DataFrame.from_records(registros, columns=columnas)
+        # Los tipos se indexan con los nombres que tendrá la tabla
+        df.columns = normalizar_columnas(df.columns)
+
+        # Crear tabla física con tipos inferidos de las filas
+        ok, msg = crear_tabla_dinamica(tabla, df, inferir_tipos(df))
+        if not ok:
+            return jsonify({"error": msg}), 400
+
+        # Insertar todas las filas en lotes dentro de una transacción
+        insertadas, lotes = insertar_filas_lote(tabla, registros, atomico=True)
+        if any(l["error"] for l in lotes):
+            eliminar_tabla_fisica(tabla)
+            db.session.commit()
+            return jsonify({"error": "No se pudieron insertar las filas", "lotes": lotes}), 400
 
         # Guardar registro en MetaTabla para este usuario
         meta_tabla = MetaTabla(nombre_tabla=tabla, usuario_id=usuario_id)
@@ -41,7 +67,7 @@ def upload_dynamic():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
-    return jsonify({"mensaje": f"Datos insertados en tabla {tabla} correctamente"}), 201
+    return jsonify({"mensaje": f"Datos insertados en tabla {tabla} correctamente", "filas_insertadas": insertadas}), 201
 
 
 @table_bp.route('/tablas', methods=['GET'])
@@ -61,6 +87,7 @@ def tablas():
 
 @table_bp.route('/datos/<int:tabla_id>', methods=['GET',])
 @jwt_required()
+@limitar_consultas('browse')
 def datos(tabla_id):
 
     usuario = get_jwt_identity()
@@ -73,17 +100,57 @@ def datos(tabla_id):
     limit = int(request.args.get("limit", 10))
     offset = int(request.args.get("offset", 0))
 
+    # Proyección, orden ('fecha,-monto') y filtros se resuelven en SQL
+    columnas = [c.strip() for c in request.args.get("columnas", "").split(",") if c.strip()] or None
+    orden = request.args.get("orden") or None
+
     try:
-        filas, columnas = obtener_datos(meta_tabla.nombre_tabla, limit, offset)
+        filtros = json.loads(request.args["filtros"]) if request.args.get("filtros") else None
+
+        # Con ?cursor= (vacío para la primera página) se pagina por keyset
+        if "cursor" in request.args:
+            filas, columnas, cursores = obtener_datos_cursor(
+                meta_tabla.nombre_tabla, limit, request.args.get("cursor") or None,
+                columnas=columnas, orden=orden, filtros=filtros
+            )
+            return jsonify({
+                "columnas": columnas,
+                "datos": filas,
+                "cursor": cursores
+            })
+
+        filas, columnas = obtener_datos(
+            meta_tabla.nombre_tabla, limit, offset, columnas=columnas, orden=orden, filtros=filtros
+        )
         
         return jsonify({
             "columnas": list(columnas),
             "datos": filas
         })
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ConsultaInterrumpida:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@table_bp.route('/tablas/<int:tabla_id>/esquema', methods=['GET'])
+@jwt_required()
+def esquema(tabla_id):
+    """Columnas con su tipo Postgres y categoría (numeric, temporal, categorical)"""
+    usuario = get_jwt_identity()
+    usuario_id = usuario["id"] if isinstance(usuario, dict) else int(usuario)
+
+    meta_tabla = MetaTabla.query.get_or_404(tabla_id)
+    if meta_tabla.usuario_id != usuario_id:
+        return jsonify({"error": "No autorizado"}), 403
+
+    registrado = esquema_registrado(meta_tabla.nombre_tabla)
+    if registrado is None:
+        return jsonify({"error": "Tabla no encontrada"}), 404
+    return jsonify({"tabla": meta_tabla.nombre_tabla, "columnas": registrado.to_dict()})
+
 @table_bp.route('/tablas/<int:tabla_id>', methods=['DELETE'])
 @jwt_required()
 def eliminar_tabla(tabla_id):
@@ -97,8 +164,7 @@ def eliminar_tabla(tabla_id):
         return jsonify({"error": "No autorizado"}), 403
 
     try:
-        sql = f'DROP TABLE IF EXISTS "{meta_tabla.nombre_tabla}"'
-        db.session.execute(text(sql))
+        eliminar_tabla_fisica(meta_tabla.nombre_tabla)
         db.session.delete(meta_tabla)
         db.session.commit()
         return jsonify({"msg": f"Tabla '{meta_tabla.nombre_tabla}' eliminada correctamente."})
@@ -110,7 +176,7 @@ def eliminar_tabla(tabla_id):
 @table_bp.route('/tablas/<int:tabla_id>/filas', methods=['POST'])
 @jwt_required()
 def insertar_fila_tabla(tabla_id):
-    usuario_id = get_jwt_identity()
+    usuario_id = int(get_jwt_identity())
     meta_tabla = MetaTabla.query.get_or_404(tabla_id)
 
     if meta_tabla.usuario_id != usuario_id:
@@ -118,19 +184,95 @@ def insertar_fila_tabla(tabla_id):
 
     fila = request.get_json()
     try:
-        insertar_fila(meta_tabla.nombre_tabla, fila)
+        _, lotes = insertar_filas_lote(meta_tabla.nombre_tabla, [fila], atomico=True)
+        if lotes and lotes[0]["error"]:
+            return jsonify({"error": lotes[0]["error"]}), 400
         return jsonify({"msg": "Fila insertada"}), 201
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+def _leer_ndjson(stream):
+    """Objetos de un cuerpo NDJSON, línea a línea; las líneas inválidas se entregan como error"""
+    for numero, linea in enumerate(stream, 1):
+        linea = linea.strip()
+        if not linea:
+            continue
+        try:
+            yield json.loads(linea)
+        except ValueError as e:
+            yield ValueError(f"Línea {numero}: JSON inválido ({e})")
+
+
+@table_bp.route('/tablas/<int:tabla_id>/filas/bulk', methods=['POST'])
+@jwt_required()
+def insertar_filas_bulk(tabla_id):
+    """
+    Inserción masiva. Acepta JSON ({"filas": [...], "batch_size": n, "atomico": bool}
+    o directamente una lista) o NDJSON (un objeto por línea, con batch_size y
+    atomico en la query string). Devuelve el resultado de cada lote.
+    """
+    usuario_id = int(get_jwt_identity())
+    meta_tabla = MetaTabla.query.get_or_404(tabla_id)
+
+    if meta_tabla.usuario_id != usuario_id:
+        return jsonify({"error": "No autorizado"}), 403
+
+    max_lote = current_app.config.get('BULK_MAX_BATCH_SIZE', 10000)
+    opciones = dict(request.args)
+
+    if request.mimetype in ('application/x-ndjson', 'application/ndjson'):
+        filas = _leer_ndjson(request.stream)
+    else:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            filas = data.get('filas')
+            opciones.update({k: data[k] for k in ('batch_size', 'atomico') if k in data})
+        else:
+            filas = data
+        if not isinstance(filas, list):
+            return jsonify({"error": "Se esperaba una lista de filas"}), 400
+
+    try:
+        tamano_lote = max(1, min(int(opciones.get('batch_size', 1000)), max_lote))
+    except (TypeError, ValueError):
+        return jsonify({"error": "batch_size inválido"}), 400
+    atomico = str(opciones.get('atomico', '')).lower() in ('1', 'true', 'si')
+
+    try:
+        insertadas, lotes = insertar_filas_lote(
+            meta_tabla.nombre_tabla, filas, tamano_lote=tamano_lote, atomico=atomico
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    errores = sum(1 for l in lotes if l["error"])
+    if errores == 0:
+        status = 201
+    elif errores < len(lotes) and not atomico:
+        status = 207
+    else:
+        status = 400
+
+    return jsonify({
+        "filas_insertadas": insertadas,
+        "lotes_con_error": errores,
+        "lotes": lotes
+    }), status
     
 
 @table_bp.route('/graficar/<int:tabla_id>', methods=['GET', 'OPTIONS'])
 @jwt_required()
+@limitar_consultas('chart')
 def graficar(tabla_id):
     if request.method == 'OPTIONS':
         return jsonify({}), 200
 
-    usuario_id = get_jwt_identity()
+    usuario = get_jwt_identity()
+    usuario_id = usuario["id"] if isinstance(usuario, dict) else int(usuario)
     tipo = request.args.get('tipo')
     x = request.args.get('x')
     y = request.args.get('y')
@@ -142,62 +284,42 @@ def graficar(tabla_id):
     tabla = meta.nombre_tabla
 
     try:
-        # Usar db.engine en vez de db.session.bind para evitar NoneType
-        df = pd.read_sql(text(f"SELECT * FROM {tabla}"), db.engine)
-
-        if tipo == 'pastel':
-            if not x:
-                return jsonify({"error": "Columna x requerida para gráfico pastel"}), 400
-            data = df[x].value_counts().to_dict()
-
-        elif tipo == 'barras':
-            if not x:
-                return jsonify({"error": "Columna x requerida"}), 400
-            if y:
-                data = df.groupby(x)[y].sum().to_dict()
-            else:
-                data = df[x].value_counts().to_dict()
-
-        elif tipo == 'lineas':
-            if not x or not y:
-                return jsonify({"error": "Columnas x e y requeridas"}), 400
-            data = df.groupby(x)[y].mean().sort_index().to_dict()
-
-        elif tipo == 'histograma':
-            if not x:
-                return jsonify({"error": "Columna x requerida para histograma"}), 400
-            counts, bins = np.histogram(df[x].dropna(), bins=10)
-            data = {
-                "labels": [f"{bins[i]:.2f}-{bins[i+1]:.2f}" for i in range(len(counts))],
-                "values": counts.tolist()
-            }
-
-        elif tipo == 'boxplot':
-            if not y:
-                return jsonify({"error": "Columna y requerida"}), 400
-            if x:
-                grouped = df[[x, y]].dropna().groupby(x)
-                data = {str(k): v[y].describe().to_dict() for k, v in grouped}
-            else:
-                data = df[y].dropna().describe().to_dict()
-
-        elif tipo == 'dispersión':
-            if not x or not y:
-                return jsonify({"error": "Columnas x e y requeridas"}), 400
-            points = df[[x, y]].dropna().to_dict(orient='records')
-            data = {"points": points}
-
-        elif tipo == 'heatmap':
-            corr = df.select_dtypes(include='number').corr().round(2)
-            data = corr.to_dict()
-
-        else:
-            return jsonify({"error": "Tipo de gráfico no soportado"}), 400
+        # Resultado cacheado por tabla, versión y parámetros del gráfico
+        opciones = {k: v for k, v in request.args.items() if k not in ('tipo', 'x', 'y')}
+        cache = cache_graficos(current_app)
+
+        # ?aproximado=1: estimación sobre una muestra, con intervalo de confianza
+        if opciones.get('aproximado', '').lower() in ('1', 'true', 'si'):
+            (data, detalle), _ = cache.obtener_o_calcular(
+                clave_cache(meta, 'graficar', tipo, x, y, opciones),
+                lambda: grafico_aproximado(tabla, tipo, x, y, opciones)
+            )
+            return jsonify({
+                "tipo": tipo,
+                "datos": data,
+                "aproximado": detalle
+            })
+
+        data, _ = cache.obtener_o_calcular(
+            clave_cache(meta, 'graficar', tipo, x, y, opciones),
+            lambda: calcular_grafico(tabla, tipo, x, y, opciones)
+        )
 
         return jsonify({
             "tipo": tipo,
             "datos": data
         })
 
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except ConsultaInterrumpida:
+        raise
     except Exception as e:
         return jsonify({"error": f"Error al generar gráfico: {str(e)}"}), 500
+
+
+@table_bp.route('/graficar/cache', methods=['GET'])
+@jwt_required()
+def estadisticas_cache():
+    """Aciertos, fallos y ocupación de la cache de gráficos de este proceso"""
+    return jsonify(cache_graficos(current_app).estadisticas())
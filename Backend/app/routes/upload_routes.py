@@ -1,25 +1,31 @@
 import re
 import os
-import pandas as pd
-from flask import Blueprint, request, jsonify
+import tempfile
+from flask import Blueprint, request, jsonify, current_app
 from werkzeug.utils import secure_filename
-from sqlalchemy import text
-from app import db
-from app.models.tablas import crear_tabla_dinamica, insertar_fila, MetaTabla
+from app.models.tablas import tabla_existe, normalizar_columnas, MetaTabla
+from app.utils.ingesta import ejecutar_ingesta
+from app.utils.trabajos import TrabajoIngesta, lanzar_trabajo, obtener_trabajo
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
-ALLOWED_EXTENSIONS = {'csv', 'xlsx'}
+ALLOWED_EXTENSIONS = {'csv', 'xlsx', 'parquet', 'arrow', 'feather', 'ipc'}
+MODOS_CARGA = ('crear', 'anexar', 'upsert')
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 upload_bp = Blueprint('upload', __name__)
 
+
+def _usuario_actual():
+    usuario = get_jwt_identity()
+    return usuario['id'] if isinstance(usuario, dict) else int(usuario)
+
+
 @upload_bp.route('/upload', methods=['POST'])
 @jwt_required()
 def upload_file():
-    usuario = get_jwt_identity()
-    usuario_id = usuario['id'] if isinstance(usuario, dict) else usuario
+    usuario_id = _usuario_actual()
 
     file = request.files.get('file')
     nombre_tabla = request.form.get('nombre_tabla')
@@ -33,36 +39,74 @@ def upload_file():
     filename = secure_filename(file.filename)
     extension = filename.rsplit('.', 1)[1].lower()
 
-    try:
-        # Leer archivo
-        if extension == 'csv':
-            df = pd.read_csv(file)
-        else:
-            df = pd.read_excel(file, engine='openpyxl')
-        
-        # Normalizar nombre de tabla
-        nombre_tabla = re.sub(r'[^a-zA-Z0-9]', '_', nombre_tabla).lower()
-        
-        # Crear tabla
-        success, msg = crear_tabla_dinamica(nombre_tabla, df)
-        
-        if not success:
-            # Manejar error o tabla existente
-            return jsonify({"error": msg}), 400
-        insertar_fila(nombre_tabla, df)
-        meta_tabla = MetaTabla(
-            nombre_tabla=nombre_tabla,
-            usuario_id=usuario_id
+    # Normalizar nombre de tabla
+    nombre_tabla = re.sub(r'[^a-zA-Z0-9]', '_', nombre_tabla).lower()
+
+    # crear (por defecto), anexar o upsert sobre una tabla existente
+    modo = (request.form.get('modo') or 'crear').lower()
+    if modo not in MODOS_CARGA:
+        return jsonify({"error": f"Modo inválido, use uno de: {', '.join(MODOS_CARGA)}"}), 400
+
+    opciones = {"modo": modo}
+    if modo == 'crear':
+        if tabla_existe(nombre_tabla):
+            return jsonify({"error": f"La tabla '{nombre_tabla}' ya existe. No se realizaron cambios."}), 400
+    else:
+        meta_tabla = MetaTabla.query.filter_by(nombre_tabla=nombre_tabla, usuario_id=usuario_id).first()
+        if not meta_tabla:
+            return jsonify({"error": f"La tabla '{nombre_tabla}' no existe o no pertenece al usuario"}), 404
+        opciones['tabla_id'] = meta_tabla.id
+
+    if modo == 'upsert':
+        clave = normalizar_columnas(
+            c.strip() for c in (request.form.get('clave') or '').split(',') if c.strip()
         )
-        db.session.add(meta_tabla)
-        db.session.commit()
-        
-        
+        if not clave:
+            return jsonify({"error": "El modo upsert requiere 'clave' (columnas separadas por coma)"}), 400
+        opciones['clave'] = clave
+
+    if extension == 'xlsx':
+        opciones['hoja'] = request.form.get('hoja')
+        opciones['todas_las_hojas'] = request.form.get('todas_las_hojas', '').lower() in ('1', 'true', 'si')
+        if opciones['todas_las_hojas'] and modo != 'crear':
+            return jsonify({"error": "'todas_las_hojas' sólo se admite al crear tablas"}), 400
+
+    try:
+        # Guardar el archivo en disco: la carga sigue después de responder
+        fd, ruta = tempfile.mkstemp(suffix=f'.{extension}', dir=current_app.config.get('UPLOAD_TMP_DIR'))
+        with os.fdopen(fd, 'wb') as destino:
+            file.save(destino)
+
+        trabajo = TrabajoIngesta(usuario_id, nombre_tabla, ruta, extension, opciones)
+        lanzar_trabajo(current_app._get_current_object(), trabajo, ejecutar_ingesta)
+
         return jsonify({
-            "mensaje": msg,
-            "columnas": list(df.columns),
-            "filas_insertadas": len(df)
-        })
-    
+            "mensaje": "Carga en proceso",
+            "job_id": trabajo.id,
+            "estado": trabajo.estado
+        }), 202, {"Location": f"/upload/jobs/{trabajo.id}"}
+
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+
+@upload_bp.route('/upload/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def estado_carga(job_id):
+    trabajo = obtener_trabajo(job_id)
+    if not trabajo or trabajo.usuario_id != _usuario_actual():
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    return jsonify(trabajo.to_dict())
+
+
+@upload_bp.route('/upload/jobs/<job_id>', methods=['DELETE'])
+@jwt_required()
+def cancelar_carga(job_id):
+    trabajo = obtener_trabajo(job_id)
+    if not trabajo or trabajo.usuario_id != _usuario_actual():
+        return jsonify({"error": "Trabajo no encontrado"}), 404
+    if trabajo.terminado:
+        return jsonify({"error": f"El trabajo ya terminó ({trabajo.estado})"}), 409
+
+    trabajo.cancelar()
+    return jsonify(trabajo.to_dict()), 202
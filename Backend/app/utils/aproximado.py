@@ -0,0 +1,124 @@
+import math
+from statistics import NormalDist
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.utils.consultas import columnas_tabla, validar_columnas, compilar_filtros
+from app.utils.graficos import filas_estimadas, clave_json, validar_numerica, granularidad_temporal
+
+
+AGREGADOS_APROXIMADOS = ('count', 'sum', 'avg')
+# Con fracciones mayores muestrear no ahorra casi nada: se calcula exacto
+FRACCION_MAXIMA = 0.5
+
+
+def fraccion_muestra(total, error, confianza):
+    """
+    Fracción de la tabla necesaria para un error relativo `error` con la
+    confianza pedida, suponiendo coeficiente de variación ~1: n = (z / error)².
+    """
+    if not 0 < error < 1:
+        raise ValueError("'error' debe estar entre 0 y 1")
+    if not 0 < confianza < 1:
+        raise ValueError("'confianza' debe estar entre 0 y 1")
+    z = NormalDist().inv_cdf((1 + confianza) / 2)
+    necesarias = (z / error) ** 2
+    fraccion = necesarias / max(total, 1)
+    return (1.0 if fraccion > FRACCION_MAXIMA else fraccion), z
+
+
+def _estimar(agregado, p, n, suma, suma_cuadrados, desviacion, z):
+    """
+    Estimación e intervalo para una muestra de Bernoulli de fracción p
+    (Horvitz-Thompson para COUNT/SUM, error estándar de la media para AVG).
+    """
+    if agregado == 'count':
+        valor, error_estandar = n / p, math.sqrt(n * (1 - p)) / p
+    elif agregado == 'sum':
+        valor = (suma or 0) / p
+        error_estandar = math.sqrt((1 - p) * (suma_cuadrados or 0)) / p
+    else:
+        if not n:
+            return None, [None, None]
+        valor = suma / n
+        error_estandar = (desviacion or 0) / math.sqrt(n) * math.sqrt(1 - p)
+    return valor, [valor - z * error_estandar, valor + z * error_estandar]
+
+
+def agregar_aproximado(tabla, x, y, agregado, error=0.05, confianza=0.95, filtros=None, granularidad=None):
+    """
+    COUNT/SUM/AVG de y (agrupado por x si se indica) sobre una muestra
+    TABLESAMPLE SYSTEM dimensionada para el error objetivo.
+    SYSTEM muestrea páginas enteras: si los datos están muy agrupados
+    físicamente el intervalo real es algo más ancho que el informado.
+    Devuelve {"valores", "intervalos", "fraccion_muestra", "confianza", "error_objetivo"};
+    sin x, valores e intervalos tienen una sola clave None. `filtros` se
+    compila al WHERE igual que en el cálculo exacto. Con `granularidad` x
+    (temporal) se agrupa por date_trunc, como en agrupar().
+    """
+    agregado = agregado.lower()
+    if agregado not in AGREGADOS_APROXIMADOS:
+        raise ValueError(f"El modo aproximado sólo admite: {', '.join(AGREGADOS_APROXIMADOS)}")
+    tipos = columnas_tabla(tabla)
+    validar_columnas([c for c in (x, y) if c], tipos)
+    if agregado != 'count':
+        if not y:
+            raise ValueError("Columna y requerida")
+        validar_numerica(y, tipos)
+
+    p, z = fraccion_muestra(filas_estimadas(tabla), error, confianza)
+    muestra = f'TABLESAMPLE SYSTEM (:pct)' if p < 1 else ''
+
+    valor = f'"{y}"::float8' if y and agregado != 'count' else 'NULL::float8'
+    agregados = f'COUNT(*), SUM({valor}), SUM({valor} * {valor}), STDDEV_SAMP({valor})'
+    condiciones = [f'"{c}" IS NOT NULL' for c in (x, y if agregado != 'count' else None) if c]
+    filtro, params = compilar_filtros(filtros, tipos)
+    if filtro:
+        condiciones.append(filtro)
+    where = f"WHERE {' AND '.join(condiciones)}" if condiciones else ''
+    if x:
+        grupo = f'date_trunc(:granularidad, "{x}")' if granularidad else f'"{x}"'
+        sql = f'SELECT {grupo}, {agregados} FROM "{tabla}" {muestra} {where} GROUP BY 1 ORDER BY 1'
+    else:
+        sql = f'SELECT NULL, {agregados} FROM "{tabla}" {muestra} {where}'
+
+    valores, intervalos = {}, {}
+    parametros = {**params, "pct": p * 100, "granularidad": granularidad}
+    for fila in db.session.execute(text(sql), parametros).fetchall():
+        clave = clave_json(fila[0])
+        valores[clave], intervalos[clave] = _estimar(agregado, p, *fila[1:], z)
+
+    return {
+        "valores": valores,
+        "intervalos": intervalos,
+        "fraccion_muestra": round(p, 6),
+        "confianza": confianza,
+        "error_objetivo": error,
+    }
+
+
+def grafico_aproximado(tabla, tipo, x, y, opciones):
+    """
+    Versión aproximada de pastel/barras/lineas para `graficar`. Devuelve
+    (datos, detalle) con datos en el mismo formato que el cálculo exacto.
+    """
+    agregados = {'pastel': 'count', 'barras': 'sum' if y else 'count', 'lineas': 'avg'}
+    if tipo not in agregados:
+        raise ValueError(f"El gráfico '{tipo}' no admite modo aproximado")
+    if not x:
+        raise ValueError("Columna x requerida")
+
+    # Las series temporales se agrupan igual que en datos_lineas
+    granularidad = None
+    if tipo == 'lineas':
+        granularidad = granularidad_temporal(
+            tabla, x, opciones.get('granularidad') or None, opciones.get('puntos')
+        )
+
+    resultado = agregar_aproximado(
+        tabla, x, y if agregados[tipo] != 'count' else None, agregados[tipo],
+        float(opciones.get('error') or 0.05), float(opciones.get('confianza') or 0.95),
+        granularidad=granularidad
+    )
+    return resultado.pop("valores"), resultado
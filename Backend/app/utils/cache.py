@@ -0,0 +1,176 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from app.utils.limites import ConsultaInterrumpida, limite_actual
+
+
+# Cada cuánto revisa un hilo en espera si su propio límite se canceló (s)
+INTERVALO_ESPERA = 0.5
+
+
+class _Vuelo:
+    """Cálculo en curso de una clave: los demás hilos esperan su resultado"""
+
+    def __init__(self):
+        self.listo = threading.Event()
+        self.valor = None
+        self.error = None
+
+
+class CacheResultados:
+    """
+    Cache LRU de resultados de gráficos con presupuesto de memoria.
+    Las claves empiezan por (nombre_tabla, tabla_id, version): al escribir en
+    una tabla se incrementa su versión y las entradas viejas dejan de usarse
+    hasta que el LRU las desaloja. Las consultas idénticas concurrentes se
+    coalescen (single-flight): sólo una llega a la base de datos.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entradas = OrderedDict()  # clave -> (valor, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._en_vuelo = {}  # clave -> _Vuelo
+        self.aciertos = 0
+        self.coalescidas = 0
+        self.fallos = 0
+        self.desalojos = 0
+
+    @staticmethod
+    def _tamano(valor):
+        # Aproximación: el tamaño del JSON que se enviaría al cliente
+        return len(json.dumps(valor, default=str))
+
+    def obtener(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            self.aciertos += 1
+            return entrada[0]
+
+    def guardar(self, clave, valor):
+        tamano = self._tamano(valor)
+        if tamano > self.max_bytes:
+            return
+        with self._lock:
+            anterior = self._entradas.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= anterior[1]
+            self._entradas[clave] = (valor, tamano)
+            self._bytes += tamano
+            while self._bytes > self.max_bytes:
+                _, (_, liberados) = self._entradas.popitem(last=False)
+                self._bytes -= liberados
+                self.desalojos += 1
+
+    @staticmethod
+    def _esperar(vuelo, limite, hasta):
+        """
+        Espera el cálculo de otro hilo sin pasarse del límite de este: se
+        corta con su statement_timeout o si lo cancelan mientras espera.
+        """
+        while True:
+            if limite is not None and limite.cancelada:
+                raise ConsultaInterrumpida(limite.clase, limite.ms, cancelada=True)
+            restante = INTERVALO_ESPERA if hasta is None else min(INTERVALO_ESPERA, hasta - time.monotonic())
+            if restante <= 0:
+                raise ConsultaInterrumpida(limite.clase, limite.ms)
+            if vuelo.listo.wait(restante):
+                return
+
+    def obtener_o_calcular(self, clave, calcular):
+        """
+        Devuelve (valor, desde_cache); calcula y guarda si no está. Si otro
+        hilo ya está calculando la misma clave se espera su resultado (o su
+        error), como mucho el statement_timeout del límite de este hilo. Si el
+        cálculo ajeno se canceló (sus clientes se fueron) se vuelve a intentar
+        en vez de propagar la cancelación.
+        """
+        limite = limite_actual()
+        hasta = time.monotonic() + limite.ms / 1000 if limite is not None else None
+        while True:
+            valor = self.obtener(clave)
+            if valor is not None:
+                return valor, True
+
+            with self._lock:
+                vuelo = self._en_vuelo.get(clave)
+                propio = vuelo is None
+                if propio:
+                    vuelo = self._en_vuelo[clave] = _Vuelo()
+                else:
+                    self.coalescidas += 1
+
+            if propio:
+                break
+            self._esperar(vuelo, limite, hasta)
+            if isinstance(vuelo.error, ConsultaInterrumpida) and vuelo.error.cancelada:
+                continue
+            if vuelo.error is not None:
+                raise vuelo.error
+            return vuelo.valor, True
+
+        try:
+            vuelo.valor = calcular()
+            self.guardar(clave, vuelo.valor)
+            return vuelo.valor, False
+        except Exception as e:
+            vuelo.error = e
+            raise
+        finally:
+            with self._lock:
+                self._en_vuelo.pop(clave, None)
+            vuelo.listo.set()
+
+    def descartar_tabla(self, nombre_tabla):
+        with self._lock:
+            for clave in [c for c in self._entradas if c[0] == nombre_tabla]:
+                self._bytes -= self._entradas.pop(clave)[1]
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                "entradas": len(self._entradas),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "desalojos": self.desalojos,
+                "coalescidas": self.coalescidas,
+                "en_vuelo": len(self._en_vuelo),
+                "tasa_aciertos": round(self.aciertos / consultas, 4) if consultas else None,
+            }
+
+
+_cache = None
+_lock = threading.Lock()
+
+
+def cache_graficos(app):
+    """Instancia del proceso, dimensionada con CHART_CACHE_MB"""
+    global _cache
+    with _lock:
+        if _cache is None:
+            _cache = CacheResultados(app.config.get('CHART_CACHE_MB', 64) * 1024 * 1024)
+        return _cache
+
+
+def clave_cache(meta_tabla, *partes):
+    """Clave estable: tabla, id, versión y el resto serializado con orden fijo"""
+    return (
+        meta_tabla.nombre_tabla, meta_tabla.id, meta_tabla.version,
+        json.dumps(partes, sort_keys=True, default=str)
+    )
+
+
+def descartar_tabla(nombre_tabla):
+    """Libera las entradas de una tabla borrada (si la cache ya existe)"""
+    if _cache is not None:
+        _cache.descartar_tabla(nombre_tabla)
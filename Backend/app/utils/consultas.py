@@ -0,0 +1,255 @@
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+
+from app.utils.tipos import ORDEN_FECHA, RANGOS_ENTEROS, VALORES_BOOLEANOS
+from app.utils.esquemas import esquema_registrado
+
+
+OPERADORES = {
+    '=': '=', '==': '=', 'eq': '=',
+    '!=': '<>', '<>': '<>', 'ne': '<>',
+    '>': '>', 'gt': '>',
+    '>=': '>=', 'gte': '>=',
+    '<': '<', 'lt': '<',
+    '<=': '<=', 'lte': '<=',
+}
+
+
+def columnas_tabla(tabla):
+    """Columnas reales de la tabla (incluye la columna id oculta) con su tipo"""
+    registrado = esquema_registrado(tabla)
+    if registrado is None:
+        raise ValueError(f"La tabla '{tabla}' no existe")
+    return registrado.columnas
+
+
+def validar_columnas(columnas, tipos):
+    desconocidas = [c for c in columnas if c not in tipos]
+    if desconocidas:
+        raise ValueError(f"Columnas desconocidas: {', '.join(desconocidas)}")
+    return columnas
+
+
+def _convertir_valor(valor, tipo, columna):
+    """Convierte el valor del filtro al tipo de la columna para enlazarlo como parámetro"""
+    if valor is None:
+        return valor
+    nombre = tipo.nombre
+    try:
+        if nombre in RANGOS_ENTEROS:
+            if isinstance(valor, bool):
+                raise ValueError
+            numero = Decimal(str(valor))
+            if numero % 1 != 0:
+                raise ValueError
+            return int(numero)
+        if nombre in ('NUMERIC', 'DOUBLE PRECISION'):
+            if isinstance(valor, bool):
+                raise ValueError
+            return Decimal(str(valor)) if nombre == 'NUMERIC' else float(valor)
+        if nombre == 'BOOLEAN':
+            if isinstance(valor, bool):
+                return valor
+            return VALORES_BOOLEANOS[str(valor).strip().lower()]
+        if nombre in ORDEN_FECHA:
+            if isinstance(valor, (date, datetime)):
+                return valor
+            texto = str(valor).strip()
+            return date.fromisoformat(texto) if nombre == 'DATE' and len(texto) == 10 else datetime.fromisoformat(texto)
+        if tipo.es_enum and str(valor) not in tipo.valores:
+            # Un valor que no está en el ENUM no coincide con ninguna fila, pero
+            # Postgres daría error al convertirlo: se rechaza aquí con un mensaje claro
+            raise ValueError
+        return str(valor)
+    except (ValueError, KeyError, TypeError, InvalidOperation):
+        raise ValueError(f"Valor inválido para la columna '{columna}': {valor!r}")
+
+
+def normalizar_filtros(filtros):
+    """
+    Acepta los formatos que usa el frontend y devuelve una lista de
+    (columna, operador, valor):
+      - [{"column"|"col": c, "operator"|"op": op, "value": v}, ...]
+      - {"col": v} (igualdad), {"col": [a, b]} (between), {"col": {"op": op, "value": v}}
+    """
+    if not filtros:
+        return []
+
+    normalizados = []
+    if isinstance(filtros, dict):
+        for col, valor in filtros.items():
+            if valor is None or valor == '':
+                continue
+            if isinstance(valor, dict):
+                normalizados.append((col, valor.get('op') or valor.get('operator') or '=', valor.get('value')))
+            elif isinstance(valor, list):
+                normalizados.append((col, 'between' if len(valor) == 2 else 'in', valor))
+            else:
+                normalizados.append((col, '=', valor))
+    elif isinstance(filtros, list):
+        for f in filtros:
+            if not isinstance(f, dict):
+                raise ValueError("Cada filtro debe ser un objeto")
+            col = f.get('column') or f.get('col')
+            op = f.get('operator') or f.get('op') or '='
+            normalizados.append((col, op, f.get('value')))
+    else:
+        raise ValueError("Formato de filtros inválido")
+    return normalizados
+
+
+def compilar_filtros(filtros, tipos, prefijo='f'):
+    """
+    Compila los filtros a una cláusula WHERE parametrizada. Las columnas se
+    validan contra `tipos` y los valores se convierten al tipo de la columna.
+    Devuelve (sql_where, params); sql_where es '' si no hay filtros.
+    """
+    condiciones = []
+    params = {}
+    for i, (col, op, valor) in enumerate(normalizar_filtros(filtros)):
+        if col not in tipos:
+            raise ValueError(f"Columna de filtro desconocida: {col}")
+        op = str(op).lower()
+        tipo = tipos[col]
+        nombre = f"{prefijo}{i}"
+        columna = f'"{col}"'
+
+        if op in OPERADORES:
+            condiciones.append(f'{columna} {OPERADORES[op]} :{nombre}')
+            params[nombre] = _convertir_valor(valor, tipo, col)
+        elif op == 'between':
+            if not isinstance(valor, (list, tuple)) or len(valor) != 2:
+                raise ValueError(f"'between' en '{col}' requiere [desde, hasta]")
+            condiciones.append(f'{columna} BETWEEN :{nombre}_a AND :{nombre}_b')
+            params[f"{nombre}_a"] = _convertir_valor(valor[0], tipo, col)
+            params[f"{nombre}_b"] = _convertir_valor(valor[1], tipo, col)
+        elif op in ('in', 'not_in'):
+            if not isinstance(valor, (list, tuple)) or not valor:
+                raise ValueError(f"'{op}' en '{col}' requiere una lista de valores")
+            marcadores = []
+            for j, v in enumerate(valor):
+                params[f"{nombre}_{j}"] = _convertir_valor(v, tipo, col)
+                marcadores.append(f':{nombre}_{j}')
+            negacion = 'NOT ' if op == 'not_in' else ''
+            condiciones.append(f'{columna} {negacion}IN ({", ".join(marcadores)})')
+        elif op in ('contains', 'starts_with'):
+            patron = str(valor).replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params[nombre] = f"%{patron}%" if op == 'contains' else f"{patron}%"
+            condiciones.append(f'CAST({columna} AS TEXT) ILIKE :{nombre}')
+        elif op == 'is_null':
+            condiciones.append(f'{columna} IS NULL')
+        elif op == 'not_null':
+            condiciones.append(f'{columna} IS NOT NULL')
+        else:
+            raise ValueError(f"Operador de filtro no soportado: {op}")
+
+    return ' AND '.join(condiciones), params
+
+
+def construir_select(tabla, columnas=None, filtros=None, extra=(), condiciones=()):
+    """
+    SELECT parametrizado con proyección y filtros validados contra el esquema.
+    `extra` son columnas que se agregan al final si no están en la proyección
+    (p.ej. las de orden para armar un cursor) y `condiciones` pares (sql, params)
+    que se suman al WHERE con AND.
+    Devuelve (sql, params, columnas_seleccionadas, tipos); las columnas
+    seleccionadas no incluyen las de `extra`.
+    """
+    tipos = columnas_tabla(tabla)
+    seleccion = validar_columnas(columnas, tipos) if columnas else list(tipos.keys())
+    where, params = compilar_filtros(filtros, tipos)
+
+    partes = [where] if where else []
+    for condicion, params_condicion in condiciones:
+        partes.append(condicion)
+        params.update(params_condicion)
+
+    proyeccion = seleccion + [c for c in dict.fromkeys(extra) if c not in seleccion]
+    lista = ', '.join(f'"{c}"' for c in proyeccion)
+    sql = f'SELECT {lista} FROM "{tabla}"'
+    if partes:
+        sql += f' WHERE {" AND ".join(partes)}'
+    return sql, params, seleccion, tipos
+
+
+def parsear_orden(orden, tipos):
+    """
+    'fecha,-monto' -> [('fecha', True), ('monto', False), ('id', True)].
+    Se agrega id como desempate para que el orden sea estable entre páginas.
+    """
+    claves = []
+    for parte in (orden or '').split(','):
+        parte = parte.strip()
+        if not parte:
+            continue
+        ascendente = not parte.startswith('-')
+        col = parte.lstrip('+-')
+        if col not in tipos:
+            raise ValueError(f"Columna de orden desconocida: {col}")
+        claves.append((col, ascendente))
+    if 'id' not in [c for c, _ in claves]:
+        claves.append(('id', True))
+    return claves
+
+
+def sql_orden(claves, invertir=False):
+    """ORDER BY con NULLS LAST en el sentido de lectura (invertido para ir hacia atrás)"""
+    partes = []
+    for col, ascendente in claves:
+        if invertir:
+            partes.append(f'"{col}" {"DESC" if ascendente else "ASC"} NULLS FIRST')
+        else:
+            partes.append(f'"{col}" {"ASC" if ascendente else "DESC"} NULLS LAST')
+    return ', '.join(partes)
+
+
+def condicion_keyset(claves, valores, direccion, prefijo='k', no_nulas=('id',)):
+    """
+    Condición de keyset para un orden de varias columnas con NULLS LAST:
+    filas estrictamente después ('next') o antes ('prev') de `valores`.
+    Las columnas de `no_nulas` (NOT NULL) no llevan la rama IS NULL, así el
+    cursor por defecto queda en "id" > :k0 y usa un range scan del índice.
+    Devuelve (sql, params).
+    """
+    if len(valores) != len(claves):
+        raise ValueError("Cursor inválido para este orden")
+
+    params = {}
+    alternativas = []
+    for i, (col, ascendente) in enumerate(claves):
+        condiciones = []
+        for j in range(i):
+            col_j = claves[j][0]
+            if valores[j] is None:
+                condiciones.append(f'"{col_j}" IS NULL')
+            else:
+                params[f"{prefijo}{j}"] = valores[j]
+                condiciones.append(f'"{col_j}" = :{prefijo}{j}')
+
+        valor = valores[i]
+        params_i = f"{prefijo}{i}"
+        if direccion == 'next':
+            if valor is None:
+                continue  # nada va estrictamente después de un nulo en esta columna
+            operador = '>' if ascendente else '<'
+            if col in no_nulas:
+                condiciones.append(f'"{col}" {operador} :{params_i}')
+            else:
+                condiciones.append(f'("{col}" {operador} :{params_i} OR "{col}" IS NULL)')
+        else:
+            if valor is None:
+                condiciones.append(f'"{col}" IS NOT NULL')
+            else:
+                operador = '<' if ascendente else '>'
+                condiciones.append(f'"{col}" {operador} :{params_i}')
+        if valor is not None:
+            params[params_i] = valor
+        alternativas.append(
+            condiciones[0] if len(condiciones) == 1 else '(' + ' AND '.join(condiciones) + ')'
+        )
+
+    if not alternativas:
+        return 'FALSE', {}
+    if len(alternativas) == 1:
+        return alternativas[0], params
+    return '(' + ' OR '.join(alternativas) + ')', params
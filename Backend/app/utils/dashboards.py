@@ -0,0 +1,462 @@
+import contextvars
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, text, Integer, Float, Numeric
+
+from app.extensions import db
+from app.models.dashboard import ResultadoItem
+from app.utils.cache import cache_graficos, clave_cache
+from app.utils.aproximado import agregar_aproximado
+from app.utils.graficos import granularidad_temporal
+from app.utils.esquemas import esquema_registrado, tabla_sqlalchemy
+from app.utils.consultas import columnas_tabla, compilar_filtros
+from app.utils.rollups import combinacion_item, rollups_vigentes, chart_desde_rollup, kpi_desde_rollup
+from app.utils.limites import ConsultaInterrumpida
+
+
+AGG_MAP = {
+    "SUM": func.sum,
+    "AVG": func.avg,
+    "COUNT": func.count,
+    "MAX": func.max,
+    "MIN": func.min,
+}
+
+
+def _granularidad_item(item, table, x_name):
+    """Granularidad de date_trunc de un chart de líneas (None si no aplica)"""
+    if item.chart_type != "line":
+        return None
+    config = item.config or {}
+    return granularidad_temporal(
+        table.name, x_name,
+        config.get("granularity") or config.get("granularidad"), config.get("points")
+    )
+
+
+def _item_aproximado(table, x_name, y_name, agg_func, aproximado, filtros=None, granularidad=None):
+    """Chart/KPI sobre una muestra: valores con intervalo de confianza"""
+    agregado = agg_func.lower()
+    y_col = table.c.get(y_name)
+    if agregado in ("sum", "avg") and not isinstance(y_col.type, (Integer, Float, Numeric)):
+        agregado = "count"
+    resultado = agregar_aproximado(
+        table.name, x_name, y_name if agregado != "count" else None, agregado,
+        float(aproximado.get("error") or 0.05), float(aproximado.get("confianza") or 0.95),
+        filtros, granularidad
+    )
+    valores, intervalos = resultado.pop("valores"), resultado.pop("intervalos")
+
+    if x_name is None:
+        return {"value": valores.get(None), "ic": intervalos.get(None), "aproximado": resultado}
+    return {
+        "datos": [{"label": k, "value": v, "ic": intervalos[k]} for k, v in valores.items()],
+        "aproximado": resultado
+    }
+
+
+def _vista_rollup(item, table, rollups=None):
+    """
+    (vista, nivel) del rollup vigente del item, o (None, None). `rollups` es
+    el resultado de rollups_vigentes() para su tabla; sin él se consulta.
+    """
+    if rollups is None:
+        rollups = rollups_vigentes([item.table_id])
+    if not rollups:
+        return None, None
+    esquema = esquema_registrado(table.name)
+    combinacion = combinacion_item(item, esquema) if esquema else None
+    if combinacion is None:
+        return None, None
+    x, y, nivel = combinacion
+    return rollups.get((item.table_id, x or '', y, nivel)), nivel
+
+
+def _chart_rollup(item, table, agg_func, numerica, rollups=None):
+    """Datos de un chart sin filtros leídos de su rollup, o None si no hay uno vigente"""
+    config = item.config or {}
+    granularidad = config.get("granularity") or config.get("granularidad")
+    vista, nivel = _vista_rollup(item, table, rollups)
+    if vista is None:
+        return None
+    if not nivel:
+        if item.chart_type == "line" and granularidad:
+            return None  # x no temporal: el cálculo en vivo informa el error
+        return chart_desde_rollup(vista, agg_func, numerica, False)
+    return chart_desde_rollup(vista, agg_func, numerica, granularidad, config.get("points"))
+
+
+def _columna_kpi(config, table):
+    col_name = config.get("column")
+    agg_func = (config.get("agg") or "SUM").upper()
+    if not col_name:
+        raise ValueError("Falta columna KPI")
+    if table.c.get(col_name) is None:
+        raise ValueError("Columna inválida")
+    return col_name, agg_func
+
+
+def expresion_kpi(item, table):
+    """Agregado SQL de un item KPI (p.ej. SUM(col)); ValueError si la config es inválida"""
+    col_name, agg_func = _columna_kpi(item.config or {}, table)
+    return AGG_MAP.get(agg_func, func.sum)(table.c[col_name])
+
+
+def filtro_item(item, table):
+    """
+    DashboardItem.filters compilado a una condición SQL parametrizada
+    (columnas validadas y valores convertidos al tipo de la columna), o None.
+    """
+    if not item.filters:
+        return None
+    where, params = compilar_filtros(item.filters, columnas_tabla(table.name))
+    return text(where).bindparams(**params) if where else None
+
+
+def _filtrar(query, filtro):
+    return query.filter(filtro) if filtro is not None else query
+
+
+def datos_kpis(items, table):
+    """
+    Varios KPI de la misma tabla y filtros en una sola consulta:
+    SELECT agg1(a), agg2(b), ... WHERE <filtros>. Devuelve {item_id: datos} y
+    {item_id: error} para los items con configuración inválida.
+    """
+    expresiones, errores = {}, {}
+    for item in items:
+        try:
+            expresiones[item.id] = expresion_kpi(item, table)
+        except ValueError as e:
+            errores[item.id] = e
+    if not expresiones:
+        return {}, errores
+
+    # Todos comparten filtros: se compilan con los del primero
+    filtro = filtro_item(items[0], table)
+    fila = _filtrar(db.session.query(*expresiones.values()), filtro).one()
+    return {item_id: {"value": valor} for item_id, valor in zip(expresiones, fila)}, errores
+
+
+def datos_item(item, table, aproximado=None, rollups=None):
+    """
+    Calcula los datos de un item; los errores de configuración son ValueError.
+    Con `aproximado` ({"error", "confianza"}) chart y KPI se estiman sobre una muestra.
+    `rollups` son los rollups vigentes ya cargados (ver rollups_vigentes).
+    """
+    config = item.config or {}
+    item_type = item.item_type
+    filtro = filtro_item(item, table) if item_type != "text" else None
+
+    # --- CHART (bar, line, pie) ---
+    if item_type == "chart":
+        x_name = config.get("x") or config.get("x_axis")
+        y_name = config.get("y") or config.get("y_axis")
+        agg_func = (config.get("agg") or config.get("aggregation") or "SUM").upper() 
+
+        if not x_name or not y_name:
+            raise ValueError("Faltan columnas x/y")
+
+        x_col = table.c.get(x_name)
+        y_col = table.c.get(y_name)
+        if x_col is None or y_col is None:
+            raise ValueError("Columnas inválidas")
+
+        if aproximado is not None:
+            return _item_aproximado(
+                table, x_name, y_name, agg_func, aproximado, item.filters,
+                _granularidad_item(item, table, x_name)
+            )
+
+        numerica = isinstance(y_col.type, (Integer, Float, Numeric))
+        if filtro is None:
+            datos = _chart_rollup(item, table, agg_func, numerica, rollups)
+            if datos is not None:
+                return datos
+
+        agg_func_callable = AGG_MAP.get(agg_func, func.sum)
+
+        if numerica:
+            agg = agg_func_callable(y_col)
+        else:
+            if agg_func in ("SUM", "AVG"):
+                agg = func.count(y_col)
+            else:
+                agg = agg_func_callable(y_col)
+
+        # Series temporales: date_trunc a la granularidad pedida o a la elegida por rango
+        grupo = x_col
+        granularidad = _granularidad_item(item, table, x_name)
+        if granularidad:
+            grupo = func.date_trunc(granularidad, x_col)
+
+        query = _filtrar(db.session.query(grupo.label("label"), agg.label("value")), filtro).group_by(grupo)
+        if grupo is not x_col:
+            query = query.order_by(grupo)
+        rows = query.all()
+        return [{"label": r.label, "value": r.value} for r in rows]
+
+    # --- KPI ---
+    elif item_type == "kpi":
+        if aproximado is not None:
+            col_name, agg_func = _columna_kpi(config, table)
+            return _item_aproximado(table, None, col_name, agg_func, aproximado, item.filters)
+
+        if filtro is None:
+            vista, _ = _vista_rollup(item, table, rollups)
+            if vista is not None:
+                col_name, agg_func = _columna_kpi(config, table)
+                numerica = isinstance(table.c[col_name].type, (Integer, Float, Numeric))
+                return kpi_desde_rollup(vista, agg_func, numerica)
+
+        value = _filtrar(db.session.query(expresion_kpi(item, table)), filtro).scalar()
+        return {"value": value}
+
+    # --- TABLE ---
+    elif item_type == "table":
+        cols = config.get("columns", [])
+        if cols is None:
+            raise ValueError("Faltan columnas para tabla")
+
+        selected = [table.c[c] for c in cols if c in table.c]
+        if not selected:
+            raise ValueError("Columnas inválidas")
+
+        rows = _filtrar(db.session.query(*selected), filtro).limit(100).all()
+        return [dict(zip(cols, r)) for r in rows]
+
+    # --- TEXTO ---
+    elif item_type == "text":
+        return {"text": config.get("text", "")}
+
+    raise ValueError(f"Tipo de item '{item_type}' no soportado")
+
+
+def definicion_item(item):
+    """Lo que determina el resultado de un item: si cambia, lo precalculado deja de servir"""
+    return (item.item_type, item.chart_type, item.config, item.filters)
+
+
+def vigente(resultado, item, meta_tabla, ahora=None):
+    """
+    Un resultado precalculado sirve si no tiene error, se calculó con la
+    versión actual de la tabla y no pasó más de refresh_interval segundos.
+    """
+    if resultado is None or resultado.error is not None or not item.refresh_interval:
+        return False
+    if resultado.version_tabla != meta_tabla.version:
+        return False
+    ahora = ahora or datetime.utcnow()
+    return resultado.calculado_en + timedelta(seconds=item.refresh_interval) > ahora
+
+
+def resultados_vigentes(items, metas):
+    """{item_id: datos} de los items con un resultado precalculado vigente (una consulta)"""
+    ids = [item.id for item in items if item.refresh_interval]
+    if not ids:
+        return {}
+    guardados = {r.item_id: r for r in ResultadoItem.query.filter(ResultadoItem.item_id.in_(ids)).all()}
+    ahora = datetime.utcnow()
+    return {
+        item.id: guardados[item.id].datos
+        for item in items
+        if item.table_id in metas and vigente(guardados.get(item.id), item, metas[item.table_id], ahora)
+    }
+
+
+def tabla_item(nombre_tabla):
+    """Tabla de SQLAlchemy sobre la que se consultan los items (del registro de esquemas)"""
+    return tabla_sqlalchemy(nombre_tabla)
+
+
+def opciones_aproximado(args):
+    """{"error", "confianza"} si la petición trae ?aproximado=1, si no None"""
+    if args.get("aproximado", "").lower() in ("1", "true", "si"):
+        return {k: args.get(k) for k in ("error", "confianza")}
+    return None
+
+
+def _clave_item(meta_tabla, item, aproximado=None):
+    # Mismo item y misma versión de la tabla -> mismo resultado
+    return clave_cache(meta_tabla, "item", *definicion_item(item), aproximado)
+
+
+def datos_item_cacheado(app, meta_tabla, item, table, aproximado=None, rollups=None):
+    """datos_item servido desde la cache de resultados: (datos, desde_cache)"""
+    return cache_graficos(app).obtener_o_calcular(
+        _clave_item(meta_tabla, item, aproximado), lambda: datos_item(item, table, aproximado, rollups)
+    )
+
+
+_executor = None
+_lock = threading.Lock()
+
+
+def _obtener_executor(app):
+    global _executor
+    with _lock:
+        if _executor is None:
+            # Acotado para no agotar el pool de conexiones del engine
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get('DASHBOARD_WORKERS', 4),
+                thread_name_prefix='dashboard'
+            )
+        return _executor
+
+
+def _evaluar_kpis(app, meta_tabla, table, items, rollups):
+    """
+    Los KPI que comparten filtros y no están en cache se resuelven juntos con
+    datos_kpis(): N KPI sobre la misma tabla cuestan un solo recorrido. Los
+    que tienen un rollup vigente quedan afuera: leer el rollup es más barato.
+    """
+    cache = cache_graficos(app)
+    por_filtros = {}
+    for item in items:
+        if item.item_type == "kpi" and _vista_rollup(item, table, rollups)[0] is None:
+            por_filtros.setdefault(json.dumps(item.filters or {}, sort_keys=True, default=str), []).append(item)
+
+    resultados = {}
+    for grupo in por_filtros.values():
+        faltantes = []
+        for item in grupo:
+            datos = cache.obtener(_clave_item(meta_tabla, item))
+            if datos is not None:
+                resultados[item.id] = {"item_id": item.id, "data": datos, "error": None,
+                                       "status": 200, "cached": True, "ms": 0.0}
+            else:
+                faltantes.append(item)
+        if len(faltantes) < 2:
+            continue  # uno solo se evalúa como cualquier otro item
+
+        inicio = time.perf_counter()
+        try:
+            valores, errores = datos_kpis(faltantes, table)
+        except ConsultaInterrumpida as e:
+            # Reintentarlos de a uno volvería a agotar el tiempo: todos quedan interrumpidos
+            db.session.rollback()
+            ms = round((time.perf_counter() - inicio) * 1000, 1)
+            for item in faltantes:
+                resultados[item.id] = _interrumpido(item, e, ms)
+            continue
+        except Exception:
+            db.session.rollback()
+            continue  # se reintentan de a uno para informar el error de cada item
+        ms = round((time.perf_counter() - inicio) * 1000, 1)
+
+        for item in faltantes:
+            if item.id in errores:
+                resultados[item.id] = {"item_id": item.id, "data": None, "error": str(errores[item.id]),
+                                       "status": 400, "cached": False, "ms": 0.0}
+                continue
+            cache.guardar(_clave_item(meta_tabla, item), valores[item.id])
+            resultados[item.id] = {"item_id": item.id, "data": valores[item.id], "error": None,
+                                   "status": 200, "cached": False, "combined": len(valores), "ms": ms}
+    return resultados
+
+
+def _interrumpido(item, error, ms):
+    return {"item_id": item.id, "data": None, "error": str(error), "status": error.status,
+            "cached": False, "timeout": True, "ms": ms}
+
+
+def _tareas(items, aproximado):
+    """
+    Reparte los items de una tabla en tareas del pool: los KPI que comparten
+    filtros van juntos (un solo SELECT); cada uno de los demás es su propia tarea.
+    """
+    kpis = {}
+    for item in items:
+        if item.item_type == "kpi" and aproximado is None:
+            kpis.setdefault(json.dumps(item.filters or {}, sort_keys=True, default=str), []).append(item)
+        else:
+            yield [item]
+    yield from kpis.values()
+
+
+def _evaluar_grupo(app, meta_tabla, items, aproximado, rollups):
+    """Evalúa en un hilo una tarea (items de una misma tabla), con su propio contexto y sesión"""
+    resultados = {}
+    with app.app_context():
+        try:
+            table = tabla_item(meta_tabla.nombre_tabla)
+            if table is not None and aproximado is None:
+                resultados.update(_evaluar_kpis(app, meta_tabla, table, items, rollups))
+            for item in items:
+                if item.id in resultados:
+                    continue
+                inicio = time.perf_counter()
+                resultado = {"item_id": item.id, "data": None, "error": None, "cached": False}
+                try:
+                    if table is None:
+                        raise LookupError("Tabla no encontrada")
+                    resultado["data"], resultado["cached"] = datos_item_cacheado(
+                        app, meta_tabla, item, table, aproximado, rollups
+                    )
+                    resultado["status"] = 200
+                except ValueError as e:
+                    resultado["error"], resultado["status"] = str(e), 400
+                except LookupError as e:
+                    resultado["error"], resultado["status"] = str(e), 404
+                except ConsultaInterrumpida as e:
+                    db.session.rollback()
+                    resultado.update(_interrumpido(item, e, 0.0))
+                except Exception as e:
+                    db.session.rollback()
+                    resultado["error"], resultado["status"] = str(e), 500
+                resultado["ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+                resultados[item.id] = resultado
+        finally:
+            db.session.remove()
+    return resultados
+
+
+def evaluar_items(app, items, metas, usuario_id, aproximado=None):
+    """
+    Datos de varios items en una sola pasada: cada item (o cada lote de KPI
+    de la misma tabla y filtros) es una tarea del pool de DASHBOARD_WORKERS
+    hilos, así un dashboard de una sola tabla también se evalúa en paralelo. `metas` es
+    {table_id: MetaTabla}. Devuelve un resultado por item, en el orden de
+    `items`, con status, error y tiempo en ms. Sin `aproximado` se usan los
+    resultados precalculados por el refresco cuando están vigentes.
+    Los hilos heredan el contexto del llamador (su límite de consultas):
+    un item que agota el tiempo vuelve con status 504 y "timeout" sin
+    afectar al resto.
+    """
+    grupos = {}
+    resultados = {}
+    # Los items con un resultado precalculado vigente no se recalculan
+    materializados = resultados_vigentes(items, metas) if aproximado is None else {}
+    for item in items:
+        meta_tabla = metas.get(item.table_id)
+        if meta_tabla is not None and item.id in materializados and meta_tabla.usuario_id == usuario_id:
+            resultados[item.id] = {"item_id": item.id, "data": materializados[item.id], "error": None,
+                                   "status": 200, "cached": True, "materialized": True, "ms": 0.0}
+        elif meta_tabla is None:
+            resultados[item.id] = {"item_id": item.id, "data": None, "error": "Tabla no encontrada",
+                                   "status": 404, "cached": False, "ms": 0.0}
+        elif meta_tabla.usuario_id != usuario_id:
+            resultados[item.id] = {"item_id": item.id, "data": None, "error": "No autorizado",
+                                   "status": 403, "cached": False, "ms": 0.0}
+        else:
+            grupos.setdefault(item.table_id, []).append(item)
+
+    # Los rollups de todas las tablas se buscan una vez, no uno por item
+    rollups = rollups_vigentes(grupos) if grupos and aproximado is None else {}
+
+    executor = _obtener_executor(app)
+    futuros = [
+        executor.submit(
+            contextvars.copy_context().run, _evaluar_grupo, app, metas[table_id], tarea, aproximado, rollups
+        )
+        for table_id, grupo in grupos.items()
+        for tarea in _tareas(grupo, aproximado)
+    ]
+    for futuro in futuros:
+        resultados.update(futuro.result())
+
+    return [resultados[item.id] for item in items]
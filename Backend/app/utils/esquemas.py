@@ -0,0 +1,92 @@
+import threading
+
+from sqlalchemy import (
+    MetaData, Table, Column, Integer, SmallInteger, BigInteger, Numeric, Float,
+    Boolean, Date, DateTime, Text
+)
+
+from app.utils.tipos import ORDEN_NUMERICO, ORDEN_FECHA, TipoColumna, esquema_tabla
+
+
+# Tipos de SQLAlchemy para construir la Table sin reflejarla
+TIPOS_SQLALCHEMY = {
+    'SMALLINT': SmallInteger,
+    'INTEGER': Integer,
+    'BIGINT': BigInteger,
+    'NUMERIC': Numeric,
+    'DOUBLE PRECISION': Float,
+    'BOOLEAN': Boolean,
+    'DATE': Date,
+    'TIMESTAMP': DateTime,
+    'TIMESTAMPTZ': lambda: DateTime(timezone=True),
+}
+
+PALABRAS_FECHA = ("fecha", "date", "time", "created", "updated")
+
+
+def categoria(nombre, tipo):
+    """numeric, temporal o categorical según el tipo Postgres de la columna"""
+    if tipo.nombre in ORDEN_NUMERICO:
+        return "numeric"
+    if tipo.nombre in ORDEN_FECHA:
+        return "temporal"
+    if tipo.nombre == 'TEXT':
+        # Textos con nombre de fecha que no se pudieron convertir al cargar
+        normalizado = nombre.lower().replace("_", "").replace(" ", "")
+        if any(p in normalizado for p in PALABRAS_FECHA):
+            return "temporal"
+    return "categorical"
+
+
+class EsquemaRegistrado:
+    """Columnas, tipos, categorías y Table de SQLAlchemy de una tabla de usuario"""
+
+    def __init__(self, nombre, tipos):
+        self.nombre = nombre
+        self.tipos = tipos  # el dict de esquema_tabla() del que se derivó
+        self.columnas = {"id": TipoColumna('INTEGER'), **tipos}
+        self.categorias = {c: categoria(c, t) for c, t in tipos.items()}
+
+        # MetaData propia: las tablas dinámicas no deben entrar en db.metadata (create_all)
+        self.tabla = Table(
+            nombre, MetaData(),
+            Column("id", Integer, primary_key=True),
+            *[Column(c, TIPOS_SQLALCHEMY.get(t.nombre, Text)()) for c, t in tipos.items()]
+        )
+
+    def to_dict(self):
+        return {
+            c: {"tipo": t.nombre, "categoria": self.categorias[c]}
+            for c, t in self.tipos.items()
+        }
+
+
+_registro = {}
+_lock = threading.Lock()
+
+
+def esquema_registrado(nombre_tabla):
+    """
+    Esquema de la tabla, reflejado una vez por proceso. Se apoya en la cache
+    de esquema_tabla(): cuando invalidar_esquema() la descarta (al crear,
+    alterar o eliminar en este proceso) o vence su TTL (cambios hechos por
+    otro worker) y los tipos releídos difieren, el registro se reconstruye.
+    Devuelve None si la tabla no existe.
+    """
+    tipos = esquema_tabla(nombre_tabla)
+    if not tipos:
+        with _lock:
+            _registro.pop(nombre_tabla, None)
+        return None
+    with _lock:
+        registrado = _registro.get(nombre_tabla)
+        if registrado is None or (registrado.tipos is not tipos and registrado.tipos != tipos):
+            registrado = EsquemaRegistrado(nombre_tabla, tipos)
+            _registro[nombre_tabla] = registrado
+        return registrado
+
+
+def tabla_sqlalchemy(nombre_tabla):
+    """Table de SQLAlchemy de una tabla de usuario, o None si no existe"""
+    registrado = esquema_registrado(nombre_tabla)
+    return registrado.tabla if registrado else None
@@ -0,0 +1,191 @@
+import json
+import queue
+import threading
+import time
+
+from app.extensions import db
+from app.decorators import make_json_serializable
+from app.models.dashboard import Dashboard
+from app.models.tablas import MetaTabla
+from app.utils.dashboards import evaluar_items, definicion_item
+from app.utils.limites import aplicar_limite, limite_de
+
+
+class CanalDashboard:
+    """
+    Un canal por (dashboard, usuario): un único hilo calcula los items en
+    cada tick y reparte a todos los suscriptores sólo los resultados que
+    cambiaron. La carga sobre Postgres depende de los widgets, no de las
+    pestañas abiertas.
+    """
+
+    def __init__(self, app, dash_id, usuario_id, tick):
+        self.app = app
+        self.dash_id = dash_id
+        self.usuario_id = usuario_id
+        self.tick = tick
+        self.suscriptores = set()
+        self.ultimos = {}      # item_id -> evento ya enviado (para la foto inicial)
+        self._firmas = {}      # item_id -> JSON del último resultado
+        self._proximo = {}     # item_id -> instante (monotonic) del próximo cálculo
+        self._definiciones = {}  # item_id -> definición con la que se calculó (JSON)
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._limite = None    # límite de la pasada en curso, para cancelarla
+
+    def suscribir(self):
+        cola = queue.Queue(maxsize=1000)
+        with self._lock:
+            for evento in self.ultimos.values():
+                cola.put_nowait(evento)
+            self.suscriptores.add(cola)
+            if self._hilo is None:
+                # Canal dormido que se reactiva: la primera pasada vuelve a calcular todo
+                self._proximo.clear()
+                self._hilo = threading.Thread(
+                    target=self._ciclo, name=f'sse-dashboard-{self.dash_id}', daemon=True
+                )
+                self._hilo.start()
+        return cola
+
+    def desuscribir(self, cola):
+        with self._lock:
+            self.suscriptores.discard(cola)
+            limite = self._limite if not self.suscriptores else None
+        if limite is not None:
+            # Se fue el último cliente: las consultas en curso se cancelan en Postgres
+            limite.cancelar()
+
+    def suscrito(self, cola):
+        with self._lock:
+            return cola in self.suscriptores
+
+    def _publicar(self, evento):
+        with self._lock:
+            self.ultimos[evento["item_id"]] = evento
+            for cola in list(self.suscriptores):
+                try:
+                    cola.put_nowait(evento)
+                except queue.Full:
+                    # Cliente que no consume: se lo desconecta (flujo_sse cierra el stream)
+                    self.suscriptores.discard(cola)
+
+    def _vencidos(self, items, ahora):
+        """
+        Primera pasada: todos los items; luego sólo los editados y los que
+        tienen refresh_interval vencido.
+        """
+        vencidos = []
+        for item in items:
+            proximo = self._proximo.get(item.id)
+            definicion = json.dumps(definicion_item(item), sort_keys=True, default=str)
+            editado = self._definiciones.get(item.id) != definicion
+            if proximo is None or editado or (item.refresh_interval and proximo <= ahora):
+                self._definiciones[item.id] = definicion
+                vencidos.append(item)
+                self._proximo[item.id] = ahora + (item.refresh_interval or float('inf'))
+        return vencidos
+
+    def _pasada(self):
+        limite = limite_de(self.app, 'dashboard')
+        with self._lock:
+            self._limite = limite
+        with self.app.app_context(), aplicar_limite(limite):
+            try:
+                dash = Dashboard.query.get(self.dash_id)
+                if dash is None:
+                    return False
+                items = self._vencidos(dash.items, time.monotonic())
+                if not items:
+                    return True
+                ids = {item.table_id for item in items}
+                metas = {m.id: m for m in MetaTabla.query.filter(MetaTabla.id.in_(ids)).all()}
+
+                for resultado in evaluar_items(self.app, items, metas, self.usuario_id):
+                    if limite.cancelada:
+                        # Nadie escucha: se recalcula cuando vuelva a haber suscriptores
+                        self._proximo.pop(resultado["item_id"], None)
+                        continue
+                    evento = {
+                        "item_id": resultado["item_id"],
+                        "data": make_json_serializable(resultado["data"]),
+                        "error": resultado["error"],
+                        "status": resultado["status"],
+                    }
+                    firma = json.dumps(evento, sort_keys=True, default=str)
+                    if self._firmas.get(evento["item_id"]) != firma:
+                        self._firmas[evento["item_id"]] = firma
+                        self._publicar(evento)
+                return True
+            finally:
+                with self._lock:
+                    self._limite = None
+                db.session.remove()
+
+    def _ciclo(self):
+        while True:
+            with self._lock:
+                if not self.suscriptores:
+                    self._hilo = None
+                    return
+            try:
+                if not self._pasada():
+                    self._publicar({"item_id": None, "data": None, "error": "Dashboard eliminado", "status": 404})
+            except Exception as e:
+                self.app.logger.warning(f"SSE dashboard {self.dash_id}: {e}")
+            time.sleep(self.tick)
+
+
+_canales = {}
+_lock = threading.Lock()
+
+
+def canal_dashboard(app, dash_id, usuario_id):
+    with _lock:
+        clave = (dash_id, usuario_id)
+        canal = _canales.get(clave)
+        if canal is None:
+            canal = CanalDashboard(app, dash_id, usuario_id, app.config.get('DASHBOARD_STREAM_TICK', 5))
+            _canales[clave] = canal
+        return canal
+
+
+def _suscribir(canal):
+    """
+    Suscribe al canal registrado para (dashboard, usuario). Si el canal se
+    descartó entre canal_dashboard() y el inicio del flujo, se lo vuelve a
+    registrar; si ya hay otro, se usa ese.
+    """
+    with _lock:
+        canal = _canales.setdefault((canal.dash_id, canal.usuario_id), canal)
+        return canal, canal.suscribir()
+
+
+def _desuscribir(canal, cola):
+    """Con el último suscriptor el canal sale del registro (y con él sus resultados)"""
+    with _lock:
+        canal.desuscribir(cola)
+        clave = (canal.dash_id, canal.usuario_id)
+        if not canal.suscriptores and _canales.get(clave) is canal:
+            del _canales[clave]
+
+
+def flujo_sse(canal, latido=15):
+    """
+    Generador text/event-stream; manda un comentario de latido si no hay
+    cambios. Si el canal descartó la cola (cliente que no consumía) el stream
+    termina: el cliente reconecta y recibe la foto actual.
+    """
+    canal, cola = _suscribir(canal)
+    try:
+        yield "retry: 5000\n\n"
+        while canal.suscrito(cola):
+            try:
+                evento = cola.get(timeout=latido)
+            except queue.Empty:
+                yield ": ping\n\n"
+                continue
+            yield f"event: item\ndata: {json.dumps(evento, default=str)}\n\n"
+    finally:
+        # El cliente cerró la conexión (GeneratorExit) o terminó el servidor
+        _desuscribir(canal, cola)
@@ -0,0 +1,438 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.utils.consultas import columnas_tabla, validar_columnas
+from app.utils.tipos import ORDEN_FECHA, ORDEN_NUMERICO
+
+
+MAX_CUBETAS = 500
+
+METODOS_DISPERSION = ('muestra', 'grilla', 'lttb')
+# Por encima de estas filas la dispersión se agrega en grilla en vez de muestrear
+UMBRAL_GRILLA = 5_000_000
+# LTTB recorre todas las filas ordenadas en Python: sólo hasta este tamaño
+MAX_FILAS_LTTB = 2_000_000
+
+# Granularidades de date_trunc para series temporales, con su duración aproximada
+GRANULARIDADES = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400,
+    'month': 30 * 86400,
+    'quarter': 91 * 86400,
+    'year': 365 * 86400,
+}
+# Puntos por defecto (y máximo admitido) de una serie temporal
+PUNTOS_OBJETIVO = 500
+MAX_PUNTOS_SERIE = 5000
+
+
+def clave_json(valor):
+    """Las claves de un objeto JSON no pueden ser fechas ni Decimal"""
+    if isinstance(valor, (datetime, date)):
+        return valor.isoformat()
+    if isinstance(valor, Decimal):
+        return float(valor)
+    return valor
+
+
+def _numero(valor):
+    if isinstance(valor, Decimal):
+        return int(valor) if valor % 1 == 0 else float(valor)
+    return valor
+
+
+def validar_numerica(col, tipos):
+    if tipos[col].nombre not in ORDEN_NUMERICO:
+        raise ValueError(f"La columna '{col}' no es numérica")
+
+
+def agrupar(tabla, x, y=None, agregado='count', ordenar=False, granularidad=None):
+    """
+    GROUP BY x en Postgres: sólo viajan las columnas x/y y el resultado
+    agregado. Devuelve {valor_x: agregado}; los x nulos se excluyen, igual
+    que en value_counts/groupby de pandas. Con `granularidad` x (temporal)
+    se agrupa por date_trunc.
+    """
+    tipos = columnas_tabla(tabla)
+    validar_columnas([x] + ([y] if y else []), tipos)
+
+    if agregado == 'count':
+        expresion = 'COUNT(*)'
+    else:
+        validar_numerica(y, tipos)
+        expresion = {
+            'sum': f'COALESCE(SUM("{y}"), 0)',
+            'avg': f'AVG("{y}")',
+        }[agregado]
+
+    grupo = f'date_trunc(:granularidad, "{x}")' if granularidad else f'"{x}"'
+    sql = f'SELECT {grupo} AS x, {expresion} FROM "{tabla}" WHERE "{x}" IS NOT NULL GROUP BY 1'
+    if ordenar:
+        sql += ' ORDER BY 1'
+
+    filas = db.session.execute(text(sql), {"granularidad": granularidad}).fetchall()
+    return {clave_json(k): _numero(v) for k, v in filas}
+
+
+def elegir_granularidad(tabla, x, puntos=PUNTOS_OBJETIVO):
+    """
+    La granularidad más fina de GRANULARIDADES que deja el rango de x en
+    `puntos` cubetas o menos.
+    """
+    minimo, maximo = db.session.execute(
+        text(f'SELECT MIN("{x}"), MAX("{x}") FROM "{tabla}"')
+    ).fetchone()
+    if minimo is None:
+        return 'day'
+    if not isinstance(minimo, datetime):
+        minimo = datetime(minimo.year, minimo.month, minimo.day)
+        maximo = datetime(maximo.year, maximo.month, maximo.day)
+    rango = (maximo - minimo).total_seconds()
+
+    for granularidad, segundos in GRANULARIDADES.items():
+        if rango / segundos <= puntos:
+            return granularidad
+    return 'year'
+
+
+def granularidad_temporal(tabla, x, granularidad=None, puntos=None):
+    """
+    Granularidad para agrupar x: None si x no es temporal; la pedida si se
+    indica (validada) o la elegida por rango y cantidad de puntos.
+    """
+    tipos = columnas_tabla(tabla)
+    validar_columnas([x], tipos)
+    if tipos[x].nombre not in ORDEN_FECHA:
+        if granularidad:
+            raise ValueError(f"La columna '{x}' no es de fecha: no admite granularidad")
+        return None
+    if granularidad:
+        if granularidad not in GRANULARIDADES:
+            raise ValueError(f"Granularidad inválida, use una de: {', '.join(GRANULARIDADES)}")
+        return granularidad
+    puntos = int(puntos or PUNTOS_OBJETIVO)
+    if not 1 <= puntos <= MAX_PUNTOS_SERIE:
+        raise ValueError(f"'puntos' debe estar entre 1 y {MAX_PUNTOS_SERIE}")
+    return elegir_granularidad(tabla, x, puntos)
+
+
+def datos_pastel(tabla, x):
+    return agrupar(tabla, x)
+
+
+def datos_barras(tabla, x, y=None):
+    return agrupar(tabla, x, y, 'sum') if y else agrupar(tabla, x)
+
+
+def datos_lineas(tabla, x, y, granularidad=None, puntos=None):
+    """Promedio de y por x; si x es temporal se agrupa con date_trunc"""
+    granularidad = granularidad_temporal(tabla, x, granularidad, puntos)
+    return agrupar(tabla, x, y, 'avg', ordenar=True, granularidad=granularidad)
+
+
+def datos_histograma(tabla, x, cubetas=10):
+    """
+    Histograma con width_bucket sobre [min, max] calculado en Postgres.
+    Igual que np.histogram: el máximo cae en la última cubeta y, si todos los
+    valores son iguales, el rango se abre ±0.5. Devuelve {"labels", "values"}.
+    """
+    if not 1 <= cubetas <= MAX_CUBETAS:
+        raise ValueError(f"'bins' debe estar entre 1 y {MAX_CUBETAS}")
+    tipos = columnas_tabla(tabla)
+    validar_columnas([x], tipos)
+    validar_numerica(x, tipos)
+
+    sql = f'''
+        WITH rango AS (
+            SELECT MIN("{x}")::float8 AS lo, MAX("{x}")::float8 AS hi FROM "{tabla}"
+        ), limites AS (
+            SELECT CASE WHEN lo = hi THEN lo - 0.5 ELSE lo END AS lo,
+                   CASE WHEN lo = hi THEN hi + 0.5 ELSE hi END AS hi
+            FROM rango
+        )
+        SELECT l.lo, l.hi,
+               LEAST(width_bucket(t."{x}"::float8, l.lo, l.hi, :n), :n) AS cubeta,
+               COUNT(*)
+        FROM "{tabla}" t, limites l
+        WHERE t."{x}" IS NOT NULL
+        GROUP BY l.lo, l.hi, cubeta
+    '''
+    filas = db.session.execute(text(sql), {"n": cubetas}).fetchall()
+
+    lo, hi = (filas[0][0], filas[0][1]) if filas else (0.0, 1.0)
+    conteos = [0] * cubetas
+    for _, _, cubeta, total in filas:
+        conteos[cubeta - 1] = total
+
+    ancho = (hi - lo) / cubetas
+    bordes = [lo + i * ancho for i in range(cubetas)] + [hi]
+    return {
+        "labels": [f"{bordes[i]:.2f}-{bordes[i+1]:.2f}" for i in range(cubetas)],
+        "values": conteos
+    }
+
+
+def _resumen(fila):
+    total, media, desviacion, minimo, cuartiles, maximo = fila
+    return {
+        "count": float(total),
+        "mean": media,
+        "std": desviacion,
+        "min": minimo,
+        "25%": cuartiles[0],
+        "50%": cuartiles[1],
+        "75%": cuartiles[2],
+        "max": maximo,
+    }
+
+
+def datos_boxplot(tabla, y, x=None):
+    """
+    Resumen de describe() (count, mean, std, min, cuartiles, max) por grupo
+    de x, con percentile_cont en Postgres. Sin x, un único resumen de y.
+    """
+    tipos = columnas_tabla(tabla)
+    validar_columnas([y] + ([x] if x else []), tipos)
+    validar_numerica(y, tipos)
+
+    agregados = f'''
+        COUNT(*), AVG("{y}")::float8, STDDEV_SAMP("{y}")::float8,
+        MIN("{y}")::float8,
+        percentile_cont(ARRAY[0.25, 0.5, 0.75]) WITHIN GROUP (ORDER BY "{y}"::float8),
+        MAX("{y}")::float8
+    '''
+    if x:
+        sql = (f'SELECT "{x}", {agregados} FROM "{tabla}" '
+               f'WHERE "{x}" IS NOT NULL AND "{y}" IS NOT NULL GROUP BY "{x}" ORDER BY "{x}"')
+        filas = db.session.execute(text(sql)).fetchall()
+        return {str(clave_json(fila[0])): _resumen(fila[1:]) for fila in filas}
+
+    sql = f'SELECT {agregados} FROM "{tabla}" WHERE "{y}" IS NOT NULL'
+    fila = db.session.execute(text(sql)).fetchone()
+    if not fila[0]:
+        return {"count": 0.0}
+    return _resumen(fila)
+
+
+def filas_estimadas(tabla):
+    """reltuples de pg_class; si la tabla nunca se analizó se cuenta"""
+    estimadas = db.session.execute(
+        text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:t)"), {"t": f'"{tabla}"'}
+    ).scalar()
+    if estimadas is None or estimadas < 0:
+        return db.session.execute(text(f'SELECT COUNT(*) FROM "{tabla}"')).scalar()
+    return int(estimadas)
+
+
+def _a_numero(valor):
+    if isinstance(valor, datetime):
+        return valor.timestamp()
+    if isinstance(valor, date):
+        return datetime(valor.year, valor.month, valor.day).timestamp()
+    return float(valor)
+
+
+def lttb(puntos, umbral):
+    """
+    Largest-Triangle-Three-Buckets sobre puntos (x, y) ordenados por x:
+    conserva la forma de la serie con `umbral` puntos.
+    """
+    n = len(puntos)
+    if umbral >= n or umbral < 3:
+        return puntos
+
+    xs = [_a_numero(p[0]) for p in puntos]
+    ys = [float(p[1]) for p in puntos]
+    elegidos = [puntos[0]]
+    ancho = (n - 2) / (umbral - 2)
+    a = 0
+
+    for i in range(umbral - 2):
+        # Promedio de la cubeta siguiente (tercer vértice del triángulo)
+        inicio_sig = int((i + 1) * ancho) + 1
+        fin_sig = min(int((i + 2) * ancho) + 1, n)
+        cantidad = fin_sig - inicio_sig
+        media_x = sum(xs[inicio_sig:fin_sig]) / cantidad
+        media_y = sum(ys[inicio_sig:fin_sig]) / cantidad
+
+        # Punto de la cubeta actual que forma el triángulo de mayor área
+        inicio = int(i * ancho) + 1
+        fin = int((i + 1) * ancho) + 1
+        mayor, elegido = -1.0, inicio
+        for j in range(inicio, fin):
+            area = abs((xs[a] - media_x) * (ys[j] - ys[a]) - (xs[a] - xs[j]) * (media_y - ys[a]))
+            if area > mayor:
+                mayor, elegido = area, j
+        elegidos.append(puntos[elegido])
+        a = elegido
+
+    elegidos.append(puntos[-1])
+    return elegidos
+
+
+def _muestra(tabla, x, y, max_puntos, total):
+    """Muestra aleatoria con TABLESAMPLE BERNOULLI (REPEATABLE: estable entre refrescos)"""
+    porcentaje = min(100.0, 100.0 * max_puntos / max(total, 1) * 1.2)
+    sql = (f'SELECT "{x}", "{y}" FROM "{tabla}" TABLESAMPLE BERNOULLI (:pct) REPEATABLE (0) '
+           f'WHERE "{x}" IS NOT NULL AND "{y}" IS NOT NULL LIMIT :n')
+    return db.session.execute(text(sql), {"pct": porcentaje, "n": max_puntos}).fetchall()
+
+
+def _grilla(tabla, x, y, max_puntos, temporal):
+    """
+    Densidad en una grilla de √max_puntos × √max_puntos celdas: un punto por
+    celda ocupada (centroide) con la cantidad de filas que representa.
+    """
+    lado = max(int(max_puntos ** 0.5), 1)
+    expr_x = f'EXTRACT(EPOCH FROM "{x}")::float8' if temporal else f'"{x}"::float8'
+    sql = f'''
+        WITH datos AS (
+            SELECT {expr_x} AS px, "{y}"::float8 AS py FROM "{tabla}"
+            WHERE "{x}" IS NOT NULL AND "{y}" IS NOT NULL
+        ), rango AS (
+            SELECT MIN(px) AS x0, NULLIF(MAX(px), MIN(px)) AS x1,
+                   MIN(py) AS y0, NULLIF(MAX(py), MIN(py)) AS y1
+            FROM datos
+        )
+        SELECT AVG(px), AVG(py), COUNT(*)
+        FROM datos, rango
+        GROUP BY LEAST(COALESCE(width_bucket(px, x0, x1, :lado), 1), :lado),
+                 LEAST(COALESCE(width_bucket(py, y0, y1, :lado), 1), :lado)
+    '''
+    filas = db.session.execute(text(sql), {"lado": lado}).fetchall()
+    if temporal:
+        return [(datetime.utcfromtimestamp(px), py, c) for px, py, c in filas]
+    return filas
+
+
+def datos_dispersion(tabla, x, y, max_puntos=None, metodo=None):
+    """
+    Puntos (x, y) para el gráfico de dispersión. Con `max_puntos` se reduce en
+    el servidor: 'muestra' (TABLESAMPLE), 'grilla' (densidad por celdas) o
+    'lttb' (x ordenado). Sin método se elige según el tamaño y el tipo de x.
+    """
+    tipos = columnas_tabla(tabla)
+    validar_columnas([x, y], tipos)
+    if metodo and metodo not in METODOS_DISPERSION:
+        raise ValueError(f"Método inválido, use uno de: {', '.join(METODOS_DISPERSION)}")
+    if max_puntos is not None and max_puntos < 1:
+        raise ValueError("'max_points' debe ser positivo")
+
+    total = filas_estimadas(tabla) if max_puntos else None
+    filas = None
+    if not max_puntos or total <= max_puntos:
+        sql = f'SELECT "{x}", "{y}" FROM "{tabla}" WHERE "{x}" IS NOT NULL AND "{y}" IS NOT NULL'
+        params = {}
+        if max_puntos:
+            # reltuples puede estar desactualizado (o ser -1): una fila de más indica que hay que reducir
+            sql += ' LIMIT :tope'
+            params["tope"] = max_puntos + 1
+        filas = db.session.execute(text(sql), params).fetchall()
+        if max_puntos and len(filas) > max_puntos:
+            # La tabla creció desde el último ANALYZE: se cuenta y se reduce como una grande
+            total = db.session.execute(text(f'SELECT COUNT(*) FROM "{tabla}"')).scalar()
+            filas = None
+        else:
+            metodo = 'ninguno'
+
+    if filas is None:
+        temporal = tipos[x].nombre in ORDEN_FECHA
+        ordenable = temporal or tipos[x].nombre in ORDEN_NUMERICO
+        if metodo is None:
+            if total > UMBRAL_GRILLA and ordenable and tipos[y].nombre in ORDEN_NUMERICO:
+                metodo = 'grilla'
+            elif temporal and total <= MAX_FILAS_LTTB:
+                metodo = 'lttb'
+            else:
+                metodo = 'muestra'
+        if metodo in ('grilla', 'lttb'):
+            if not ordenable:
+                raise ValueError(f"'{metodo}' requiere una columna x numérica o de fecha")
+            validar_numerica(y, tipos)
+
+        if metodo == 'muestra':
+            filas = _muestra(tabla, x, y, max_puntos, total)
+        elif metodo == 'grilla':
+            filas = _grilla(tabla, x, y, max_puntos, temporal)
+        else:
+            sql = (f'SELECT "{x}", "{y}" FROM "{tabla}" '
+                   f'WHERE "{x}" IS NOT NULL AND "{y}" IS NOT NULL ORDER BY "{x}"')
+            filas = lttb(db.session.execute(text(sql)).fetchall(), max_puntos)
+
+    puntos = []
+    for fila in filas:
+        punto = {x: clave_json(fila[0]), y: _numero(fila[1])}
+        if metodo == 'grilla':
+            punto["count"] = fila[2]
+        puntos.append(punto)
+    return {"points": puntos, "metodo": metodo, "filas_totales": total}
+
+
+def datos_heatmap(tabla):
+    """Matriz de correlación entre las columnas numéricas (corr() de Postgres por par)"""
+    tipos = columnas_tabla(tabla)
+    numericas = [c for c, t in tipos.items() if c != 'id' and t.nombre in ORDEN_NUMERICO]
+    if not numericas:
+        return {}
+
+    pares = [(a, b) for i, a in enumerate(numericas) for b in numericas[i:]]
+    expresiones = ', '.join(f'corr("{a}"::float8, "{b}"::float8)' for a, b in pares)
+    fila = db.session.execute(text(f'SELECT {expresiones} FROM "{tabla}"')).fetchone()
+
+    matriz = {c: {} for c in numericas}
+    for (a, b), valor in zip(pares, fila):
+        valor = round(valor, 2) if valor is not None else None
+        matriz[a][b] = valor
+        matriz[b][a] = valor
+    return matriz
+
+
+def calcular_grafico(tabla, tipo, x=None, y=None, opciones=None):
+    """
+    Datos de un gráfico de `graficar` por tipo. Los parámetros faltantes o
+    inválidos se informan con ValueError.
+    """
+    opciones = opciones or {}
+
+    if tipo == 'pastel':
+        if not x:
+            raise ValueError("Columna x requerida para gráfico pastel")
+        return datos_pastel(tabla, x)
+
+    if tipo == 'barras':
+        if not x:
+            raise ValueError("Columna x requerida")
+        return datos_barras(tabla, x, y)
+
+    if tipo == 'lineas':
+        if not x or not y:
+            raise ValueError("Columnas x e y requeridas")
+        return datos_lineas(tabla, x, y, opciones.get('granularidad') or None, opciones.get('puntos'))
+
+    if tipo == 'histograma':
+        if not x:
+            raise ValueError("Columna x requerida para histograma")
+        return datos_histograma(tabla, x, int(opciones.get('bins') or 10))
+
+    if tipo == 'boxplot':
+        if not y:
+            raise ValueError("Columna y requerida")
+        return datos_boxplot(tabla, y, x)
+
+    if tipo == 'dispersión':
+        if not x or not y:
+            raise ValueError("Columnas x e y requeridas")
+        max_puntos = opciones.get('max_points')
+        return datos_dispersion(
+            tabla, x, y, int(max_puntos) if max_puntos else None, opciones.get('metodo') or None
+        )
+
+    if tipo == 'heatmap':
+        return datos_heatmap(tabla)
+
+    raise ValueError("Tipo de gráfico no soportado")
@@ -0,0 +1,517 @@
+import hashlib
+import re
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import load_workbook
+from flask import current_app
+from sqlalchemy import text
+from app.extensions import db
+from app.models.tablas import (
+    crear_tabla_dinamica, copiar_bloque, copiar_lote_arrow, normalizar_columnas,
+    eliminar_tabla_fisica, incrementar_version, MetaTabla
+)
+from app.utils.tipos import TipoColumna, inferir_tipos, ajustar_bloque, tipos_tabla, fijar_formatos
+
+
+FORMATOS_ARROW = {'parquet', 'arrow', 'feather', 'ipc'}
+
+
+def leer_csv_por_bloques(archivo, filas_por_bloque):
+    """Lee un CSV en bloques de tamaño fijo sin cargar el archivo completo"""
+    return pd.read_csv(archivo, chunksize=filas_por_bloque)
+
+
+def leer_hoja_por_bloques(hoja, filas_por_bloque):
+    """
+    Recorre una hoja de openpyxl abierta en modo read-only y devuelve
+    DataFrames de tamaño fijo. La primera fila se usa como encabezado y las
+    filas completamente vacías se descartan.
+    """
+    filas = hoja.iter_rows(values_only=True)
+    encabezado = next(filas, None)
+    if encabezado is None:
+        return
+
+    columnas = [
+        str(valor) if valor is not None else f"columna_{i + 1}"
+        for i, valor in enumerate(encabezado)
+    ]
+    ancho = len(columnas)
+
+    lote = []
+    for fila in filas:
+        if all(valor is None for valor in fila):
+            continue
+        lote.append(fila[:ancho])
+        if len(lote) >= filas_por_bloque:
+            yield pd.DataFrame.from_records(lote, columns=columnas)
+            lote = []
+    if lote:
+        yield pd.DataFrame.from_records(lote, columns=columnas)
+
+
+def _partir_lotes(lotes, filas_por_bloque):
+    """Corta los RecordBatch grandes en trozos de tamaño fijo (zero-copy)"""
+    for lote in lotes:
+        for inicio in range(0, lote.num_rows, filas_por_bloque):
+            yield lote.slice(inicio, filas_por_bloque)
+
+
+def leer_arrow_por_lotes(ruta, extension, filas_por_bloque):
+    """
+    Abre un Parquet o un Arrow IPC (formato archivo o stream) con memory map.
+    Devuelve (esquema, iterador de RecordBatch, filas_totales o None).
+    """
+    if extension == 'parquet':
+        archivo = pq.ParquetFile(ruta, memory_map=True)
+        lotes = archivo.iter_batches(batch_size=filas_por_bloque)
+        return archivo.schema_arrow, lotes, archivo.metadata.num_rows
+
+    fuente = pa.memory_map(ruta)
+    try:
+        lector = pa.ipc.open_file(fuente)
+        lotes = (lector.get_batch(i) for i in range(lector.num_record_batches))
+    except pa.ArrowInvalid:
+        fuente.seek(0)
+        lector = pa.ipc.open_stream(fuente)
+    else:
+        return lector.schema, _partir_lotes(lotes, filas_por_bloque), None
+    return lector.schema, _partir_lotes(lector, filas_por_bloque), None
+
+
+def tipo_arrow(tipo):
+    """Tipo Postgres para un tipo de Arrow; None si no se puede cargar con COPY"""
+    if pa.types.is_dictionary(tipo):
+        tipo = tipo.value_type
+    if pa.types.is_boolean(tipo):
+        return TipoColumna('BOOLEAN')
+    if pa.types.is_int8(tipo) or pa.types.is_int16(tipo) or pa.types.is_uint8(tipo):
+        return TipoColumna('SMALLINT')
+    if pa.types.is_int32(tipo) or pa.types.is_uint16(tipo):
+        return TipoColumna('INTEGER')
+    if pa.types.is_int64(tipo) or pa.types.is_uint32(tipo):
+        return TipoColumna('BIGINT')
+    if pa.types.is_uint64(tipo) or pa.types.is_decimal(tipo):
+        return TipoColumna('NUMERIC')
+    if pa.types.is_floating(tipo):
+        return TipoColumna('DOUBLE PRECISION')
+    if pa.types.is_date(tipo):
+        return TipoColumna('DATE')
+    if pa.types.is_timestamp(tipo):
+        return TipoColumna('TIMESTAMPTZ' if tipo.tz else 'TIMESTAMP')
+    if pa.types.is_time(tipo):
+        return TipoColumna('TIME')
+    if pa.types.is_string(tipo) or pa.types.is_large_string(tipo):
+        return TipoColumna('TEXT')
+    return None
+
+
+def _normalizar_lote(lote):
+    """Decodifica diccionarios y baja los timestamps a microsegundos (resolución de Postgres)"""
+    columnas = []
+    for col in lote.columns:
+        if pa.types.is_dictionary(col.type):
+            col = col.cast(col.type.value_type)
+        if pa.types.is_timestamp(col.type) and col.type.unit == 'ns':
+            col = col.cast(pa.timestamp('us', tz=col.type.tz), safe=False)
+        columnas.append(col)
+    return pa.RecordBatch.from_arrays(columnas, names=lote.schema.names)
+
+
+def ingestar_lotes_arrow(nombre_tabla, esquema, lotes, progreso=None):
+    """
+    Crea la tabla con los tipos del esquema embebido en el archivo y carga los
+    RecordBatch con COPY en una sola transacción.
+    Devuelve (mensaje, columnas, filas_insertadas).
+    """
+    columnas = normalizar_columnas(esquema.names)
+    tipos = {}
+    no_soportadas = []
+    for col, campo in zip(columnas, esquema):
+        tipo = tipo_arrow(campo.type)
+        if tipo is None:
+            no_soportadas.append(f"{campo.name} ({campo.type})")
+        tipos[col] = tipo
+    if no_soportadas:
+        raise ValueError(f"Tipos de columna no soportados: {', '.join(no_soportadas)}")
+
+    success, msg = crear_tabla_dinamica(nombre_tabla, pd.DataFrame(columns=columnas), tipos)
+    if not success:
+        raise ValueError(msg)
+
+    filas = 0
+    try:
+        for lote in lotes:
+            copiadas = copiar_lote_arrow(nombre_tabla, _normalizar_lote(lote), columnas)
+            filas += copiadas
+            if progreso:
+                progreso(copiadas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        eliminar_tabla_fisica(nombre_tabla)
+        db.session.commit()
+        raise
+
+    analizar_tabla(nombre_tabla)
+    return msg, columnas, filas
+
+
+def analizar_tabla(nombre_tabla):
+    """
+    ANALYZE después de una carga: las estimaciones de filas (reltuples) que
+    usan los gráficos para decidir si reducen puntos quedan al día.
+    """
+    try:
+        db.session.execute(text(f'ANALYZE "{nombre_tabla}"'))
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.warning(f"ANALYZE {nombre_tabla}: {e}")
+
+
+def _con_primero(primero, resto):
+    if primero is not None:
+        yield primero
+    yield from resto
+
+
+def ingestar_bloques(nombre_tabla, bloques, progreso=None):
+    """
+    Crea la tabla a partir del primer bloque y carga todos los bloques con COPY
+    en una sola transacción. Si algo falla se elimina la tabla recién creada.
+
+    Los tipos de columna se infieren de una muestra (el primer bloque) y se
+    amplían con ALTER TABLE si un bloque posterior trae valores que no encajan.
+    progreso(filas) se llama después de cada bloque y puede lanzar una
+    excepción para abortar la carga.
+    Devuelve (mensaje, columnas, filas_insertadas).
+    """
+    bloques = iter(bloques)
+    primero = next(bloques, None)
+    if primero is None or primero.empty:
+        raise ValueError("El archivo no contiene filas")
+
+    primero.columns = normalizar_columnas(primero.columns)
+    muestra = primero.head(current_app.config.get('UPLOAD_SAMPLE_ROWS', len(primero)))
+    tipos = inferir_tipos(muestra)
+
+    success, msg = crear_tabla_dinamica(nombre_tabla, primero, tipos)
+    if not success:
+        raise ValueError(msg)
+
+    columnas = list(primero.columns)
+    filas = 0
+    try:
+        for bloque in _con_primero(primero, bloques):
+            bloque.columns = normalizar_columnas(bloque.columns)
+            bloque = ajustar_bloque(nombre_tabla, tipos, bloque)
+            copiadas = copiar_bloque(nombre_tabla, bloque)
+            filas += copiadas
+            if progreso:
+                progreso(copiadas)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        eliminar_tabla_fisica(nombre_tabla)
+        db.session.commit()
+        raise
+
+    analizar_tabla(nombre_tabla)
+    return msg, columnas, filas
+
+
+def _preparar_upsert(nombre_tabla, clave):
+    """
+    Índice único sobre la clave, necesario para ON CONFLICT. Se reutiliza un
+    índice existente sólo si pg_index confirma que su clave son exactamente esas
+    columnas (las columnas INCLUDE no cuentan: indkey las lista después de las
+    indnkeyatts de la clave); el nombre lleva un hash de la clave para que dos
+    claves largas no terminen con el mismo nombre truncado.
+    """
+    existe = db.session.execute(text("""
+        SELECT EXISTS (
+            SELECT 1 FROM pg_index i
+            WHERE i.indrelid = to_regclass(:tabla)
+              AND i.indisunique AND i.indisvalid
+              AND i.indpred IS NULL AND i.indexprs IS NULL
+              AND i.indnkeyatts = :n
+              AND (SELECT array_agg(a.attname::text ORDER BY a.attname::text)
+                   FROM unnest(i.indkey::int2[]) WITH ORDINALITY AS k(attnum, posicion)
+                   JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = k.attnum
+                   WHERE k.posicion <= i.indnkeyatts) = :columnas
+        )
+    """), {"tabla": f'"{nombre_tabla}"', "n": len(clave), "columnas": sorted(clave)}).scalar()
+    if existe:
+        return
+
+    firma = hashlib.md5(','.join(clave).encode()).hexdigest()[:12]
+    nombre_indice = f"uq_{nombre_tabla[:45]}_{firma}"
+    columnas_clave = ', '.join(f'"{c}"' for c in clave)
+    db.session.execute(text(
+        f'CREATE UNIQUE INDEX "{nombre_indice}" ON "{nombre_tabla}" ({columnas_clave})'
+    ))
+
+
+def _upsert_bloque(nombre_tabla, bloque, clave):
+    """
+    Copia el bloque a una tabla temporal y lo vuelca con INSERT ... ON CONFLICT.
+    Las filas que ya existen y no cambian no se reescriben.
+    Devuelve (insertadas, actualizadas).
+    """
+    staging = f"_carga_{nombre_tabla}"[:63]
+    columnas = list(bloque.columns)
+    lista = ', '.join(f'"{c}"' for c in columnas)
+
+    # Se recrea en cada bloque por si un ALTER anterior cambió los tipos.
+    # pg_temp: el DROP nunca puede alcanzar una tabla de usuario con ese nombre
+    db.session.execute(text(f'DROP TABLE IF EXISTS pg_temp."{staging}"'))
+    db.session.execute(text(
+        f'CREATE TEMP TABLE "{staging}" ON COMMIT DROP AS '
+        f'SELECT {lista} FROM "{nombre_tabla}" WITH NO DATA'
+    ))
+    copiar_bloque(staging, bloque)
+
+    actualizar = [c for c in columnas if c not in clave]
+    if actualizar:
+        set_sql = ', '.join(f'"{c}" = EXCLUDED."{c}"' for c in actualizar)
+        actuales = ', '.join(f'"{nombre_tabla}"."{c}"' for c in actualizar)
+        nuevos = ', '.join(f'EXCLUDED."{c}"' for c in actualizar)
+        conflicto = f'DO UPDATE SET {set_sql} WHERE ({actuales}) IS DISTINCT FROM ({nuevos})'
+    else:
+        conflicto = 'DO NOTHING'
+
+    sql = f"""
+        WITH escritas AS (
+            INSERT INTO "{nombre_tabla}" ({lista})
+            SELECT {lista} FROM pg_temp."{staging}"
+            ON CONFLICT ({', '.join(f'"{c}"' for c in clave)}) {conflicto}
+            RETURNING (xmax = 0) AS insertada
+        )
+        SELECT count(*) FILTER (WHERE insertada), count(*) FILTER (WHERE NOT insertada)
+        FROM escritas
+    """
+    insertadas, actualizadas = db.session.execute(text(sql)).one()
+    return insertadas, actualizadas
+
+
+def anexar_bloques(nombre_tabla, bloques, clave=None, progreso=None):
+    """
+    Carga bloques en una tabla existente. Sin `clave` las filas se anexan con
+    COPY; con `clave` (lista de columnas) se hace upsert por lotes con
+    ON CONFLICT. Las columnas entrantes deben existir en la tabla y los tipos
+    se amplían igual que al crearla. Todo corre en una sola transacción.
+    Devuelve (mensaje, columnas, filas_insertadas, filas_actualizadas).
+    """
+    tipos = tipos_tabla(nombre_tabla)
+    if not tipos:
+        raise ValueError(f"La tabla '{nombre_tabla}' no existe")
+
+    columnas = None
+    insertadas = actualizadas = 0
+    try:
+        if clave:
+            faltantes = [c for c in clave if c not in tipos]
+            if faltantes:
+                raise ValueError(f"Columnas de clave inexistentes: {', '.join(faltantes)}")
+            _preparar_upsert(nombre_tabla, clave)
+
+        for bloque in bloques:
+            bloque.columns = normalizar_columnas(bloque.columns)
+            if columnas is None:
+                columnas = list(bloque.columns)
+                desconocidas = [c for c in columnas if c not in tipos]
+                if desconocidas:
+                    raise ValueError(
+                        f"Columnas que no existen en '{nombre_tabla}': {', '.join(desconocidas)}"
+                    )
+                if clave and any(c not in columnas for c in clave):
+                    raise ValueError("El archivo no trae todas las columnas de la clave")
+                # Orden día/mes de las fechas de texto: se fija con el primer bloque para todo el archivo
+                fijar_formatos(tipos, bloque)
+
+            bloque = ajustar_bloque(nombre_tabla, tipos, bloque)
+            if clave:
+                bloque = bloque.drop_duplicates(subset=clave, keep='last')
+                nuevas, cambiadas = _upsert_bloque(nombre_tabla, bloque, clave)
+                insertadas += nuevas
+                actualizadas += cambiadas
+            else:
+                insertadas += copiar_bloque(nombre_tabla, bloque)
+            if progreso:
+                progreso(len(bloque))
+
+        if columnas is None:
+            raise ValueError("El archivo no contiene filas")
+        incrementar_version(nombre_tabla)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    analizar_tabla(nombre_tabla)
+    msg = f"{insertadas} fila(s) insertada(s) y {actualizadas} actualizada(s) en '{nombre_tabla}'."
+    return msg, columnas, insertadas, actualizadas
+
+
+def _cargar(trabajo, nombre_tabla, bloques, progreso):
+    """Crea la tabla o anexa/actualiza según trabajo.opciones['modo']"""
+    modo = trabajo.opciones.get('modo', 'crear')
+
+    if modo == 'crear':
+        msg, columnas, filas = ingestar_bloques(nombre_tabla, bloques, progreso=progreso)
+        meta_tabla = _registrar_tabla(nombre_tabla, trabajo.usuario_id)
+        return msg, {
+            "tabla": nombre_tabla,
+            "tabla_id": meta_tabla.id,
+            "creada": True,
+            "columnas": columnas,
+            "filas_insertadas": filas
+        }
+
+    clave = trabajo.opciones.get('clave') if modo == 'upsert' else None
+    msg, columnas, insertadas, actualizadas = anexar_bloques(
+        nombre_tabla, bloques, clave=clave, progreso=progreso
+    )
+    return msg, {
+        "tabla": nombre_tabla,
+        "tabla_id": trabajo.opciones.get('tabla_id'),
+        "creada": False,
+        "columnas": columnas,
+        "filas_insertadas": insertadas,
+        "filas_actualizadas": actualizadas
+    }
+
+
+def _registrar_tabla(nombre_tabla, usuario_id):
+    meta_tabla = MetaTabla(nombre_tabla=nombre_tabla, usuario_id=usuario_id)
+    db.session.add(meta_tabla)
+    db.session.commit()
+    return meta_tabla
+
+
+def _deshacer_cargas(cargas):
+    """Elimina las tablas ya creadas por un trabajo que terminó con error"""
+    db.session.rollback()
+    for carga in cargas:
+        if not carga.get("creada"):
+            continue
+        eliminar_tabla_fisica(carga["tabla"])
+        MetaTabla.query.filter_by(id=carga["tabla_id"]).delete()
+    db.session.commit()
+
+
+def _resumen(cargas, mensaje):
+    resumen = {
+        "mensaje": mensaje,
+        "tablas": cargas,
+        "filas_insertadas": sum(c["filas_insertadas"] for c in cargas),
+        "filas_actualizadas": sum(c.get("filas_actualizadas", 0) for c in cargas)
+    }
+    if len(cargas) == 1:
+        resumen.update(tabla_id=cargas[0]["tabla_id"], columnas=cargas[0]["columnas"])
+    return resumen
+
+
+def _ingestar_xlsx(trabajo, filas_por_bloque):
+    """
+    Carga un libro Excel en modo read-only. Por defecto se usa la primera hoja;
+    opciones['hoja'] elige otra y opciones['todas_las_hojas'] crea una tabla
+    por hoja con el nombre '<tabla>_<hoja>'.
+    """
+    hoja_pedida = trabajo.opciones.get('hoja')
+    todas = trabajo.opciones.get('todas_las_hojas', False)
+
+    libro = load_workbook(trabajo.ruta, read_only=True, data_only=True)
+    cargas = []
+    try:
+        if todas:
+            hojas = [
+                (f"{trabajo.nombre_tabla}_{re.sub(r'[^a-zA-Z0-9]', '_', h.title).lower()}", h)
+                for h in libro.worksheets
+            ]
+        elif hoja_pedida:
+            if hoja_pedida not in libro.sheetnames:
+                raise ValueError(f"La hoja '{hoja_pedida}' no existe en el archivo")
+            hojas = [(trabajo.nombre_tabla, libro[hoja_pedida])]
+        else:
+            hojas = [(trabajo.nombre_tabla, libro.worksheets[0])]
+
+        # max_row sale de las dimensiones guardadas en el archivo (puede faltar)
+        trabajo.filas_totales = sum((h.max_row or 0) for _, h in hojas) or None
+
+        for nombre_tabla, hoja in hojas:
+            bloques = leer_hoja_por_bloques(hoja, filas_por_bloque)
+            primero = next(bloques, None)
+            if primero is None and todas:
+                # En modo multi-hoja se saltan las hojas vacías
+                continue
+
+            msg, carga = _cargar(
+                trabajo, nombre_tabla, _con_primero(primero, bloques), trabajo.avanzar
+            )
+            carga["hoja"] = hoja.title
+            cargas.append(carga)
+    except Exception:
+        _deshacer_cargas(cargas)
+        raise
+    finally:
+        libro.close()
+
+    if not cargas:
+        raise ValueError("El archivo no contiene filas")
+    if len(cargas) == 1:
+        return _resumen(cargas, msg)
+    return _resumen(cargas, f"{len(cargas)} tabla(s) creada(s) exitosamente.")
+
+
+def _ingestar_arrow(trabajo, filas_por_bloque):
+    """
+    Parquet / Arrow IPC. Al crear se usa el camino columnar nativo; al anexar
+    o hacer upsert los lotes pasan a pandas para validarse contra la tabla.
+    """
+    esquema, lotes, total = leer_arrow_por_lotes(trabajo.ruta, trabajo.extension, filas_por_bloque)
+    trabajo.filas_totales = total
+
+    if trabajo.opciones.get('modo', 'crear') != 'crear':
+        bloques = (lote.to_pandas() for lote in lotes)
+        msg, carga = _cargar(trabajo, trabajo.nombre_tabla, bloques, trabajo.avanzar)
+        return _resumen([carga], msg)
+
+    msg, columnas, filas = ingestar_lotes_arrow(
+        trabajo.nombre_tabla, esquema, lotes, progreso=trabajo.avanzar
+    )
+    meta_tabla = _registrar_tabla(trabajo.nombre_tabla, trabajo.usuario_id)
+    return _resumen([{
+        "tabla": trabajo.nombre_tabla,
+        "tabla_id": meta_tabla.id,
+        "creada": True,
+        "columnas": columnas,
+        "filas_insertadas": filas
+    }], msg)
+
+
+def ejecutar_ingesta(trabajo):
+    """
+    Cuerpo de un TrabajoIngesta: lee el archivo guardado en disco, lo carga
+    y registra la MetaTabla del usuario. Devuelve el resumen de la carga.
+    """
+    filas_por_bloque = current_app.config['UPLOAD_CHUNK_ROWS']
+
+    if trabajo.extension == 'xlsx':
+        return _ingestar_xlsx(trabajo, filas_por_bloque)
+
+    if trabajo.extension in FORMATOS_ARROW:
+        return _ingestar_arrow(trabajo, filas_por_bloque)
+
+    with open(trabajo.ruta, 'rb') as archivo:
+        bloques = leer_csv_por_bloques(archivo, filas_por_bloque)
+        msg, carga = _cargar(
+            trabajo,
+            trabajo.nombre_tabla,
+            bloques,
+            lambda filas: trabajo.avanzar(filas, archivo.tell())
+        )
+
+    return _resumen([carga], msg)
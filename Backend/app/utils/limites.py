@@ -0,0 +1,182 @@
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from flask import current_app, jsonify
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+
+from app.extensions import db
+
+
+# Clase de endpoint -> variable de configuración con su statement_timeout (ms)
+CLASES = {
+    'browse': 'STATEMENT_TIMEOUT_BROWSE_MS',
+    'chart': 'STATEMENT_TIMEOUT_CHART_MS',
+    'dashboard': 'STATEMENT_TIMEOUT_DASHBOARD_MS',
+    'scenario': 'STATEMENT_TIMEOUT_SCENARIO_MS',
+}
+
+# SQLSTATE query_canceled: lo usa Postgres tanto para statement_timeout como para cancelaciones
+QUERY_CANCELED = '57014'
+
+
+class ConsultaInterrumpida(Exception):
+    """Una consulta cortada por statement_timeout o cancelada porque el cliente se fue"""
+
+    def __init__(self, clase, ms, cancelada=False):
+        self.clase = clase
+        self.ms = ms
+        self.cancelada = cancelada
+        self.status = 499 if cancelada else 504
+        if cancelada:
+            mensaje = "La consulta se canceló porque el cliente se desconectó"
+        elif ms is None:
+            mensaje = "La consulta superó el tiempo límite"
+        else:
+            mensaje = f"La consulta superó el tiempo límite de {ms} ms ({clase})"
+        super().__init__(mensaje)
+
+    def to_dict(self):
+        return {"error": str(self), "timeout": not self.cancelada, "limite_ms": self.ms}
+
+
+class LimiteConsultas:
+    """
+    Presupuesto de una clase de endpoint: fija statement_timeout en cada
+    transacción que se abre dentro de aplicar_limite() y recuerda las
+    conexiones en uso para poder cancelar su consulta (cancelar()).
+    """
+
+    def __init__(self, clase, ms):
+        self.clase = clase
+        self.ms = ms
+        self.cancelada = False
+        self._conexiones = {}  # sesión -> conexión psycopg2 con transacción abierta
+        self._lock = threading.Lock()
+
+    def registrar(self, sesion, conexion_dbapi):
+        with self._lock:
+            self._conexiones[sesion] = conexion_dbapi
+
+    def liberar(self, sesion):
+        with self._lock:
+            self._conexiones.pop(sesion, None)
+
+    def cancelar(self):
+        """Cancela en Postgres lo que estén ejecutando las conexiones registradas"""
+        with self._lock:
+            self.cancelada = True
+            conexiones = list(self._conexiones.values())
+        for conexion in conexiones:
+            try:
+                conexion.cancel()
+            except Exception:
+                pass  # la conexión ya se cerró o no hay nada en curso
+
+
+_actual = ContextVar('limite_consultas', default=None)
+
+
+def limite_actual():
+    """Límite aplicado en este contexto (None fuera de aplicar_limite)"""
+    return _actual.get()
+
+
+def limite_de(app, clase):
+    return LimiteConsultas(clase, int(app.config.get(CLASES[clase], 30000)))
+
+
+def _conexion_dbapi(connection):
+    fairy = connection.connection
+    return getattr(fairy, 'dbapi_connection', None) or fairy.connection
+
+
+def fijar_timeout(connection, limite):
+    # set_config(..., true) equivale a SET LOCAL: vuelve al valor del servidor al terminar la transacción
+    connection.execute(
+        text("SELECT set_config('statement_timeout', :ms, true)"), {"ms": str(limite.ms)}
+    )
+
+
+@contextmanager
+def aplicar_limite(limite):
+    """
+    Las transacciones de db.session abiertas dentro del bloque (en este hilo
+    o en los que copian el contexto) corren con el statement_timeout del límite.
+    """
+    token = _actual.set(limite)
+    sesion = db.session()
+    try:
+        if sesion.in_transaction():
+            # Transacción ya abierta (p.ej. por la consulta de MetaTabla): se ajusta ahora
+            connection = sesion.connection()
+            fijar_timeout(connection, limite)
+            sesion.info['limite_consultas'] = limite
+            limite.registrar(sesion, _conexion_dbapi(connection))
+        yield limite
+    finally:
+        _actual.reset(token)
+
+
+def limitar_consultas(clase):
+    """Decorador de rutas: statement_timeout de la clase durante toda la vista"""
+    def decorador(fn):
+        @wraps(fn)
+        def envoltura(*args, **kwargs):
+            with aplicar_limite(limite_de(current_app, clase)):
+                return fn(*args, **kwargs)
+        return envoltura
+    return decorador
+
+
+def _al_empezar(sesion, transaccion, connection):
+    limite = _actual.get()
+    if limite is None:
+        return
+    if limite.cancelada:
+        # Cancelado antes de empezar: no se lanza la consulta
+        raise ConsultaInterrumpida(limite.clase, limite.ms, cancelada=True)
+    fijar_timeout(connection, limite)
+    sesion.info['limite_consultas'] = limite
+    limite.registrar(sesion, _conexion_dbapi(connection))
+
+
+def _al_terminar(sesion, transaccion):
+    # Sólo la transacción raíz devuelve la conexión al pool: desde ahí no se
+    # la puede cancelar (podría estar ejecutando la consulta de otro)
+    if transaccion.parent is None:
+        limite = sesion.info.pop('limite_consultas', None)
+        if limite is not None:
+            limite.liberar(sesion)
+
+
+def _traducir_error(contexto):
+    original = contexto.original_exception
+    if getattr(original, 'pgcode', None) != QUERY_CANCELED:
+        return None
+    limite = _actual.get()
+    if limite is None:
+        return ConsultaInterrumpida(None, None, cancelada='user request' in str(original))
+    return ConsultaInterrumpida(limite.clase, limite.ms, cancelada=limite.cancelada)
+
+
+_registrado = False
+_lock = threading.Lock()
+
+
+def iniciar_limites(app):
+    """Registra (una vez por proceso) los eventos de sesión y motor, y el manejador de errores"""
+    global _registrado
+    with _lock:
+        if not _registrado:
+            event.listen(db.session, 'after_begin', _al_empezar)
+            event.listen(db.session, 'after_transaction_end', _al_terminar)
+            event.listen(Engine, 'handle_error', _traducir_error)
+            _registrado = True
+
+    @app.errorhandler(ConsultaInterrumpida)
+    def consulta_interrumpida(e):
+        db.session.rollback()
+        return jsonify(e.to_dict()), e.status
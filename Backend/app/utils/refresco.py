@@ -0,0 +1,111 @@
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.decorators import make_json_serializable
+from app.models.dashboard import DashboardItem, ResultadoItem
+from app.models.tablas import MetaTabla
+from app.utils.dashboards import tabla_item, datos_item_cacheado
+from app.utils.rollups import sincronizar_rollups
+from app.utils.limites import aplicar_limite, limite_de
+
+
+def _siguiente_pendiente():
+    """
+    Bloquea el próximo item vencido. SKIP LOCKED permite que varios procesos
+    corran el refresco sin calcular dos veces el mismo item.
+    """
+    return db.session.execute(text("""
+        SELECT id FROM dashboard_items
+        WHERE refresh_interval > 0
+          AND (last_refresh IS NULL
+               OR last_refresh + make_interval(secs => refresh_interval) <= :ahora)
+        ORDER BY last_refresh NULLS FIRST
+        LIMIT 1
+        FOR UPDATE SKIP LOCKED
+    """), {"ahora": datetime.utcnow()}).scalar()
+
+
+def refrescar_item(app, item):
+    """Recalcula un item y guarda el resultado; no hace commit"""
+    meta_tabla = MetaTabla.query.get(item.table_id)
+    resultado = ResultadoItem.query.get(item.id) or ResultadoItem(item_id=item.id)
+    inicio = time.perf_counter()
+    try:
+        table = tabla_item(meta_tabla.nombre_tabla) if meta_tabla else None
+        if table is None:
+            raise LookupError("Tabla no encontrada")
+        with db.session.begin_nested():
+            datos, _ = datos_item_cacheado(app, meta_tabla, item, table)
+        resultado.datos = make_json_serializable(datos)
+        resultado.error = None
+    except Exception as e:
+        resultado.error = str(e)
+    resultado.version_tabla = meta_tabla.version if meta_tabla else 0
+    resultado.calculado_en = datetime.utcnow()
+    resultado.ms = round((time.perf_counter() - inicio) * 1000, 1)
+    item.last_refresh = resultado.calculado_en
+    db.session.add(resultado)
+    return resultado
+
+
+def refrescar_pendientes(app, maximo=50):
+    """Refresca hasta `maximo` items vencidos, con un commit por item. Devuelve cuántos"""
+    refrescados = 0
+    # Un item mal configurado no debe trabar la pasada: mismo límite que los dashboards
+    with app.app_context(), aplicar_limite(limite_de(app, 'dashboard')):
+        try:
+            while refrescados < maximo:
+                item_id = _siguiente_pendiente()
+                if item_id is None:
+                    break
+                refrescar_item(app, DashboardItem.query.get(item_id))
+                db.session.commit()
+                refrescados += 1
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+    return refrescados
+
+
+_hilo = None
+_lock = threading.Lock()
+
+
+def iniciar_refresco(app):
+    """
+    Arranca (una vez por proceso) el hilo que cada DASHBOARD_REFRESH_TICK
+    segundos sincroniza los rollups (ROLLUPS_ENABLED) y refresca los items
+    vencidos (DASHBOARD_REFRESH_ENABLED). Cada tarea se apaga por separado.
+    """
+    global _hilo
+    rollups = app.config.get('ROLLUPS_ENABLED', True)
+    refresco = app.config.get('DASHBOARD_REFRESH_ENABLED', True)
+    with _lock:
+        if _hilo is not None or not (rollups or refresco):
+            return _hilo
+
+        intervalo = app.config.get('DASHBOARD_REFRESH_TICK', 15)
+
+        def ciclo():
+            while True:
+                if rollups:
+                    try:
+                        sincronizar_rollups(app)
+                    except Exception as e:
+                        app.logger.warning(f"Sincronización de rollups falló: {e}")
+                if refresco:
+                    try:
+                        refrescar_pendientes(app)
+                    except Exception as e:
+                        app.logger.warning(f"Refresco de dashboards falló: {e}")
+                time.sleep(intervalo)
+
+        _hilo = threading.Thread(target=ciclo, name='refresco-dashboards', daemon=True)
+        _hilo.start()
+        return _hilo
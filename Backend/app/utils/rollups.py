@@ -0,0 +1,219 @@
+import hashlib
+
+from sqlalchemy import text
+
+from app.extensions import db
+from app.models.dashboard import DashboardItem, Rollup
+from app.models.tablas import MetaTabla
+from app.utils.esquemas import esquema_registrado
+from app.utils.graficos import GRANULARIDADES, elegir_granularidad, filas_estimadas
+from app.utils.tipos import ORDEN_FECHA, ORDEN_NUMERICO
+
+
+# Las series temporales se preagregan por hora: sirven para hour, day, week...
+NIVEL_TEMPORAL = 'hour'
+TIPOS_ORDENABLES = ORDEN_NUMERICO + ORDEN_FECHA + ['TEXT', 'ENUM']
+
+
+def combinacion_item(item, esquema):
+    """
+    (columna_x, columna_y, nivel) que necesita un item chart/kpi sin filtros,
+    o None si el item no se puede responder desde un rollup.
+    """
+    if item.filters:
+        return None
+    config = item.config or {}
+    if item.item_type == "chart":
+        x = config.get("x") or config.get("x_axis")
+        y = config.get("y") or config.get("y_axis")
+        if x not in esquema.columnas or y not in esquema.columnas:
+            return None
+        temporal = esquema.columnas[x].nombre in ORDEN_FECHA
+        return x, y, NIVEL_TEMPORAL if item.chart_type == "line" and temporal else ''
+    if item.item_type == "kpi":
+        y = config.get("column")
+        return ('', y, '') if y in esquema.columnas else None
+    return None
+
+
+def _nombre_vista(tabla_id, x, y, nivel):
+    firma = hashlib.md5(f"{x}|{y}|{nivel}".encode()).hexdigest()[:12]
+    return f"rollup_{tabla_id}_{firma}"
+
+
+def _crear_vista(rollup, nombre_tabla, esquema):
+    x, y = rollup.columna_x, rollup.columna_y
+    tipo_y = esquema.columnas[y].nombre
+    if not x:
+        grupo = 'NULL::int'
+    elif rollup.nivel:
+        grupo = f"date_trunc('{rollup.nivel}', \"{x}\")"
+    else:
+        grupo = f'"{x}"'
+    suma = f'SUM("{y}")' if tipo_y in ORDEN_NUMERICO else 'NULL::numeric'
+    minimo, maximo = (f'MIN("{y}")', f'MAX("{y}")') if tipo_y in TIPOS_ORDENABLES else ('NULL', 'NULL')
+
+    db.session.execute(text(f'DROP MATERIALIZED VIEW IF EXISTS "{rollup.vista}"'))
+    db.session.execute(text(f'''
+        CREATE MATERIALIZED VIEW "{rollup.vista}" AS
+        SELECT {grupo} AS grupo, COUNT(*) AS n, COUNT("{y}") AS n_y,
+               {suma} AS s, {minimo} AS mn, {maximo} AS mx
+        FROM "{nombre_tabla}"
+        GROUP BY 1
+    '''))
+    # Índice único: permite REFRESH ... CONCURRENTLY sin bloquear lecturas
+    db.session.execute(text(f'CREATE UNIQUE INDEX ON "{rollup.vista}" (grupo)'))
+
+
+def _refrescar(rollup_id, app):
+    """Crea o refresca un rollup desactualizado; un commit por rollup"""
+    rollup = Rollup.query.filter_by(id=rollup_id).with_for_update(skip_locked=True).first()
+    if rollup is None:
+        return False  # otro proceso lo está refrescando
+    meta_tabla = MetaTabla.query.get(rollup.tabla_id)
+    # La versión se lee antes de agregar: si hay una escritura en medio, el
+    # rollup queda con una versión vieja y se vuelve a refrescar (nunca al revés)
+    version = meta_tabla.version
+    if rollup.version_tabla == version:
+        db.session.rollback()
+        return False
+
+    try:
+        if rollup.version_tabla < 0:
+            _crear_vista(rollup, meta_tabla.nombre_tabla, esquema_registrado(meta_tabla.nombre_tabla))
+        else:
+            db.session.execute(text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY "{rollup.vista}"'))
+        rollup.version_tabla = version
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        app.logger.warning(f"Rollup {rollup_id}: {e}")
+        return False
+
+
+def sincronizar_rollups(app):
+    """
+    Alinea los rollups con las configuraciones de DashboardItem: crea los de
+    combinaciones (tabla, x, y, nivel) usadas sobre tablas grandes, borra los
+    que ya nadie usa y refresca los que quedaron atrás de MetaTabla.version.
+    """
+    minimo = app.config.get('ROLLUP_MIN_FILAS', 100000)
+    with app.app_context():
+        try:
+            items = DashboardItem.query.filter(DashboardItem.item_type.in_(("chart", "kpi"))).all()
+            metas = {m.id: m for m in MetaTabla.query.filter(
+                MetaTabla.id.in_({i.table_id for i in items})
+            ).all()} if items else {}
+
+            necesarias = set()
+            grandes = {}
+            for item in items:
+                meta_tabla = metas.get(item.table_id)
+                if meta_tabla is None:
+                    continue
+                if meta_tabla.id not in grandes:
+                    grandes[meta_tabla.id] = filas_estimadas(meta_tabla.nombre_tabla) >= minimo
+                esquema = esquema_registrado(meta_tabla.nombre_tabla)
+                combinacion = combinacion_item(item, esquema) if grandes[meta_tabla.id] and esquema else None
+                if combinacion:
+                    necesarias.add((meta_tabla.id, *combinacion))
+
+            existentes = {(r.tabla_id, r.columna_x, r.columna_y, r.nivel): r for r in Rollup.query.all()}
+            for clave, rollup in existentes.items():
+                if clave not in necesarias:
+                    db.session.execute(text(f'DROP MATERIALIZED VIEW IF EXISTS "{rollup.vista}"'))
+                    db.session.delete(rollup)
+            for clave in necesarias - set(existentes):
+                tabla_id, x, y, nivel = clave
+                db.session.add(Rollup(
+                    tabla_id=tabla_id, columna_x=x, columna_y=y, nivel=nivel,
+                    vista=_nombre_vista(tabla_id, x, y, nivel), version_tabla=-1
+                ))
+            db.session.commit()
+
+            pendientes = db.session.execute(text("""
+                SELECT r.id FROM rollups r JOIN meta_tabla m ON m.id = r.tabla_id
+                WHERE r.version_tabla <> m.version
+            """)).scalars().all()
+            return sum(1 for rollup_id in pendientes if _refrescar(rollup_id, app))
+        except Exception:
+            db.session.rollback()
+            raise
+        finally:
+            db.session.remove()
+
+
+def eliminar_rollups(tabla):
+    """
+    Borra las vistas materializadas de rollup que dependen de la tabla (y su
+    registro): Postgres no deja alterar ni borrar columnas usadas por una
+    vista. El siguiente ciclo de sincronización las vuelve a crear.
+    """
+    vistas = db.session.execute(text("""
+        SELECT DISTINCT c.relname
+        FROM pg_depend d
+        JOIN pg_rewrite r ON r.oid = d.objid
+        JOIN pg_class c ON c.oid = r.ev_class
+        WHERE d.refobjid = to_regclass(:tabla)
+          AND c.relkind = 'm'
+          AND c.relname LIKE 'rollup\\_%'
+    """), {"tabla": f'"{tabla}"'}).scalars().all()
+    for vista in vistas:
+        db.session.execute(text(f'DROP MATERIALIZED VIEW IF EXISTS "{vista}"'))
+    if vistas:
+        db.session.execute(text("DELETE FROM rollups WHERE vista = ANY(:vistas)"), {"vistas": list(vistas)})
+
+
+def rollups_vigentes(tabla_ids):
+    """
+    {(tabla_id, x, y, nivel): vista} de los rollups al día con la versión de
+    esas tablas, en una sola consulta (las tablas chicas no tienen ninguno).
+    """
+    if not tabla_ids:
+        return {}
+    filas = db.session.execute(text("""
+        SELECT r.tabla_id, r.columna_x, r.columna_y, r.nivel, r.vista
+        FROM rollups r JOIN meta_tabla m ON m.id = r.tabla_id
+        WHERE r.tabla_id = ANY(:tablas) AND r.version_tabla = m.version
+    """), {"tablas": list(tabla_ids)}).fetchall()
+    return {(t, x, y, nivel): vista for t, x, y, nivel, vista in filas}
+
+
+def _agregado(agg_func, numerica):
+    """Re-agregación sobre las filas del rollup equivalente a agg(y) sobre la tabla"""
+    if agg_func in ("SUM", "AVG") and not numerica:
+        agg_func = "COUNT"
+    return {
+        "AVG": "SUM(s) / NULLIF(SUM(n_y), 0)",
+        "COUNT": "COALESCE(SUM(n_y), 0)::bigint",
+        "MAX": "MAX(mx)",
+        "MIN": "MIN(mn)",
+    }.get(agg_func, "SUM(s)")
+
+
+def chart_desde_rollup(vista, agg_func, numerica, granularidad=None, puntos=None):
+    """
+    [{label, value}] de un chart leyendo el rollup. Con x temporal se agrupa
+    por date_trunc a la granularidad pedida o elegida; None si es más fina
+    que la del rollup (se calcula en vivo).
+    """
+    expresion = _agregado(agg_func, numerica)
+    if granularidad is False:
+        sql = f'SELECT grupo AS label, {expresion} AS value FROM "{vista}" GROUP BY grupo'
+        filas = db.session.execute(text(sql)).fetchall()
+    else:
+        if granularidad and granularidad not in GRANULARIDADES:
+            raise ValueError(f"Granularidad inválida, use una de: {', '.join(GRANULARIDADES)}")
+        granularidad = granularidad or elegir_granularidad(vista, "grupo", int(puntos or 500))
+        if granularidad == 'minute':
+            return None
+        sql = (f'SELECT date_trunc(:g, grupo) AS label, {expresion} AS value '
+               f'FROM "{vista}" GROUP BY 1 ORDER BY 1')
+        filas = db.session.execute(text(sql), {"g": granularidad}).fetchall()
+    return [{"label": label, "value": value} for label, value in filas]
+
+
+def kpi_desde_rollup(vista, agg_func, numerica):
+    sql = f'SELECT {_agregado(agg_func, numerica)} FROM "{vista}"'
+    return {"value": db.session.execute(text(sql)).scalar()}
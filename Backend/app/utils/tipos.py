@@ -0,0 +1,517 @@
+import re
+import threading
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, text
+from app.extensions import db
+
+
+# Máximo de valores distintos para codificar una columna de texto como ENUM
+MAX_CATEGORIAS = 64
+# Postgres limita las etiquetas de un ENUM a 63 bytes
+MAX_BYTES_ETIQUETA = 63
+
+VALORES_BOOLEANOS = {
+    'true': True, 't': True, 'yes': True, 'y': True, 'si': True, 'sí': True,
+    'false': False, 'f': False, 'no': False, 'n': False,
+}
+
+PATRON_FECHA = r'^\d{1,4}[-/.]\d{1,2}[-/.]\d{1,4}'
+# Partes de una fecha escrita como texto: a sep b sep c y el resto (la hora)
+PATRON_PARTES_FECHA = r'^(\d{1,4})([-/.])(\d{1,2})[-/.](\d{1,4})(.*)$'
+PATRON_HORA = re.compile(r'^([ T])\d{1,2}:\d{2}(:\d{2}(\.\d+)?)?(\s*)(Z|[+-]\d{2}:?\d{2})?$')
+
+ORDEN_NUMERICO = ['SMALLINT', 'INTEGER', 'BIGINT', 'NUMERIC', 'DOUBLE PRECISION']
+ORDEN_FECHA = ['DATE', 'TIMESTAMP', 'TIMESTAMPTZ']
+
+RANGOS_ENTEROS = {
+    'SMALLINT': (-2 ** 15, 2 ** 15 - 1),
+    'INTEGER': (-2 ** 31, 2 ** 31 - 1),
+    'BIGINT': (-2 ** 63, 2 ** 63 - 1),
+}
+
+
+class TipoColumna:
+    """
+    Tipo Postgres elegido para una columna; los ENUM guardan sus etiquetas y
+    las fechas escritas como texto el formato (strptime) detectado en la muestra.
+    """
+
+    def __init__(self, nombre, valores=None, formato=None):
+        self.nombre = nombre
+        self.valores = set(valores) if valores is not None else None
+        self.formato = formato
+
+    @property
+    def es_enum(self):
+        return self.nombre == 'ENUM'
+
+    def __eq__(self, otro):
+        return (
+            isinstance(otro, TipoColumna)
+            and self.nombre == otro.nombre
+            and self.valores == otro.valores
+        )
+
+    def __repr__(self):
+        if self.es_enum:
+            return f"ENUM({len(self.valores)})"
+        return self.nombre
+
+
+def nombre_enum(tabla, columna):
+    """Nombre del tipo ENUM de una columna (los identificadores tienen 63 bytes)"""
+    return f"enum_{tabla}_{columna}"[:63]
+
+
+def sql_tipo(tabla, columna, tipo):
+    if tipo.es_enum:
+        return f'"{nombre_enum(tabla, columna)}"'
+    return tipo.nombre
+
+
+def _texto(serie):
+    """Valores como texto sin espacios; vacíos y nulos quedan como NaN"""
+    texto = serie.where(serie.notna()).astype(str).str.strip()
+    return texto.where(serie.notna() & (texto != ''))
+
+
+def _tipo_entero(minimo, maximo):
+    for nombre in ('SMALLINT', 'INTEGER', 'BIGINT'):
+        bajo, alto = RANGOS_ENTEROS[nombre]
+        if bajo <= minimo and maximo <= alto:
+            return TipoColumna(nombre)
+    return TipoColumna('NUMERIC')
+
+
+def _tipo_decimal(numeros):
+    """Enteros, NUMERIC si hay hasta 4 decimales (importes) o DOUBLE PRECISION"""
+    if not np.isfinite(numeros).all():
+        return TipoColumna('DOUBLE PRECISION')
+    if (numeros % 1 == 0).all():
+        return _tipo_entero(numeros.min(), numeros.max())
+    for decimales in range(1, 5):
+        if (numeros.round(decimales) == numeros).all():
+            return TipoColumna('NUMERIC')
+    return TipoColumna('DOUBLE PRECISION')
+
+
+def _tipo_fecha(fechas):
+    if getattr(fechas.dt, 'tz', None) is not None:
+        return TipoColumna('TIMESTAMPTZ')
+    if (fechas == fechas.dt.normalize()).all():
+        return TipoColumna('DATE')
+    return TipoColumna('TIMESTAMP')
+
+
+def _formato_hora(resto):
+    if not resto:
+        return ''
+    partes = PATRON_HORA.match(resto)
+    if partes is None:
+        return None
+    separador, segundos, fraccion, espacio, zona = partes.groups()
+    return (
+        separador + '%H:%M' + (':%S' if segundos else '') + ('.%f' if fraccion else '')
+        + (espacio + '%z' if zona else '')
+    )
+
+
+def formato_fecha(texto):
+    """
+    Formato strptime común a todas las fechas de texto, o None si se mezclan
+    formatos o no se puede saber si van día/mes o mes/día (ningún valor, o
+    valores de los dos órdenes, tienen un componente mayor que 12).
+    """
+    partes = texto.str.extract(PATRON_PARTES_FECHA)
+    if texto.empty or partes[0].isna().any():
+        return None
+    primero, separador, segundo, tercero, resto = (partes[i] for i in range(5))
+    if separador.nunique() != 1:
+        return None
+    horas = set(resto.map(_formato_hora))
+    if None in horas:
+        return None
+    sep = separador.iloc[0]
+
+    largo_primero, largo_tercero = primero.str.len(), tercero.str.len()
+    if (largo_primero == 4).all() and (largo_tercero <= 2).all():
+        if len(horas) > 1:
+            # ISO 8601 con y sin hora en la misma columna: el orden no es ambiguo
+            return 'ISO8601' if sep == '-' else None
+        return f'%Y{sep}%m{sep}%d{horas.pop()}'
+    if len(horas) != 1:
+        return None
+    hora = horas.pop()
+    if (largo_primero <= 2).all() and largo_tercero.isin([2, 4]).all() and largo_tercero.nunique() == 1:
+        anio = '%Y' if largo_tercero.iloc[0] == 4 else '%y'
+        dia_primero = bool((primero.astype(int) > 12).any())
+        mes_primero = bool((segundo.astype(int) > 12).any())
+        if dia_primero == mes_primero:
+            return None
+        orden = f'%d{sep}%m' if dia_primero else f'%m{sep}%d'
+        return f'{orden}{sep}{anio}{hora}'
+    return None
+
+
+def _leer_fechas(texto, formato):
+    """pd.to_datetime con el formato fijado; None si pandas no puede unificarlas (zonas mezcladas)"""
+    try:
+        return pd.to_datetime(texto, format=formato, errors='coerce')
+    except ValueError:
+        return None
+
+
+def fijar_formatos(tipos, muestra):
+    """
+    Completa el formato de las columnas de fecha de una tabla existente
+    (tipos_tabla no lo conoce) a partir de la muestra del archivo entrante,
+    para que todos sus bloques se lean con el mismo orden día/mes.
+    """
+    for col, tipo in tipos.items():
+        if tipo.nombre not in ORDEN_FECHA or tipo.formato or col not in muestra.columns:
+            continue
+        if pd.api.types.is_datetime64_any_dtype(muestra[col]):
+            continue
+        texto = _texto(muestra[col]).dropna()
+        if not texto.empty:
+            tipo.formato = formato_fecha(texto)
+
+
+def _es_enum(valores, total):
+    return (
+        len(valores) <= MAX_CATEGORIAS
+        and len(valores) * 2 <= total
+        and all(len(v.encode('utf-8')) <= MAX_BYTES_ETIQUETA for v in valores)
+    )
+
+
+def inferir_tipo(serie):
+    """
+    Elige el tipo más compacto que admite todos los valores no nulos de la
+    muestra. Devuelve None si la columna no tiene valores.
+    """
+    serie = serie.dropna()
+    if serie.empty:
+        return None
+
+    if pd.api.types.is_bool_dtype(serie):
+        return TipoColumna('BOOLEAN')
+    if pd.api.types.is_integer_dtype(serie):
+        return _tipo_entero(serie.min(), serie.max())
+    if pd.api.types.is_float_dtype(serie):
+        return _tipo_decimal(serie)
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return _tipo_fecha(serie)
+
+    texto = _texto(serie).dropna()
+    if texto.empty:
+        return None
+
+    if texto.str.lower().isin(VALORES_BOOLEANOS.keys()).all():
+        return TipoColumna('BOOLEAN')
+
+    # Números escritos como texto; los ceros a la izquierda (códigos) quedan como texto
+    numeros = pd.to_numeric(texto, errors='coerce')
+    if numeros.notna().all() and not texto.str.match(r'^[+-]?0\d').any():
+        return _tipo_decimal(numeros.astype(float))
+
+    if texto.str.match(PATRON_FECHA).all():
+        # El formato se fija una vez con la muestra; si es ambiguo queda como texto
+        formato = formato_fecha(texto)
+        if formato is None:
+            return TipoColumna('TEXT')
+        fechas = _leer_fechas(texto, formato)
+        # Con zonas horarias mezcladas no hay un tipo común: se deja como texto
+        if fechas is not None and pd.api.types.is_datetime64_any_dtype(fechas) and fechas.notna().all():
+            tipo = _tipo_fecha(fechas)
+            tipo.formato = formato
+            return tipo
+
+    valores = set(texto.unique())
+    if _es_enum(valores, len(texto)):
+        return TipoColumna('ENUM', valores)
+
+    return TipoColumna('TEXT')
+
+
+def inferir_tipos(muestra):
+    """Tipo por columna a partir de una muestra; columnas sin datos quedan como TEXT"""
+    return {
+        col: inferir_tipo(muestra[col]) or TipoColumna('TEXT')
+        for col in muestra.columns
+    }
+
+
+def combinar(actual, nuevo):
+    """Tipo más estrecho que admite los valores de ambos"""
+    if actual is None:
+        return nuevo
+    if nuevo is None:
+        return actual
+    if actual.nombre in ORDEN_FECHA and nuevo.nombre in ORDEN_FECHA:
+        # Dos formatos distintos (p.ej. día/mes y mes/día) no se mezclan en una columna
+        formatos = {actual.formato, nuevo.formato} - {None}
+        if len(formatos) > 1:
+            return TipoColumna('TEXT')
+        mayor = max(actual, nuevo, key=lambda t: ORDEN_FECHA.index(t.nombre))
+        return TipoColumna(mayor.nombre, formato=formatos.pop() if formatos else None)
+    if actual == nuevo:
+        return actual
+    if actual.nombre in ORDEN_NUMERICO and nuevo.nombre in ORDEN_NUMERICO:
+        return max(actual, nuevo, key=lambda t: ORDEN_NUMERICO.index(t.nombre))
+    if actual.es_enum and nuevo.es_enum:
+        valores = actual.valores | nuevo.valores
+        if len(valores) <= MAX_CATEGORIAS:
+            return TipoColumna('ENUM', valores)
+    return TipoColumna('TEXT')
+
+
+def convertir_serie(serie, tipo):
+    """
+    Convierte la serie al formato que COPY espera para el tipo.
+    Devuelve (serie_convertida, valida); valida=False si algún valor no encaja.
+    Las fechas de texto se leen con tipo.formato; sin formato sólo se aceptan
+    si el de la serie no es ambiguo.
+    """
+    nombre = tipo.nombre
+    if nombre == 'TEXT':
+        return serie, True
+
+    if nombre == 'BOOLEAN':
+        if pd.api.types.is_bool_dtype(serie):
+            return serie, True
+        texto = _texto(serie)
+        convertida = texto.str.lower().map(VALORES_BOOLEANOS)
+        return convertida, bool(convertida[texto.notna()].notna().all())
+
+    if nombre in ORDEN_NUMERICO:
+        if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+            numeros, presentes = serie, serie.notna()
+        else:
+            texto = _texto(serie)
+            numeros, presentes = pd.to_numeric(texto, errors='coerce'), texto.notna()
+        valida = bool(numeros[presentes].notna().all())
+        no_nulos = numeros.dropna()
+        if nombre in RANGOS_ENTEROS:
+            bajo, alto = RANGOS_ENTEROS[nombre]
+            valida = valida and bool((no_nulos % 1 == 0).all() and no_nulos.between(bajo, alto).all())
+            return (numeros.astype('Int64') if valida else numeros), valida
+        if nombre == 'NUMERIC':
+            valida = valida and bool(np.isfinite(no_nulos.astype(float)).all())
+        return numeros, valida
+
+    if nombre in ORDEN_FECHA:
+        if pd.api.types.is_datetime64_any_dtype(serie):
+            fechas = serie
+            presentes = serie.notna()
+            valida = True
+        else:
+            texto = _texto(serie)
+            presentes = texto.notna()
+            valida = bool(texto[presentes].str.match(PATRON_FECHA).all())
+            formato = tipo.formato or formato_fecha(texto[presentes])
+            if formato is None:
+                return texto, not presentes.any()
+            fechas = _leer_fechas(texto, formato)
+            if fechas is None or not pd.api.types.is_datetime64_any_dtype(fechas):
+                return serie, False
+        valida = valida and bool(fechas[presentes].notna().all())
+        tiene_tz = getattr(fechas.dt, 'tz', None) is not None
+        if nombre == 'DATE':
+            no_nulas = fechas.dropna()
+            valida = valida and not tiene_tz and bool((no_nulas == no_nulas.dt.normalize()).all())
+            return fechas.dt.strftime('%Y-%m-%d'), valida
+        if nombre == 'TIMESTAMP':
+            valida = valida and not tiene_tz
+        return fechas, valida
+
+    if tipo.es_enum:
+        texto = _texto(serie)
+        return texto, bool(texto.dropna().isin(tipo.valores).all())
+
+    return serie, True
+
+
+def convertir_bloque(df, tipos):
+    """Convierte todas las columnas; devuelve (df_convertido, columnas_que_no_encajan)"""
+    convertidas = {}
+    invalidas = []
+    for col in df.columns:
+        tipo = tipos.get(col)
+        if tipo is None:
+            continue
+        serie, valida = convertir_serie(df[col], tipo)
+        if not valida:
+            invalidas.append(col)
+        convertidas[col] = serie
+    return df.assign(**convertidas), invalidas
+
+
+def ampliar_tipo(actual, serie):
+    """Tipo que admite la columna actual y los valores nuevos de la serie"""
+    if actual.es_enum:
+        valores = actual.valores | set(_texto(serie).dropna().unique())
+        if len(valores) <= MAX_CATEGORIAS and all(
+            len(v.encode('utf-8')) <= MAX_BYTES_ETIQUETA for v in valores
+        ):
+            return TipoColumna('ENUM', valores)
+        return TipoColumna('TEXT')
+
+    nuevo = combinar(actual, inferir_tipo(serie))
+    if nuevo == actual:
+        # La inferencia dice que encaja pero la conversión falló: ir a lo seguro
+        return TipoColumna('TEXT')
+    return nuevo
+
+
+def _ejecutar_ddl(sql):
+    """DDL con literales (etiquetas de ENUM) sin pasar por el parser de text()"""
+    cursor = db.session.connection().connection.cursor()
+    try:
+        cursor.execute(sql)
+    finally:
+        cursor.close()
+
+
+def _literal(valor):
+    return "'" + valor.replace("'", "''") + "'"
+
+
+def crear_enum(nombre, valores):
+    etiquetas = ', '.join(_literal(v) for v in sorted(valores))
+    _ejecutar_ddl(f'CREATE TYPE "{nombre}" AS ENUM ({etiquetas})')
+
+
+def alterar_columna(tabla, columna, actual, nuevo):
+    """Cambia el tipo de una columna existente (no hace commit)"""
+    # rollups importa este módulo: se importa aquí para no crear un ciclo
+    from app.utils.rollups import eliminar_rollups
+
+    invalidar_al_terminar(tabla)
+    eliminar_rollups(tabla)
+    if nuevo.es_enum:
+        # ADD VALUE no se puede usar en la misma transacción: se recrea el tipo
+        nombre = nombre_enum(tabla, columna)
+        temporal = nombre[:59] + '_tmp'
+        crear_enum(temporal, nuevo.valores)
+        _ejecutar_ddl(
+            f'ALTER TABLE "{tabla}" ALTER COLUMN "{columna}" '
+            f'TYPE "{temporal}" USING "{columna}"::text::"{temporal}"'
+        )
+        _ejecutar_ddl(f'DROP TYPE IF EXISTS "{nombre}"')
+        _ejecutar_ddl(f'ALTER TYPE "{temporal}" RENAME TO "{nombre}"')
+        return
+
+    conversion = f'"{columna}"::text::{nuevo.nombre}' if actual.es_enum else f'"{columna}"::{nuevo.nombre}'
+    _ejecutar_ddl(
+        f'ALTER TABLE "{tabla}" ALTER COLUMN "{columna}" TYPE {nuevo.nombre} USING {conversion}'
+    )
+    if actual.es_enum:
+        _ejecutar_ddl(f'DROP TYPE IF EXISTS "{nombre_enum(tabla, columna)}"')
+
+
+def ajustar_bloque(tabla, tipos, bloque):
+    """
+    Convierte el bloque a los tipos de la tabla. Si alguna columna no encaja
+    (valor fuera de rango, etiqueta nueva, texto en columna numérica...) se
+    amplía su tipo con ALTER TABLE y se actualiza `tipos`.
+    """
+    convertido, invalidas = convertir_bloque(bloque, tipos)
+    if not invalidas:
+        return convertido
+
+    for col in invalidas:
+        nuevo = ampliar_tipo(tipos[col], bloque[col])
+        alterar_columna(tabla, col, tipos[col], nuevo)
+        tipos[col] = nuevo
+
+    convertido, _ = convertir_bloque(bloque, tipos)
+    return convertido
+
+
+# Nombres de format_type() de Postgres a los tipos que maneja la inferencia
+TIPOS_POSTGRES = {
+    'smallint': 'SMALLINT',
+    'integer': 'INTEGER',
+    'bigint': 'BIGINT',
+    'numeric': 'NUMERIC',
+    'double precision': 'DOUBLE PRECISION',
+    'boolean': 'BOOLEAN',
+    'date': 'DATE',
+    'timestamp without time zone': 'TIMESTAMP',
+    'timestamp with time zone': 'TIMESTAMPTZ',
+    'text': 'TEXT',
+    'character varying': 'TEXT',
+}
+
+
+def tipos_tabla(tabla):
+    """Tipos actuales de las columnas de una tabla existente (sin la columna id)"""
+    filas = db.session.execute(text("""
+        SELECT a.attname,
+               format_type(a.atttypid, a.atttypmod) AS tipo,
+               t.typtype,
+               ARRAY(SELECT e.enumlabel FROM pg_enum e WHERE e.enumtypid = t.oid) AS etiquetas
+        FROM pg_attribute a
+        JOIN pg_type t ON t.oid = a.atttypid
+        WHERE a.attrelid = to_regclass(:tabla)
+          AND a.attnum > 0
+          AND NOT a.attisdropped
+          AND a.attname <> 'id'
+        ORDER BY a.attnum
+    """), {"tabla": f'"{tabla}"'}).all()
+
+    tipos = {}
+    for nombre, tipo, typtype, etiquetas in filas:
+        if typtype == 'e':
+            tipos[nombre] = TipoColumna('ENUM', etiquetas)
+        else:
+            base = tipo.split('(')[0]
+            tipos[nombre] = TipoColumna(TIPOS_POSTGRES.get(base, base.upper()))
+    return tipos
+
+
+# Segundos que un esquema cacheado sirve sin releerlo. La invalidación sólo
+# llega al proceso que hizo el ALTER/DROP: el TTL acota cuánto tardan en
+# enterarse los demás workers.
+TTL_ESQUEMA = 30
+
+_esquemas = {}  # tabla -> (tipos, instante en que se leyeron)
+_esquemas_lock = threading.Lock()
+
+
+def esquema_tabla(tabla):
+    """tipos_tabla() cacheado por proceso durante TTL_ESQUEMA; se invalida al crear, alterar o eliminar"""
+    ahora = time.monotonic()
+    with _esquemas_lock:
+        tipos, leido = _esquemas.get(tabla, (None, 0.0))
+    if tipos is None or ahora - leido > TTL_ESQUEMA:
+        tipos = tipos_tabla(tabla)
+        with _esquemas_lock:
+            _esquemas[tabla] = (tipos, ahora)
+    return tipos
+
+
+def invalidar_esquema(tabla):
+    with _esquemas_lock:
+        _esquemas.pop(tabla, None)
+
+
+def invalidar_al_terminar(tabla):
+    """
+    Invalida el esquema cuando termine la transacción en curso (commit o
+    rollback). Invalidarlo antes dejaría que otro hilo vuelva a cachear los
+    tipos viejos mientras el ALTER/DROP todavía no está confirmado.
+    """
+    db.session().info.setdefault('esquemas_a_invalidar', set()).add(tabla)
+
+
+def _al_terminar_transaccion(sesion, transaccion):
+    if transaccion.parent is None:
+        for tabla in sesion.info.pop('esquemas_a_invalidar', ()):
+            invalidar_esquema(tabla)
+
+
+event.listen(db.session, 'after_transaction_end', _al_terminar_transaccion)
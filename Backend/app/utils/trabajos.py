@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from app.extensions import db
+
+
+class IngestaCancelada(Exception):
+    """Se lanza dentro del trabajo cuando el usuario pidió cancelarlo"""
+
+
+class TrabajoIngesta:
+    """Estado y progreso de una carga de archivo que corre en segundo plano"""
+
+    def __init__(self, usuario_id, nombre_tabla, ruta, extension, opciones=None):
+        self.id = uuid.uuid4().hex
+        self.usuario_id = usuario_id
+        self.nombre_tabla = nombre_tabla
+        self.ruta = ruta
+        self.extension = extension
+        self.opciones = opciones or {}
+
+        self.estado = 'pendiente'  # pendiente, en_proceso, completado, error, cancelado
+        self.filas_procesadas = 0
+        self.bytes_totales = os.path.getsize(ruta) if os.path.exists(ruta) else 0
+        self.bytes_leidos = 0
+        # Estimación de filas totales cuando el formato la ofrece (p.ej. xlsx)
+        self.filas_totales = None
+        self.resultado = None
+        self.error = None
+
+        self.creado = datetime.utcnow()
+        self.inicio = None
+        self.fin = None
+
+        self._cancelar = threading.Event()
+        self._future = None
+
+    def avanzar(self, filas, bytes_leidos=None):
+        """Registra un bloque procesado y corta la carga si se pidió cancelar"""
+        self.filas_procesadas += filas
+        if bytes_leidos is not None:
+            self.bytes_leidos = bytes_leidos
+        if self._cancelar.is_set():
+            raise IngestaCancelada("Carga cancelada por el usuario")
+
+    def cancelar(self):
+        """Pide la cancelación; si aún no empezó se descarta directamente"""
+        self._cancelar.set()
+        if self._future is not None and self._future.cancel():
+            self._finalizar('cancelado')
+            _borrar_archivo(self.ruta)
+
+    @property
+    def terminado(self):
+        return self.estado in ('completado', 'error', 'cancelado')
+
+    def _finalizar(self, estado, resultado=None, error=None):
+        self.estado = estado
+        self.resultado = resultado
+        self.error = error
+        self.fin = time.monotonic()
+
+    def to_dict(self):
+        transcurrido = None
+        filas_por_segundo = None
+        progreso = None
+        eta = None
+
+        if self.inicio is not None:
+            transcurrido = (self.fin or time.monotonic()) - self.inicio
+            if transcurrido > 0:
+                filas_por_segundo = round(self.filas_procesadas / transcurrido, 1)
+
+        if self.estado == 'completado':
+            progreso = 1.0
+            eta = 0
+        else:
+            if self.filas_totales:
+                progreso = min(self.filas_procesadas / self.filas_totales, 1.0)
+            elif self.bytes_totales and self.bytes_leidos:
+                progreso = min(self.bytes_leidos / self.bytes_totales, 1.0)
+            if transcurrido and progreso:
+                eta = round(transcurrido * (1 - progreso) / progreso, 1)
+
+        return {
+            "id": self.id,
+            "estado": self.estado,
+            "tabla": self.nombre_tabla,
+            "filas_procesadas": self.filas_procesadas,
+            "filas_por_segundo": filas_por_segundo,
+            "progreso": round(progreso, 4) if progreso is not None else None,
+            "eta_segundos": eta,
+            "segundos_transcurridos": round(transcurrido, 1) if transcurrido is not None else None,
+            "resultado": self.resultado,
+            "error": self.error,
+            "creado": self.creado.isoformat(),
+        }
+
+
+_trabajos = {}
+_lock = threading.Lock()
+_executor = None
+
+# Trabajos terminados se conservan este tiempo para poder consultar su resultado
+RETENCION_SEGUNDOS = 3600
+
+
+def _obtener_executor(app):
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=app.config.get('UPLOAD_WORKERS', 2),
+                thread_name_prefix='ingesta'
+            )
+        return _executor
+
+
+def _borrar_archivo(ruta):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
+
+
+def _purgar_terminados():
+    ahora = time.monotonic()
+    for trabajo_id, trabajo in list(_trabajos.items()):
+        if trabajo.terminado and trabajo.fin and ahora - trabajo.fin > RETENCION_SEGUNDOS:
+            del _trabajos[trabajo_id]
+
+
+def lanzar_trabajo(app, trabajo, funcion):
+    """
+    Registra el trabajo y ejecuta funcion(trabajo) en el pool de workers,
+    dentro de un contexto de aplicación propio. El valor devuelto por la
+    función queda como resultado del trabajo.
+    """
+    def ejecutar():
+        with app.app_context():
+            trabajo.estado = 'en_proceso'
+            trabajo.inicio = time.monotonic()
+            try:
+                resultado = funcion(trabajo)
+                trabajo._finalizar('completado', resultado=resultado)
+            except IngestaCancelada as e:
+                trabajo._finalizar('cancelado', error=str(e))
+            except Exception as e:
+                trabajo._finalizar('error', error=str(e))
+            finally:
+                db.session.remove()
+                _borrar_archivo(trabajo.ruta)
+
+    with _lock:
+        _purgar_terminados()
+        _trabajos[trabajo.id] = trabajo
+    trabajo._future = _obtener_executor(app).submit(ejecutar)
+    return trabajo
+
+
+def obtener_trabajo(trabajo_id):
+    with _lock:
+        return _trabajos.get(trabajo_id)
@@ -0,0 +1,28 @@
+"""add version to meta_tabla
+
+Revision ID: 5c1d7e2a9f34
+Revises: ffa2d9923edd
+Create Date: 2026-10-18 10:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c1d7e2a9f34'
+down_revision: Union[str, Sequence[str], None] = 'ffa2d9923edd'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('meta_tabla', sa.Column('version', sa.Integer(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('meta_tabla', 'version')
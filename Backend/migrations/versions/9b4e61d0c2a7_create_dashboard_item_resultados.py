@@ -0,0 +1,37 @@
+"""create dashboard_item_resultados
+
+Revision ID: 9b4e61d0c2a7
+Revises: 5c1d7e2a9f34
+Create Date: 2026-10-18 11:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9b4e61d0c2a7'
+down_revision: Union[str, Sequence[str], None] = '5c1d7e2a9f34'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('dashboard_item_resultados',
+    sa.Column('item_id', sa.Integer(), nullable=False),
+    sa.Column('datos', sa.JSON(), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('version_tabla', sa.Integer(), nullable=False),
+    sa.Column('calculado_en', sa.DateTime(), nullable=False),
+    sa.Column('ms', sa.Float(), nullable=True),
+    sa.ForeignKeyConstraint(['item_id'], ['dashboard_items.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('item_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('dashboard_item_resultados')
@@ -0,0 +1,50 @@
+"""create rollups
+
+Revision ID: e3f0a8c51b62
+Revises: 9b4e61d0c2a7
+Create Date: 2026-10-18 12:00:00
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e3f0a8c51b62'
+down_revision: Union[str, Sequence[str], None] = '9b4e61d0c2a7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tabla_id', sa.Integer(), nullable=False),
+    sa.Column('columna_x', sa.String(length=100), nullable=False),
+    sa.Column('columna_y', sa.String(length=100), nullable=False),
+    sa.Column('nivel', sa.String(length=20), nullable=False),
+    sa.Column('vista', sa.String(length=63), nullable=False),
+    sa.Column('version_tabla', sa.Integer(), nullable=False),
+    sa.Column('creado_en', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['tabla_id'], ['meta_tabla.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tabla_id', 'columna_x', 'columna_y', 'nivel'),
+    sa.UniqueConstraint('vista')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("""
+        DO $$
+        DECLARE v text;
+        BEGIN
+            FOR v IN SELECT vista FROM rollups LOOP
+                EXECUTE format('DROP MATERIALIZED VIEW IF EXISTS %I', v);
+            END LOOP;
+        END $$
+    """)
+    op.drop_table('rollups')
@@ -0,0 +1,44 @@
+import pytest
+from flask import Flask
+from sqlalchemy import Column, Float, Integer, MetaData, String, Table
+
+from app.extensions import db
+from app.models.dashboard import Dashboard  # noqa: F401 (registra los modelos para create_all)
+from app.models.tablas import MetaTabla  # noqa: F401
+from app.utils import cache, dashboards
+
+
+VENTAS = Table(
+    "ventas", MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("region", String),
+    Column("monto", Float),
+)
+
+
+@pytest.fixture
+def app_ventas(tmp_path, monkeypatch):
+    """
+    App sobre SQLite en archivo (los hilos del pool abren sus propias
+    conexiones) con la tabla de datos 'ventas'. El registro de esquemas y el
+    de rollups leen catálogos de Postgres: se reemplazan por la tabla conocida
+    y por "sin rollups"; el resto del cálculo corre de verdad.
+    """
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI=f"sqlite:///{tmp_path / 'datos.db'}", DASHBOARD_WORKERS=4)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        VENTAS.create(db.engine)
+        db.session.execute(VENTAS.insert(), [
+            {"region": "norte", "monto": 10.0},
+            {"region": "norte", "monto": 20.0},
+            {"region": "sur", "monto": 5.0},
+        ])
+        db.session.commit()
+
+    monkeypatch.setattr(dashboards, "tabla_item", lambda nombre: VENTAS if nombre == "ventas" else None)
+    monkeypatch.setattr(dashboards, "rollups_vigentes", lambda tabla_ids: {})
+    monkeypatch.setattr(dashboards, "_executor", None)
+    monkeypatch.setattr(cache, "_cache", None)
+    return app
@@ -0,0 +1,71 @@
+import math
+import statistics
+
+import pytest
+
+from app.utils.aproximado import _estimar, fraccion_muestra
+
+
+# Muestra conocida: los valores de y de las filas que cayeron en la muestra
+MUESTRA = [2.0, 4.0, 4.0, 5.0, 7.0, 9.0, 11.0, 14.0]
+N = len(MUESTRA)
+SUMA = sum(MUESTRA)
+SUMA_CUADRADOS = sum(v * v for v in MUESTRA)
+DESVIACION = statistics.stdev(MUESTRA)
+Z = 1.959963984540054  # 95 %
+
+
+def _estimar_muestra(agregado, p):
+    return _estimar(agregado, p, N, SUMA, SUMA_CUADRADOS, DESVIACION, Z)
+
+
+def test_fraccion_para_el_error_objetivo():
+    fraccion, z = fraccion_muestra(1_000_000, 0.05, 0.95)
+    assert z == pytest.approx(Z)
+    assert fraccion == pytest.approx((Z / 0.05) ** 2 / 1_000_000)
+
+
+def test_fraccion_grande_se_calcula_exacto():
+    # Harían falta ~1537 filas de 2000: muestrear no ahorra nada
+    assert fraccion_muestra(2000, 0.05, 0.95)[0] == 1.0
+
+
+@pytest.mark.parametrize("error, confianza", [(0, 0.95), (1, 0.95), (0.05, 0), (0.05, 1)])
+def test_fraccion_valida_parametros(error, confianza):
+    with pytest.raises(ValueError):
+        fraccion_muestra(1000, error, confianza)
+
+
+def test_count_horvitz_thompson():
+    valor, (bajo, alto) = _estimar_muestra('count', 0.1)
+    error_estandar = math.sqrt(N * 0.9) / 0.1
+    assert valor == pytest.approx(80.0)
+    assert bajo == pytest.approx(80.0 - Z * error_estandar)
+    assert alto == pytest.approx(80.0 + Z * error_estandar)
+
+
+def test_sum_horvitz_thompson():
+    valor, (bajo, alto) = _estimar_muestra('sum', 0.1)
+    error_estandar = math.sqrt(0.9 * SUMA_CUADRADOS) / 0.1
+    assert valor == pytest.approx(560.0)
+    assert alto - valor == pytest.approx(Z * error_estandar)
+    assert valor - bajo == pytest.approx(Z * error_estandar)
+
+
+def test_avg_con_correccion_por_poblacion_finita():
+    valor, (bajo, alto) = _estimar_muestra('avg', 0.25)
+    error_estandar = DESVIACION / math.sqrt(N) * math.sqrt(0.75)
+    assert valor == pytest.approx(7.0)
+    assert alto - bajo == pytest.approx(2 * Z * error_estandar)
+
+
+@pytest.mark.parametrize("agregado, exacto", [('count', N), ('sum', SUMA), ('avg', SUMA / N)])
+def test_muestra_completa_el_intervalo_colapsa(agregado, exacto):
+    valor, (bajo, alto) = _estimar_muestra(agregado, 1.0)
+    assert valor == pytest.approx(exacto)
+    assert bajo == pytest.approx(exacto)
+    assert alto == pytest.approx(exacto)
+
+
+def test_avg_sin_filas():
+    assert _estimar('avg', 0.1, 0, None, None, None, Z) == (None, [None, None])
@@ -0,0 +1,65 @@
+import threading
+import time
+
+import pytest
+
+from app.utils import limites
+from app.utils.cache import CacheResultados
+from app.utils.limites import ConsultaInterrumpida, LimiteConsultas
+
+
+def _dueno_bloqueado(cache, error):
+    """Hilo que toma la clave 'k' y termina con `error` cuando se libera el evento"""
+    seguir = threading.Event()
+    resultado = {}
+
+    def calcular():
+        seguir.wait(5)
+        raise error
+
+    def correr():
+        try:
+            cache.obtener_o_calcular("k", calcular)
+        except ConsultaInterrumpida as e:
+            resultado["error"] = e
+
+    hilo = threading.Thread(target=correr)
+    hilo.start()
+    while not cache.estadisticas()["en_vuelo"]:
+        time.sleep(0.01)
+    return hilo, seguir, resultado
+
+
+def test_la_cancelacion_del_dueno_no_llega_a_quien_espera():
+    cache = CacheResultados(1024 * 1024)
+    hilo, seguir, dueno = _dueno_bloqueado(cache, ConsultaInterrumpida("dashboard", 1000, cancelada=True))
+
+    esperado = {}
+    otro = threading.Thread(target=lambda: esperado.update(r=cache.obtener_o_calcular("k", lambda: 42)))
+    otro.start()
+    while not cache.coalescidas:
+        time.sleep(0.01)
+    seguir.set()
+    hilo.join(5)
+    otro.join(5)
+
+    assert dueno["error"].cancelada
+    # Quien esperaba recalcula por su cuenta en vez de recibir un 499
+    assert esperado["r"] == (42, False)
+
+
+def test_la_espera_respeta_el_limite_propio():
+    cache = CacheResultados(1024 * 1024)
+    hilo, seguir, _ = _dueno_bloqueado(cache, ConsultaInterrumpida("chart", None))
+
+    token = limites._actual.set(LimiteConsultas("chart", 50))
+    try:
+        inicio = time.monotonic()
+        with pytest.raises(ConsultaInterrumpida) as error:
+            cache.obtener_o_calcular("k", lambda: 42)
+        assert time.monotonic() - inicio < 2
+        assert not error.value.cancelada
+    finally:
+        limites._actual.reset(token)
+        seguir.set()
+        hilo.join(5)
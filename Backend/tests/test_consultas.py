@@ -0,0 +1,41 @@
+from app.utils import consultas
+from app.utils.consultas import condicion_keyset, construir_select
+from app.utils.tipos import TipoColumna
+
+
+def test_cursor_por_id_es_un_range_scan():
+    sql, params = condicion_keyset([('id', True)], [10], 'next')
+    assert sql == '"id" > :k0'
+    assert params == {"k0": 10}
+
+
+def test_cursor_por_id_hacia_atras():
+    sql, params = condicion_keyset([('id', True)], [10], 'prev')
+    assert sql == '"id" < :k0'
+    assert params == {"k0": 10}
+
+
+def test_columna_nullable_conserva_la_rama_null():
+    sql, params = condicion_keyset([('fecha', True), ('id', True)], ['2024-01-01', 7], 'next')
+    assert sql == (
+        '(("fecha" > :k0 OR "fecha" IS NULL) OR ("fecha" = :k0 AND "id" > :k1))'
+    )
+    assert params == {"k0": '2024-01-01', "k1": 7}
+
+
+def test_select_con_columnas_extra_y_condiciones(monkeypatch):
+    # Nombres con ' FROM ' y ' WHERE ': la consulta no se arma reemplazando texto
+    tipos = {"id": TipoColumna("INTEGER"), "a FROM b": TipoColumna("TEXT"), "x WHERE y": TipoColumna("INTEGER")}
+    monkeypatch.setattr(consultas, "columnas_tabla", lambda tabla: tipos)
+
+    sql, params, seleccion, _ = construir_select(
+        "ventas WHERE", ["a FROM b"], {"x WHERE y": 3},
+        extra=["x WHERE y", "id", "a FROM b"], condiciones=[('"id" > :k0', {"k0": 10})]
+    )
+
+    assert sql == (
+        'SELECT "a FROM b", "x WHERE y", "id" FROM "ventas WHERE" '
+        'WHERE "x WHERE y" = :f0 AND "id" > :k0'
+    )
+    assert params == {"f0": 3, "k0": 10}
+    assert seleccion == ["a FROM b"]
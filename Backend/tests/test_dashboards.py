@@ -0,0 +1,71 @@
+import threading
+from types import SimpleNamespace
+
+from app.models.dashboard import DashboardItem
+from app.utils import dashboards
+
+
+def _meta(tabla_id, nombre, usuario_id=7):
+    return SimpleNamespace(id=tabla_id, usuario_id=usuario_id, nombre_tabla=nombre, version=1)
+
+
+def _item(item_id, table_id=1, item_type="chart", **config):
+    return DashboardItem(
+        id=item_id, dashboard_id=1, table_id=table_id, item_type=item_type,
+        chart_type="bar" if item_type == "chart" else None, config=config, filters=None
+    )
+
+
+def test_evaluar_items_sobre_una_tabla(app_ventas):
+    metas = {1: _meta(1, "ventas"), 2: _meta(2, "borrada"), 3: _meta(3, "ajena", usuario_id=8)}
+    items = [
+        _item(1, x="region", y="monto", agg="SUM"),
+        _item(2, item_type="kpi", column="monto", agg="SUM"),
+        _item(3, item_type="kpi", column="monto", agg="COUNT"),
+        _item(4, item_type="kpi", column="no_existe"),
+        _item(5, x="region", y="no_existe"),
+        _item(6, table_id=2, x="region", y="monto"),
+        _item(7, table_id=3, x="region", y="monto"),
+        _item(8, table_id=9, x="region", y="monto"),
+    ]
+
+    resultados = {r["item_id"]: r for r in dashboards.evaluar_items(app_ventas, items, metas, usuario_id=7)}
+
+    assert resultados[1]["status"] == 200 and not resultados[1]["cached"]
+    assert sorted((d["label"], d["value"]) for d in resultados[1]["data"]) == [("norte", 30.0), ("sur", 5.0)]
+    # Los KPI con los mismos filtros se resuelven en un solo SELECT; el inválido informa su error
+    assert resultados[2]["data"] == {"value": 35.0}
+    assert resultados[3]["data"] == {"value": 3}
+    assert resultados[2]["combined"] == 2
+    assert (resultados[4]["status"], resultados[4]["error"]) == (400, "Columna inválida")
+    assert (resultados[5]["status"], resultados[5]["error"]) == (400, "Columnas inválidas")
+    assert (resultados[6]["status"], resultados[6]["error"]) == (404, "Tabla no encontrada")
+    assert resultados[7]["status"] == 403
+    assert resultados[8]["status"] == 404
+
+    # Segunda pasada: chart y KPI salen de la cache de resultados
+    otra = {r["item_id"]: r for r in dashboards.evaluar_items(app_ventas, items, metas, usuario_id=7)}
+    assert otra[1]["cached"] and otra[1]["data"] == resultados[1]["data"]
+    assert otra[2]["cached"] and otra[3]["cached"]
+    assert otra[4]["status"] == 400
+
+
+def test_items_de_una_misma_tabla_corren_en_paralelo(app_ventas, monkeypatch):
+    items = [_item(i, x="region", y="monto") for i in range(1, 4)]
+
+    # Cada item espera a los otros dos: si se evaluaran uno tras otro la barrera vencería
+    barrera = threading.Barrier(len(items), timeout=5)
+    hilos = set()
+
+    def datos(app, meta_tabla, item, table, aproximado=None, rollups=None):
+        hilos.add(threading.get_ident())
+        barrera.wait()
+        return {"value": item.id}, False
+
+    monkeypatch.setattr(dashboards, "datos_item_cacheado", datos)
+
+    resultados = dashboards.evaluar_items(app_ventas, items, {1: _meta(1, "ventas")}, usuario_id=7)
+
+    assert [r["status"] for r in resultados] == [200, 200, 200]
+    assert [r["data"] for r in resultados] == [{"value": 1}, {"value": 2}, {"value": 3}]
+    assert len(hilos) == len(items)
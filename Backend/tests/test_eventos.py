@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+from app.extensions import db
+from app.models.dashboard import Dashboard, DashboardItem
+from app.models.tablas import MetaTabla
+from app.utils import eventos
+
+
+def _preparar(monkeypatch):
+    # Sin hilo de cálculo: sólo interesa el registro de canales
+    monkeypatch.setattr(eventos.CanalDashboard, "_ciclo", lambda self: None)
+    monkeypatch.setattr(eventos, "_canales", {})
+    return SimpleNamespace(config={})
+
+
+def test_el_canal_se_descarta_con_el_ultimo_suscriptor(monkeypatch):
+    app = _preparar(monkeypatch)
+    canal = eventos.canal_dashboard(app, 1, 7)
+    primero, segundo = eventos.flujo_sse(canal), eventos.flujo_sse(canal)
+    next(primero), next(segundo)
+
+    primero.close()
+    assert eventos._canales == {(1, 7): canal}
+
+    segundo.close()
+    assert eventos._canales == {}
+    assert eventos.canal_dashboard(app, 1, 7) is not canal
+
+
+def test_un_canal_descartado_se_vuelve_a_registrar_al_suscribirse(monkeypatch):
+    app = _preparar(monkeypatch)
+    canal = eventos.canal_dashboard(app, 1, 7)
+    anterior = eventos.flujo_sse(canal)
+    next(anterior)
+    anterior.close()
+
+    # El cliente pidió el canal antes de que se descartara y empieza a leer después
+    flujo = eventos.flujo_sse(canal)
+    next(flujo)
+    assert eventos._canales == {(1, 7): canal}
+    assert len(canal.suscriptores) == 1
+    flujo.close()
+
+
+def test_el_stream_termina_si_el_canal_descarta_la_cola(monkeypatch):
+    app = _preparar(monkeypatch)
+    canal = eventos.canal_dashboard(app, 1, 7)
+    flujo = eventos.flujo_sse(canal)
+    next(flujo)
+
+    # Cliente que no lee: la cola se llena y el canal la descarta
+    for i in range(1001):
+        canal._publicar({"item_id": i, "data": None, "error": None, "status": 200})
+
+    # Lo que quedó en la cola se descarta: al reconectar llega la foto de `ultimos`
+    assert list(flujo) == []
+    assert eventos._canales == {}
+
+
+def test_una_pasada_publica_los_resultados_y_recalcula_los_editados(app_ventas):
+    with app_ventas.app_context():
+        meta = MetaTabla(nombre_tabla="ventas", usuario_id=7)
+        dash = Dashboard(title="Ventas", user_id=7)
+        db.session.add_all([meta, dash])
+        db.session.flush()
+        grafico = DashboardItem(dashboard_id=dash.id, table_id=meta.id, item_type="chart",
+                                chart_type="bar", config={"x": "region", "y": "monto"})
+        kpi = DashboardItem(dashboard_id=dash.id, table_id=meta.id, item_type="kpi", config={"column": "otra"})
+        db.session.add_all([grafico, kpi])
+        db.session.commit()
+        dash_id, grafico_id, kpi_id = dash.id, grafico.id, kpi.id
+
+    canal = eventos.CanalDashboard(app_ventas, dash_id, 7, tick=5)
+    assert canal._pasada()
+    assert canal.ultimos[grafico_id]["status"] == 200
+    assert sorted((d["label"], d["value"]) for d in canal.ultimos[grafico_id]["data"]) == [
+        ("norte", 30.0), ("sur", 5.0)
+    ]
+    assert (canal.ultimos[kpi_id]["status"], canal.ultimos[kpi_id]["error"]) == (400, "Columna inválida")
+
+    # Sin refresh_interval no se recalcula... salvo que se edite el item
+    with app_ventas.app_context():
+        db.session.get(DashboardItem, kpi_id).config = {"column": "monto"}
+        db.session.commit()
+    assert canal._pasada()
+    assert canal.ultimos[kpi_id] == {"item_id": kpi_id, "data": {"value": 35.0}, "error": None, "status": 200}
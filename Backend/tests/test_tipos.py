@@ -0,0 +1,79 @@
+import pandas as pd
+
+from app.utils.tipos import TipoColumna, ampliar_tipo, combinar, convertir_serie, inferir_tipo
+
+
+def _fechas(valores):
+    return pd.Series(valores, dtype=object)
+
+
+def test_dia_primero():
+    tipo = inferir_tipo(_fechas(["13/01/2024", "02/03/2024"]))
+    assert tipo.nombre == "DATE"
+    assert tipo.formato == "%d/%m/%Y"
+
+    convertida, valida = convertir_serie(_fechas(["02/03/2024"]), tipo)
+    assert valida
+    assert list(convertida) == ["2024-03-02"]
+
+
+def test_mes_primero():
+    tipo = inferir_tipo(_fechas(["01/13/2024", "03/02/2024"]))
+    assert tipo.nombre == "DATE"
+    assert tipo.formato == "%m/%d/%Y"
+
+    convertida, valida = convertir_serie(_fechas(["03/02/2024"]), tipo)
+    assert valida
+    assert list(convertida) == ["2024-03-02"]
+
+
+def test_bloque_posterior_se_lee_con_el_formato_de_la_muestra():
+    tipo = inferir_tipo(_fechas(["25/12/2023", "01/02/2024"]))
+    # "01/02/2024" sola sería ambigua: vale el día/mes detectado en la muestra
+    convertida, valida = convertir_serie(_fechas(["01/02/2024"]), tipo)
+    assert valida
+    assert list(convertida) == ["2024-02-01"]
+
+    # Un 13 en la posición del mes no encaja con día/mes
+    _, valida = convertir_serie(_fechas(["01/13/2024"]), tipo)
+    assert not valida
+
+
+def test_fechas_ambiguas_quedan_como_texto():
+    # Ningún componente mayor que 12: no se sabe si es día/mes o mes/día
+    assert inferir_tipo(_fechas(["01/02/2024", "03/04/2024"])).nombre == "TEXT"
+    # Los dos órdenes en la misma columna
+    assert inferir_tipo(_fechas(["13/01/2024", "01/13/2024"])).nombre == "TEXT"
+
+
+def test_iso_con_y_sin_hora():
+    tipo = inferir_tipo(_fechas(["2024-01-02", "2024-01-03 10:30:00"]))
+    assert tipo.nombre == "TIMESTAMP"
+    assert tipo.formato == "ISO8601"
+
+
+def test_formatos_distintos_entre_bloques_no_se_combinan():
+    dia_mes = TipoColumna("DATE", formato="%d/%m/%Y")
+    mes_dia = TipoColumna("DATE", formato="%m/%d/%Y")
+    assert combinar(dia_mes, mes_dia).nombre == "TEXT"
+    assert combinar(dia_mes, TipoColumna("TIMESTAMP", formato="%d/%m/%Y")).nombre == "TIMESTAMP"
+
+
+def test_ampliacion_entero_numeric_texto_entre_bloques():
+    tipo = inferir_tipo(pd.Series([1, 2, 3]))
+    assert tipo.nombre == "SMALLINT"
+
+    # Segundo bloque con decimales: no encaja en el entero y se amplía a NUMERIC
+    bloque = pd.Series([2.25, 4.5])
+    _, valida = convertir_serie(bloque, tipo)
+    assert not valida
+    tipo = ampliar_tipo(tipo, bloque)
+    assert tipo.nombre == "NUMERIC"
+    assert convertir_serie(bloque, tipo)[1]
+
+    # Tercer bloque con texto: sólo TEXT admite todo
+    bloque = pd.Series(["abc", "def"], dtype=object)
+    _, valida = convertir_serie(bloque, tipo)
+    assert not valida
+    tipo = ampliar_tipo(tipo, bloque)
+    assert tipo.nombre == "TEXT"
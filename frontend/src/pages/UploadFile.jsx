@@ -44,7 +44,7 @@ export default function UploadFile({onUpload}) {
         />
         <input 
           type="file" 
-          accept=".csv, .xlsx"
+          accept=".csv, .xlsx, .parquet, .arrow, .feather, .ipc"
           onChange={(e) => setFile(e.target.files[0])} 
         />
         <button type="submit">Subir</button>
@@ -2,13 +2,22 @@ import axios from "axios";
 
 const API_URL = "http://localhost:5001"; 
 
-export const getChartData = async (tabla, tipo, x, y, token, startDate, endDate) => {
+// opciones: { maxPoints, metodo } para dispersión, { bins } para histograma,
+// { aproximado: true, error } para una vista previa por muestreo (pastel/barras/lineas),
+// { granularidad: "hour"|"day"|"week"|"month" } para líneas sobre fechas
+export const getChartData = async (tabla, tipo, x, y, token, startDate, endDate, opciones = {}) => {
   const params = new URLSearchParams({ 
     tipo,
     ...(x && { x }), // Parámetros condicionales
     ...(y && { y }),
     ...(startDate && { start: startDate }),
-    ...(endDate && { end: endDate })
+    ...(endDate && { end: endDate }),
+    ...(opciones.maxPoints && { max_points: opciones.maxPoints }),
+    ...(opciones.metodo && { metodo: opciones.metodo }),
+    ...(opciones.bins && { bins: opciones.bins }),
+    ...(opciones.aproximado && { aproximado: 1 }),
+    ...(opciones.error && { error: opciones.error }),
+    ...(opciones.granularidad && { granularidad: opciones.granularidad })
   });
 
   const res = await axios.get(`${API_URL}/graficar/${tabla}?${params.toString()}`, {
@@ -23,6 +32,7 @@ export const getChartData = async (tabla, tipo, x, y, token, startDate, endDate)
   return {
     tipo: res.data.tipo,
     datos: res.data.datos,
+    aproximado: res.data.aproximado,
     rawData: res.data // Guardamos los datos crudos para posibles reprocesamientos
   };
   };
\ No newline at end of file
@@ -97,6 +97,70 @@ export async function getItemData(dashId, itemId, token) {
   }
 }
 
+// Datos de todos los widgets en una sola petición:
+// { items: [{ item_id, data, error, status, ms, cached }], errores, ms }
+export async function getDashboardData(dashId, token) {
+  try {
+    const res = await axios.get(`${API_URL}/dashboards/${dashId}/data`, { headers: authHeader(token) });
+    return res.data;
+  } catch (err) {
+    throw handleError(err);
+  }
+}
+
+// Actualizaciones en vivo por Server-Sent Events. Se usa fetch (y no EventSource)
+// para poder mandar el header Authorization. onItem recibe { item_id, data, error, status };
+// onError (opcional) recibe el mensaje si el servidor rechaza el stream (403/404...).
+// fetch no reconecta solo: si el servidor cierra el stream se vuelve a abrir
+// tras el "retry:" que indica. Devuelve una función para cerrar el stream.
+export function streamDashboard(dashId, token, onItem, onError) {
+  const controller = new AbortController();
+  let retry = 5000;
+
+  const conectar = async () => {
+    const res = await fetch(`${API_URL}/dashboards/${dashId}/stream`, {
+      headers: authHeader(token),
+      signal: controller.signal
+    });
+    if (!res.ok) {
+      const body = await res.json().catch(() => ({}));
+      throw new Error(body.error || `Error ${res.status} al abrir el stream`);
+    }
+    const reader = res.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = "";
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buffer += decoder.decode(value, { stream: true });
+      const eventos = buffer.split("\n\n");
+      buffer = eventos.pop();
+      for (const evento of eventos) {
+        const lineas = evento.split("\n");
+        const espera = lineas.find((l) => l.startsWith("retry: "));
+        if (espera) retry = Number(espera.slice(7)) || retry;
+        const linea = lineas.find((l) => l.startsWith("data: "));
+        if (linea) onItem(JSON.parse(linea.slice(6)));
+      }
+    }
+    // El servidor cerró el stream (p.ej. cliente lento descartado): se reconecta
+    setTimeout(() => {
+      if (!controller.signal.aborted) conectar().catch(fallo);
+    }, retry);
+  };
+
+  const fallo = (err) => {
+    if (err.name === "AbortError") return;
+    if (onError) onError(err.message);
+    else console.error("Stream del dashboard:", err);
+  };
+
+  conectar().catch(fallo);
+
+  return () => controller.abort();
+}
+
 export async function getValidColumns(tablaId, chartType, token) {
   try {
     const res = await axios.get(
@@ -92,6 +92,19 @@ export async function deleteComparison(compId, token) {
   }
 }
 
+// 🔹 Obtener un escenario completo (el listado no incluye data_snapshot)
+export async function getScenario(compId, scenarioId, token) {
+  try {
+    const res = await axios.get(
+      `${API_URL}/${compId}/scenarios/${scenarioId}`,
+      { headers: authHeader(token) }
+    );
+    return res.data;
+  } catch (err) {
+    throw handleError(err);
+  }
+}
+
 // 🔹 Eliminar escenario
 export async function deleteScenario(compId, scenarioId, token) {
   try {
@@ -20,6 +20,20 @@ export const getTableData = async (token, tablaId, limit = 10, offset = 0) => {
 };
 
 
+// Paginación por cursor: cursor vacío = primera página; la respuesta trae
+// cursor.siguiente / cursor.anterior para navegar.
+// opciones: { columnas: ["a", "b"], orden: "-fecha,monto", filtros: [...] }
+export const getTableDataPage = async (token, tablaId, limit = 10, cursor = "", opciones = {}) => {
+  const params = new URLSearchParams({ limit, cursor });
+  if (opciones.columnas?.length) params.set("columnas", opciones.columnas.join(","));
+  if (opciones.orden) params.set("orden", opciones.orden);
+  if (opciones.filtros?.length) params.set("filtros", JSON.stringify(opciones.filtros));
+  const res = await axios.get(`${API_URL}/datos/${tablaId}?${params.toString()}`, {
+    headers: { Authorization: `Bearer ${token}` }
+  });
+  return res.data;
+};
+
 export const deleteTableById = async (tablaId, token) => {
   return axios.delete(`${API_URL}/tablas/${tablaId}`, {
     headers: { Authorization: `Bearer ${token}` },
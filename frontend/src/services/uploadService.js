@@ -2,7 +2,25 @@ import axios from "axios";
 
 const API_URL = "http://localhost:5001"; 
 
-export const uploadFile = async (token, file, nombreTabla) => {
+const POLL_INTERVAL_MS = 1000;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+export const getUploadJob = async (token, jobId) => {
+  const res = await axios.get(`${API_URL}/upload/jobs/${jobId}`, {
+    headers: { Authorization: `Bearer ${token}` }
+  });
+  return res.data;
+};
+
+export const cancelUploadJob = async (token, jobId) => {
+  const res = await axios.delete(`${API_URL}/upload/jobs/${jobId}`, {
+    headers: { Authorization: `Bearer ${token}` }
+  });
+  return res.data;
+};
+
+export const uploadFile = async (token, file, nombreTabla, onProgress) => {
   const formData = new FormData();
   formData.append("file", file);
   formData.append("nombre_tabla", nombreTabla);
@@ -14,5 +32,20 @@ export const uploadFile = async (token, file, nombreTabla) => {
     }
   });
 
-  return res.data; 
+  // La carga corre en segundo plano: consultar el trabajo hasta que termine
+  const jobId = res.data.job_id;
+  while (true) {
+    const job = await getUploadJob(token, jobId);
+    if (onProgress) onProgress(job);
+
+    if (job.estado === "completado") {
+      return job.resultado;
+    }
+    if (job.estado === "error" || job.estado === "cancelado") {
+      const err = new Error(job.error || "Error al subir archivo");
+      err.response = { data: { error: job.error } };
+      throw err;
+    }
+    await sleep(POLL_INTERVAL_MS);
+  }
 };